@@ -2,15 +2,22 @@
 # BIBLIOTECAS
 # ==============================
 import streamlit as st
-from PIL import Image, ImageDraw, ImageFont
-import base64
-import qrcode
-import re
-import io
+from PIL import Image
 import zipfile
 import os
-from barcode import Code39
-from barcode.writer import ImageWriter
+import json
+import io
+import functools
+from escritor_pdf import escrever_pdf, validar_codificacao, CODIFICACAO_PADRAO
+from pdf_vetorial import escrever_pdf_vetorial
+from imposicao import FOLHAS_MM, IMPOSICAO_PADRAO, Imposicao
+from instrumentacao import medir
+from cache_disco import CacheComandas
+from arquivo_imagens import escrever_zip_imagens, nomes_paginas
+from tarefas import GestorTarefas, EM_FILA, A_GERAR, CONCLUIDA, CANCELADA
+from verificacao import RelatorioVerificacao, verificar_paginas
+from layout import ConfigQrCode, ConfigCodigoBarras, Layout
+from motor import MODO_QRCODE, MODO_BARRAS, aplicar_mascara_qrcode, gerar_imagem_qrcode, gerar_imagem_barcode, gerar_paginas, listar_fontes, draw_rulers_and_guides, escalar_config
 
 # ==============================
 # CONFIGURAÇÃO DA PÁGINA
@@ -23,199 +30,216 @@ st.set_page_config(page_title="Gerador de Comandas")
 
 @st.cache_data
 def carregar_fontes_disponiveis(pasta_fontes="fonts"):
-    """
-    Verifica uma pasta, lê os ficheiros .ttf e retorna um dicionário
-    mapeando o nome real da fonte para o seu caminho.
-    """
-    fontes = {}
-    if not os.path.isdir(pasta_fontes):
-        return fontes
-
-    for nome_ficheiro in os.listdir(pasta_fontes):
-        if nome_ficheiro.lower().endswith('.ttf'):
-            caminho_completo = os.path.join(pasta_fontes, nome_ficheiro)
-            try:
-                font = ImageFont.truetype(caminho_completo, size=10)
-                nome_real = " ".join(font.getname())
-                fontes[nome_real] = caminho_completo
-            except Exception:
-                nome_fallback = os.path.splitext(nome_ficheiro)[0]
-                fontes[nome_fallback] = caminho_completo
-    return fontes
-
-def carregar_fonte(caminho_fonte, tamanho):
-    """Carrega a fonte a partir de um caminho de ficheiro local."""
-    try:
-        return ImageFont.truetype(caminho_fonte, tamanho)
-    except FileNotFoundError:
-        st.error(f"Erro: O ficheiro da fonte '{caminho_fonte}' não foi encontrado.")
-        return None
-    except Exception as e:
-        st.error(f"Ocorreu um erro ao carregar a fonte: {e}")
-        return None
+    """Versão em cache de motor.listar_fontes, lida uma única vez por sessão do servidor."""
+    return listar_fontes(pasta_fontes)
 
 # ===================================================================
-# FUNÇÃO: Desenhar Réguas e Guias
+# PRÉ-VISUALIZAÇÃO
 # ===================================================================
-def draw_rulers_and_guides(image, guides, ruler_size=30):
-    """
-    Desenha réguas e linhas-guia numa imagem.
-    """
-    original_width, original_height = image.size
-    new_width = original_width + ruler_size
-    new_height = original_height + ruler_size
+# Cada interação volta a correr o script inteiro. O template é descodificado
+# uma única vez por upload e a pré-visualização é desenhada numa cópia
+# reduzida à largura do ecrã; as posições dos sliders continuam em px do
+# template e são convertidas com a escala (ver motor.escalar_config).
 
-    ruler_canvas = Image.new('RGB', (new_width, new_height), '#f0f2f6')
-    ruler_canvas.paste(image, (ruler_size, ruler_size))
-
-    draw = ImageDraw.Draw(ruler_canvas)
-    try:
-        ruler_font = ImageFont.truetype("arial.ttf", 10)
-    except IOError:
-        ruler_font = ImageFont.load_default()
-
-    # --- Régua Horizontal ---
-    for x in range(0, original_width, 10):
-        pos_x = x + ruler_size
-        if x % 100 == 0:
-            draw.line([(pos_x, 0), (pos_x, ruler_size)], fill='black', width=1)
-            text = str(x)
-            text_bbox = draw.textbbox((0, 0), text, font=ruler_font)
-            text_w = text_bbox[2] - text_bbox[0]
-            draw.text((pos_x - text_w // 2, 5), text, fill='black', font=ruler_font)
-        elif x % 50 == 0:
-            draw.line([(pos_x, ruler_size // 2), (pos_x, ruler_size)], fill='gray', width=1)
-        else:
-            draw.line([(pos_x, ruler_size * 3 // 4), (pos_x, ruler_size)], fill='lightgray', width=1)
-
-    # --- Régua Vertical ---
-    for y in range(0, original_height, 10):
-        pos_y = y + ruler_size
-        if y % 100 == 0:
-            draw.line([(0, pos_y), (ruler_size, pos_y)], fill='black', width=1)
-            text = str(y)
-            text_bbox = draw.textbbox((0, 0), text, font=ruler_font)
-            text_h = text_bbox[3] - text_bbox[1]
-            draw.text((5, pos_y - text_h // 2), text, fill='black', font=ruler_font)
-        elif y % 50 == 0:
-            draw.line([(ruler_size // 2, pos_y), (ruler_size, pos_y)], fill='gray', width=1)
-        else:
-            draw.line([(ruler_size * 3 // 4, pos_y), (ruler_size, pos_y)], fill='lightgray', width=1)
-
-    # --- Guias ---
-    for guide_type, positions in guides.items():
-        color = positions['color']
-        if 'x' in positions:
-            guide_x = positions['x'] + ruler_size
-            draw.line([(guide_x, 0), (guide_x, new_height)], fill=color, width=1)
-        if 'y' in positions:
-            guide_y = positions['y'] + ruler_size
-            draw.line([(0, guide_y), (new_width, guide_y)], fill=color, width=1)
-
-    return ruler_canvas
+LARGURA_PREVIEW = 900
 
+@st.cache_resource(max_entries=4, show_spinner=False)
+def carregar_template(chave_upload, _upload):
+    """
+    Descodifica o upload identificado por `chave_upload` e devolve
+    (largura, altura, template reduzido em RGB, escala da redução).
+    """
+    _upload.seek(0)
+    template = Image.open(_upload)
+    largura, altura = template.size
+    escala = min(1.0, LARGURA_PREVIEW / largura)
+    tamanho_preview = (max(1, round(largura * escala)), max(1, round(altura * escala)))
+    template.draft("RGB", tamanho_preview)  # JPEG: descodifica já reduzido
+    reduzido = template.convert("RGBA").convert("RGB")
+    if reduzido.size != tamanho_preview:
+        reduzido = reduzido.resize(tamanho_preview, Image.Resampling.LANCZOS)
+    return largura, altura, reduzido, escala
 
 # ===================================================================
-# SEÇÃO 1: LÓGICA DO GERADOR DE QR CODE
+# EXPORTAÇÃO EM SEGUNDO PLANO
 # ===================================================================
-
-def aplicar_mascara_qrcode(documento, tipo):
-    numeros = re.sub(r'\D', '', documento)
-    if tipo == 'CPF' and len(numeros) > 0:
-        numeros = numeros[:11]
-        mascara = '{}.{}.{}-{}'.format(numeros[0:3], numeros[3:6], numeros[6:9], numeros[9:11]) if len(numeros) == 11 else numeros
-    elif tipo == 'CNPJ' and len(numeros) > 0:
-        numeros = numeros[:14]
-        mascara = '{}.{}.{}/{}-{}'.format(numeros[0:2], numeros[2:5], numeros[5:8], numeros[8:12], numeros[12:14]) if len(numeros) == 14 else numeros
-    else:
-        mascara = numeros
-    return mascara + ':'
-
-def gerar_qrcode(numero, dado_base, tamanho, rotacao_qr):
-    texto_original = f"{dado_base}{numero}"
-    base64_encoded = base64.b64encode(texto_original.encode()).decode()
-    url = f"https://pediucomeu.com.br/autoatendimento/{base64_encoded}"
-    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=2)
-    qr.add_data(url)
-    qr.make(fit=True)
-    img_qr = qr.make_image(fill_color="black", back_color="white").convert("RGBA")
-    img_qr = img_qr.resize((tamanho, tamanho), Image.Resampling.NEAREST)
-    if rotacao_qr != 0:
-        img_qr = img_qr.rotate(rotacao_qr, expand=True)
-    return img_qr
-
-def gerar_imagem_qrcode(background, numero, dado_base, config):
-    imagem_final = background.copy().convert("RGBA")
-    draw = ImageDraw.Draw(imagem_final)
-    img_qr = gerar_qrcode(numero, dado_base, config['tamanho_qr'], config['rotacao_qr'])
-    qr_w, qr_h = img_qr.size
-    pos_qr = (config['qr_x'] - qr_w // 2, config['qr_y'] - qr_h // 2)
-    imagem_final.paste(img_qr, pos_qr, img_qr)
-    fonte = carregar_fonte(config['caminho_fonte'], config['tamanho_texto'])
-    if fonte is None: return None
-    texto_str = str(numero)
-    texto_bbox = draw.textbbox((0, 0), texto_str, font=fonte)
-    texto_w, texto_h = texto_bbox[2] - texto_bbox[0], texto_bbox[3] - texto_bbox[1]
-    if config['rotacao_texto'] == 0:
-        pos_texto = (config['texto_x'] - texto_w // 2, config['texto_y'] - texto_h // 2)
-        draw.text(pos_texto, texto_str, font=fonte, fill=config['cor_texto'])
+# Carregar no botão de gerar só submete o lote ao gestor de tarefas (ver
+# tarefas.py), partilhado por todas as sessões do servidor. As opções da
+# barra lateral são copiadas para a tarefa no momento da submissão. O painel
+# "Lotes" consulta o estado das tarefas desta sessão num fragmento que se
+# atualiza sozinho enquanto houver alguma em curso.
+
+FORMATOS_EXPORTACAO = {"PDF": None, "Imagens PNG (ZIP)": "PNG", "Imagens WebP (ZIP)": "WEBP"}
+CORES_PAGINA = {"RGB (padrão)": "RGB", "Automático": "auto", "Paleta (até 256 cores)": "P", "Tons de cinzento": "L", "Preto e branco (1 bit)": "1"}
+COMPRESSOES_PAGINA = {"JPEG (padrão)": "JPEG", "Automática": "auto", "Flate (sem perdas)": "Flate", "CCITT G4 (só preto e branco)": "CCITT"}
+INTERVALO_ATUALIZACAO_S = 1.0
+
+@st.cache_resource
+def obter_gestor_tarefas():
+    """Gestor de tarefas único do servidor, partilhado por todas as sessões."""
+    return GestorTarefas()
+
+def paginas_esperadas(template_bytes, inicio, fim, imposicao):
+    """Número de páginas do lote (folhas, com imposição). Levanta ValueError se a imposição não couber."""
+    if not imposicao:
+        return fim - inicio + 1
+    folhas = Imposicao(imposicao, *Image.open(io.BytesIO(template_bytes)).size)
+    return -(-(fim - inicio + 1) // folhas.por_folha)
+
+def pdf_vetorial(opcoes):
+    """True se o lote é um PDF vetorial, que não passa pelas comandas em imagem (os códigos são lidos à parte)."""
+    return FORMATOS_EXPORTACAO[opcoes['exportar']] is None and opcoes['formato_pdf'] == "Vetorial"
+
+def escrever_lote(tarefa, modo, template_bytes, inicio, fim, dado_base, config, opcoes, destino, ao_ler=None):
+    """
+    Escreve o PDF do lote em `destino` no formato das `opcoes`. Devolve o
+    número de páginas. `ao_ler` recebe a leitura do código de cada comanda
+    renderizada (ver motor.gerar_paginas); não se aplica ao PDF vetorial.
+    """
+    imposicao, processos, codificacao = opcoes['imposicao'], opcoes['processos'], opcoes['codificacao']
+    if opcoes['formato_pdf'] == "Vetorial":
+        return escrever_pdf_vetorial(modo, template_bytes, inicio, fim, dado_base, config, destino, imposicao, progresso=tarefa.avancar, codificacao=codificacao)
+    if opcoes['usar_cache'] and not imposicao:
+        cache = CacheComandas()
+        total = escrever_pdf(tarefa.acompanhar(cache.paginas(modo, template_bytes, inicio, fim, dado_base, config, processos, codificacao, ao_ler)), destino)
+        cache.podar()
+        tarefa.mensagens.append(f"♻️ {cache.acertos} comandas reutilizadas do cache, {cache.falhas} renderizadas.")
+        return total
+    resolucao = imposicao['dpi'] if imposicao else 72.0
+    paginas = gerar_paginas(modo, template_bytes, inicio, fim, dado_base, config, processos, imposicao, codificacao=codificacao, ao_ler=ao_ler)
+    return escrever_pdf(tarefa.acompanhar(paginas), destino, resolucao)
+
+def guardar_verificacao(tarefa, relatorio, inicio, fim):
+    """Junta o relatório da leitura dos códigos (JSON) aos resultados da tarefa, com um resumo nas mensagens."""
+    with open(tarefa.novo_resultado(f"verificacao_{inicio}_a_{fim}.json", "application/json"), "w", encoding="utf-8") as ficheiro:
+        json.dump(relatorio.como_dict(), ficheiro, ensure_ascii=False, indent=2)
+    if relatorio.falhas:
+        exemplos = "; ".join(f"nº {falha['numero']}: {falha['erro']}" for falha in relatorio.exemplos_falhas[:3])
+        tarefa.avisos.append(f"⚠️ {relatorio.falhas} de {relatorio.total} códigos não foram lidos corretamente ({exemplos}). Veja o relatório da verificação.")
     else:
-        texto_img = Image.new('RGBA', (texto_w, texto_h), (0,0,0,0))
-        draw_texto_temp = ImageDraw.Draw(texto_img)
-        draw_texto_temp.text((-texto_bbox[0], -texto_bbox[1]), texto_str, font=fonte, fill=config['cor_texto'])
-        texto_rotacionado = texto_img.rotate(config['rotacao_texto'], expand=True, fillcolor=(0,0,0,0))
-        rot_w, rot_h = texto_rotacionado.size
-        pos_rot = (config['texto_x'] - rot_w // 2, config['texto_y'] - rot_h // 2)
-        imagem_final.paste(texto_rotacionado, pos_rot, texto_rotacionado)
-    return imagem_final.convert("RGB")
-
-# ===================================================================
-# SEÇÃO 2: LÓGICA DO GERADOR DE CÓDIGO DE BARRAS
-# ===================================================================
+        mensagem = f"🔎 Os {relatorio.total} códigos foram lidos e conferem com o esperado."
+        reutilizadas = fim - inicio + 1 - relatorio.total
+        if reutilizadas:
+            mensagem += f" As {reutilizadas} comandas reutilizadas do cache não foram lidas de novo."
+        tarefa.mensagens.append(mensagem)
 
-def gerar_code39(numero, prefixo, largura, altura, corte_vertical, rotacao_barra, corte_esq, corte_dir):
-    codigo = f"{prefixo}{str(numero).zfill(4)}"
-    writer = ImageWriter()
-    writer.set_options({'module_width': 0.7, 'module_height': altura / 10, 'quiet_zone': 2.0, 'font_size': 0, 'text_distance': 0, 'write_text': False})
-    barcode_obj = Code39(codigo, writer=writer, add_checksum=False)
-    output = io.BytesIO()
-    barcode_obj.write(output)
-    output.seek(0)
-    imagem = Image.open(output)
-    largura_real, altura_real = imagem.size
-    corte_altura = int(altura_real * (1 - (corte_vertical / 100)))
-    corte_esq_px = int(largura_real * (corte_esq / 100))
-    corte_dir_px = int(largura_real * (1 - (corte_dir / 100)))
-    imagem_cortada = imagem.crop((corte_esq_px, 0, corte_dir_px, corte_altura))
-    imagem_redimensionada = imagem_cortada.resize((largura, altura), Image.Resampling.NEAREST)
-    if rotacao_barra != 0:
-        imagem_redimensionada = imagem_redimensionada.rotate(rotacao_barra, expand=True)
-    return imagem_redimensionada
-
-def gerar_imagem_barcode(background, numero, config):
-    imagem_final = background.copy().convert("RGBA")
-    draw = ImageDraw.Draw(imagem_final)
-    codigo_barras = gerar_code39(numero, config['prefixo'], config['largura'], config['altura'], config['corte_vertical'], config['rotacao_barra'], config['corte_esq'], config['corte_dir']).convert("RGBA")
-    bar_w, bar_h = codigo_barras.size
-    pos_bar = (config['bar_x'] - bar_w // 2, config['bar_y'] - bar_h // 2)
-    imagem_final.paste(codigo_barras, pos_bar, codigo_barras)
-    fonte = carregar_fonte(config['caminho_fonte'], config['tamanho_texto'])
-    if fonte is None: return None
-    texto_str = str(numero).zfill(4)
-    texto_bbox = draw.textbbox((0, 0), texto_str, font=fonte)
-    texto_w, texto_h = texto_bbox[2] - texto_bbox[0], texto_bbox[3] - texto_bbox[1]
-    if config['rotacao_texto'] == 0:
-        pos_texto = (config['texto_x'] - texto_w // 2, config['texto_y'] - texto_h // 2)
-        draw.text(pos_texto, texto_str, font=fonte, fill=config['cor_texto'])
+def gerar_lote(tarefa, modo, template_bytes, inicio, fim, dado_base, config, opcoes):
+    """
+    Função da tarefa: escreve o PDF (e um ZIP com o PDF) ou o ZIP com uma
+    imagem por página nos ficheiros de resultado da tarefa e, se pedido,
+    lê o código de cada comanda na mesma passagem e junta o relatório.
+    """
+    relatorio = RelatorioVerificacao() if opcoes['verificar'] else None
+    exportar_lote(tarefa, modo, template_bytes, inicio, fim, dado_base, config, opcoes, relatorio.registar if relatorio else None)
+    if relatorio is None:
+        return
+    if pdf_vetorial(opcoes):
+        # O PDF vetorial não tem comandas em imagem: são renderizadas à parte só para a leitura
+        for leitura in tarefa.acompanhar(verificar_paginas(modo, template_bytes, inicio, fim, dado_base, config, opcoes['processos'])):
+            relatorio.registar(leitura)
+    guardar_verificacao(tarefa, relatorio, inicio, fim)
+
+def exportar_lote(tarefa, modo, template_bytes, inicio, fim, dado_base, config, opcoes, ao_ler=None):
+    """
+    Escreve o PDF (e um ZIP com o PDF) ou o ZIP com uma imagem por página
+    nos ficheiros de resultado da tarefa. `ao_ler`: ver escrever_lote.
+    """
+    imposicao = opcoes['imposicao']
+    formato = FORMATOS_EXPORTACAO[opcoes['exportar']]
+    if formato:
+        caminho_zip = tarefa.novo_resultado(f"comandas_{inicio}_a_{fim}_{formato.lower()}.zip", "application/zip")
+        with open(caminho_zip, "wb") as zip_arquivo:
+            imagens = gerar_paginas(modo, template_bytes, inicio, fim, dado_base, config, opcoes['processos'], imposicao, formato, ao_ler=ao_ler)
+            total = escrever_zip_imagens(tarefa.acompanhar(imagens), zip_arquivo, nomes_paginas(inicio, formato, imposicao))
+        if not total:
+            raise ValueError("Nenhuma imagem pôde ser gerada.")
+        tarefa.mensagens.append(f"ZIP com {total} imagens gerado com sucesso!")
+        return
+
+    nome_pdf = f"comandas_{inicio}_a_{fim}.pdf"
+    caminho_pdf = tarefa.novo_resultado(nome_pdf, "application/pdf")
+    with open(caminho_pdf, "wb") as pdf_arquivo:
+        total_paginas = escrever_lote(tarefa, modo, template_bytes, inicio, fim, dado_base, config, opcoes, pdf_arquivo, ao_ler)
+    if not total_paginas:
+        raise ValueError("Nenhuma imagem pôde ser gerada.")
+    # O PDF já vem comprimido (JPEG/Flate): DEFLATE só gastaria CPU
+    caminho_zip = tarefa.novo_resultado(f"comandas_{inicio}_a_{fim}.zip", "application/zip")
+    with medir("escrever_zip"), zipfile.ZipFile(caminho_zip, 'w', zipfile.ZIP_STORED) as zip_file:
+        zip_file.write(caminho_pdf, nome_pdf)
+    if imposicao:
+        tarefa.mensagens.append(f"PDF com {fim - inicio + 1} comandas em {total_paginas} folhas gerado com sucesso!")
     else:
-        texto_img = Image.new('RGBA', (texto_w, texto_h), (0,0,0,0))
-        draw_texto_temp = ImageDraw.Draw(texto_img)
-        draw_texto_temp.text((-texto_bbox[0], -texto_bbox[1]), texto_str, font=fonte, fill=config['cor_texto'])
-        texto_rotacionado = texto_img.rotate(config['rotacao_texto'], expand=True, fillcolor=(0,0,0,0))
-        rot_w, rot_h = texto_rotacionado.size
-        pos_rot = (config['texto_x'] - rot_w // 2, config['texto_y'] - rot_h // 2)
-        imagem_final.paste(texto_rotacionado, pos_rot, texto_rotacionado)
-    return imagem_final.convert("RGB")
+        tarefa.mensagens.append(f"PDF com {total_paginas} comandas gerado com sucesso!")
+
+def submeter_lote(modo, template_bytes, inicio, fim, dado_base, config):
+    """Submete o lote com as opções atuais da barra lateral e guarda a tarefa na sessão."""
+    try:
+        validar_codificacao(codificacao)
+        total = paginas_esperadas(template_bytes, inicio, fim, imposicao)
+    except ValueError as erro:
+        st.error(f"❌ {erro}")
+        return
+    opcoes = {'exportar': formato_exportacao, 'formato_pdf': formato_pdf, 'usar_cache': usar_cache, 'processos': processos, 'imposicao': imposicao, 'verificar': verificar_codigos, 'codificacao': codificacao}
+    if verificar_codigos and pdf_vetorial(opcoes):
+        total += fim - inicio + 1
+    descricao = f"{modo}: comandas {inicio} a {fim} ({formato_exportacao if formato_exportacao != 'PDF' else 'PDF ' + formato_pdf}{', com verificação' if verificar_codigos else ''})"
+    tarefa = obter_gestor_tarefas().submeter(descricao, total, gerar_lote, modo, template_bytes, inicio, fim, dado_base, config, opcoes)
+    st.session_state.setdefault('tarefas', []).append(tarefa.id)
+
+def mostrar_metricas(metricas, nome, chave):
+    """Tabela com o tempo gasto em cada etapa do lote e o JSON das métricas para download."""
+    with st.expander("⏱️ Tempo por etapa"):
+        st.dataframe(metricas.resumo(), use_container_width=True, hide_index=True)
+        buffer = io.StringIO()
+        metricas.gravar_json(buffer)
+        st.download_button("⬇️ Baixar métricas (JSON)", data=buffer.getvalue(), file_name=f"metricas_{nome}.json", mime="application/json", key=chave)
+
+def ler_resultado(caminho):
+    """Conteúdo de um ficheiro de resultado de uma tarefa, para o download."""
+    with open(caminho, "rb") as ficheiro:
+        return ficheiro.read()
+
+def mostrar_tarefa(gestor, tarefa):
+    """Estado, progresso e botões (cancelar, downloads, remover) de uma tarefa."""
+    with st.container(border=True):
+        st.markdown(f"**{tarefa.descricao}**")
+        if tarefa.estado == EM_FILA:
+            st.caption(f"⏳ Na fila (posição {gestor.posicao_na_fila(tarefa)}).")
+        if tarefa.estado == A_GERAR:
+            st.progress(tarefa.progresso, text=f"{tarefa.feitas} de {tarefa.total} páginas ({tarefa.duracao:.0f} s)")
+        if tarefa.ativa:
+            if st.button("✖️ Cancelar", key=f"tarefa_cancelar_{tarefa.id}", disabled=tarefa.cancelamento_pedido):
+                tarefa.cancelar()
+            return
+        if tarefa.estado == CONCLUIDA:
+            for mensagem in tarefa.mensagens:
+                st.success(mensagem)
+            for aviso in tarefa.avisos:
+                st.warning(aviso)
+            for indice, (nome, caminho, mime) in enumerate(tarefa.resultados):
+                # O ficheiro só é lido quando o botão é clicado, não em cada atualização da página
+                st.download_button(f"⬇️ Baixar {nome}", data=functools.partial(ler_resultado, caminho), file_name=nome, mime=mime, use_container_width=True, key=f"tarefa_resultado_{tarefa.id}_{indice}")
+            st.caption(f"Gerado em {tarefa.duracao:.1f} s.")
+            mostrar_metricas(tarefa.metricas, os.path.splitext(tarefa.resultados[0][0])[0], f"tarefa_metricas_{tarefa.id}")
+        elif tarefa.estado == CANCELADA:
+            st.warning(f"Cancelado ao fim de {tarefa.feitas} de {tarefa.total} páginas.")
+        else:
+            st.error(f"❌ {tarefa.erro}")
+        if st.button("🗑️ Remover", key=f"tarefa_remover_{tarefa.id}"):
+            gestor.remover(tarefa.id)
+            st.session_state['tarefas'].remove(tarefa.id)
+            st.rerun()
+
+def painel_tarefas(a_atualizar):
+    """Lotes desta sessão. Quando o último em curso termina, volta a correr a página para parar a atualização."""
+    gestor = obter_gestor_tarefas()
+    tarefas = [tarefa for tarefa in map(gestor.obter, st.session_state.get('tarefas', [])) if tarefa is not None]
+    if a_atualizar and not any(tarefa.ativa for tarefa in tarefas):
+        st.rerun()
+    if tarefas:
+        st.header("📋 Lotes")
+    for tarefa in reversed(tarefas):
+        mostrar_tarefa(gestor, tarefa)
 
 # ===================================================================
 # INTERFACE PRINCIPAL
@@ -229,13 +253,38 @@ def limpar_estado():
     if 'preview_image' in st.session_state:
         del st.session_state['preview_image']
 
-modo = st.sidebar.radio("Escolha o tipo de código:", ("QR Code", "Código de Barras"), on_change=limpar_estado, key="modo_selecao")
+modo = st.sidebar.radio("Escolha o tipo de código:", (MODO_QRCODE, MODO_BARRAS), on_change=limpar_estado, key="modo_selecao")
 
 st.sidebar.header("⚙️ Configurações")
 mostrar_reguas = st.sidebar.checkbox("Mostrar Réguas e Guias", value=True)
+total_nucleos = os.cpu_count() or 1
+formato_exportacao = st.sidebar.selectbox("Exportar como", list(FORMATOS_EXPORTACAO), help="PDF com todas as comandas, ou um ZIP com uma imagem (sem perdas) por comanda.")
+formato_pdf = st.sidebar.radio("Formato do PDF", ("Imagem", "Vetorial"), horizontal=True, disabled=formato_exportacao != "PDF", help="Imagem: cada página é uma imagem completa. Vetorial: o template é embutido uma única vez e o código e o número são desenhados como vetores e texto, o que gera ficheiros muito menores.")
+processos = st.sidebar.number_input("Processos em paralelo", min_value=1, max_value=total_nucleos, value=total_nucleos, step=1, help="Número de processos usados para renderizar o PDF. Com 1, as comandas são geradas uma a uma.")
+verificar_codigos = st.sidebar.checkbox("Verificar a leitura de todos os códigos", value=False, help="Enquanto o lote é gerado, o código de cada comanda é lido a partir dos pixels, antes da compressão, e comparado com o esperado. As comandas reutilizadas do cache não são lidas de novo; no PDF vetorial, as comandas são renderizadas à parte para a leitura. O resultado e o relatório (JSON) aparecem junto aos downloads.")
+usar_cache = st.sidebar.checkbox("Reutilizar comandas já geradas", value=True, help="Guarda em disco cada comanda do PDF (formato Imagem, sem imposição). Ao reimprimir ou alargar um intervalo com o mesmo template e layout, só os números novos são renderizados.")
+with st.sidebar.expander("Cores e compressão do PDF"):
+    pdf_raster = formato_exportacao == "PDF"
+    cor_paginas = st.selectbox("Cores das páginas", list(CORES_PAGINA), disabled=not pdf_raster, help="Automático escolhe o modo mais compacto que representa o template e as cores do código e do número: preto e branco, tons de cinzento, paleta ou RGB. No PDF vetorial aplica-se só à imagem do template.")
+    compressao_paginas = st.selectbox("Compressão", list(COMPRESSOES_PAGINA), disabled=not pdf_raster, help="JPEG só para RGB e tons de cinzento; CCITT G4 só para preto e branco; Flate serve para todos e não tem perdas. Automática: JPEG em RGB, CCITT em preto e branco e Flate nos restantes.")
+    qualidade_jpeg = st.slider("Qualidade do JPEG", 30, 95, CODIFICACAO_PADRAO['qualidade'], 5, disabled=not pdf_raster or COMPRESSOES_PAGINA[compressao_paginas] not in ("JPEG", "auto"))
+codificacao = {'cor': CORES_PAGINA[cor_paginas], 'compressao': COMPRESSOES_PAGINA[compressao_paginas], 'qualidade': qualidade_jpeg}
+with st.sidebar.expander("Imposição (várias comandas por folha)"):
+    impor_folhas = st.checkbox("Montar as comandas em folhas", value=False, help="Coloca várias comandas em cada página do PDF, numa grelha, com sangria e marcas de corte.")
+    col1, col2 = st.columns(2)
+    folha = col1.selectbox("Folha", list(FOLHAS_MM), disabled=not impor_folhas)
+    orientacao = col2.selectbox("Orientação", ["Retrato", "Paisagem"], disabled=not impor_folhas)
+    colunas = col1.number_input("Colunas", min_value=1, max_value=20, value=IMPOSICAO_PADRAO['colunas'], step=1, disabled=not impor_folhas)
+    linhas = col2.number_input("Linhas", min_value=1, max_value=20, value=IMPOSICAO_PADRAO['linhas'], step=1, disabled=not impor_folhas)
+    dpi_folha = st.select_slider("Resolução da folha (DPI)", options=[150, 200, 300, 600], value=IMPOSICAO_PADRAO['dpi'], disabled=not impor_folhas)
+    margem_mm = col1.number_input("Margem (mm)", min_value=0.0, max_value=50.0, value=IMPOSICAO_PADRAO['margem_mm'], step=1.0, disabled=not impor_folhas)
+    espaco_mm = col2.number_input("Espaço entre comandas (mm)", min_value=0.0, max_value=50.0, value=IMPOSICAO_PADRAO['espaco_mm'], step=1.0, disabled=not impor_folhas)
+    sangria_mm = col1.number_input("Sangria (mm)", min_value=0.0, max_value=10.0, value=IMPOSICAO_PADRAO['sangria_mm'], step=0.5, disabled=not impor_folhas)
+    marcas_corte = col2.checkbox("Marcas de corte", value=IMPOSICAO_PADRAO['marcas_corte'], disabled=not impor_folhas)
+imposicao = {'folha': folha, 'paisagem': orientacao == "Paisagem", 'colunas': colunas, 'linhas': linhas, 'dpi': dpi_folha, 'margem_mm': margem_mm, 'espaco_mm': espaco_mm, 'sangria_mm': sangria_mm, 'marcas_corte': marcas_corte} if impor_folhas else None
 
 # --- Bloco do QR Code ---
-if modo == "QR Code":
+if modo == MODO_QRCODE:
     st.sidebar.subheader("1. Ficheiros e Fonte")
     imagem_base_up = st.sidebar.file_uploader("1. Template Vazio da Comanda", type=["png", "jpg", "jpeg"], key="qr_uploader")
     if fontes_disponiveis:
@@ -254,9 +303,7 @@ if modo == "QR Code":
     st.sidebar.subheader("3. Layout e Posições")
     max_width, max_height = 2000, 2000
     if imagem_base_up:
-        imagem_base_up.seek(0)
-        img_temp = Image.open(imagem_base_up)
-        max_width, max_height = img_temp.size
+        max_width, max_height, template_preview, escala_preview = carregar_template(imagem_base_up.file_id, imagem_base_up)
         st.sidebar.info(f"Dimensões: {max_width}x{max_height} px")
     
     tamanho_qr = st.sidebar.slider("Tamanho do QR Code", 50, max_width, 450, 10, key="qr_tam_qr")
@@ -273,19 +320,21 @@ if modo == "QR Code":
 
     st.header("🖼️ Pré-visualização Automática")
     if imagem_base_up and documento and fonte_selecionada:
-        imagem_base_up.seek(0)
-        background = Image.open(imagem_base_up)
         dado_base_para_url = aplicar_mascara_qrcode(documento, tipo_doc)
-        config = {'tamanho_qr': tamanho_qr, 'qr_x': qr_x, 'qr_y': qr_y, 'tamanho_texto': tamanho_texto_qr, 'texto_x': texto_x_qr, 'texto_y': texto_y_qr, 'cor_texto': cor_texto_qr, 'rotacao_qr': rotacao_qr, 'rotacao_texto': rotacao_texto_qr, 'caminho_fonte': fontes_disponiveis[fonte_selecionada]}
-        preview_image = gerar_imagem_qrcode(background, inicio, dado_base_para_url, config)
+        config = ConfigQrCode(caminho_fonte=fontes_disponiveis[fonte_selecionada], tamanho_qr=tamanho_qr, qr_x=qr_x, qr_y=qr_y, tamanho_texto=tamanho_texto_qr, texto_x=texto_x_qr, texto_y=texto_y_qr, cor_texto=cor_texto_qr, rotacao_qr=rotacao_qr, rotacao_texto=rotacao_texto_qr).como_dict()
+        preview_image = gerar_imagem_qrcode(template_preview, inicio, dado_base_para_url, escalar_config(config, escala_preview))
         if preview_image:
             if mostrar_reguas:
                 guias = {
                     'Codigo': {'x': qr_x, 'y': qr_y, 'color': '#ff4b4b'}, # Vermelho
                     'Numero': {'x': texto_x_qr, 'y': texto_y_qr, 'color': '#2b83ff'} # Azul
                 }
-                preview_image = draw_rulers_and_guides(preview_image, guias)
+                preview_image = draw_rulers_and_guides(preview_image, guias, escala=escala_preview)
             st.image(preview_image, caption=f"Exemplo da Comanda Nº {inicio}", use_container_width=True)
+            layout = Layout(ConfigQrCode(**config), tipo_doc, documento, imposicao)
+            st.download_button("⬇️ Baixar layout (JSON)", data=json.dumps(layout.como_dict(), ensure_ascii=False, indent=2), file_name="layout_qrcode.json", mime="application/json", help="Layout para gerar as comandas pela linha de comandos (cli.py).")
+        else:
+            st.error(f"Erro: Não foi possível carregar a fonte '{fonte_selecionada}'.")
     else:
         st.info("Preencha todos os campos obrigatórios para ver a pré-visualização.")
 
@@ -307,28 +356,12 @@ if modo == "QR Code":
         if erros:
             st.error(f"❌ Por favor, forneça {', '.join(erros)} para continuar.")
         else:
-            with st.spinner(f"A gerar PDF com comandas de {inicio} a {fim}..."):
-                imagem_base_up.seek(0)
-                background = Image.open(imagem_base_up)
-                dado_base_para_url = aplicar_mascara_qrcode(documento, tipo_doc)
-                config = {'tamanho_qr': tamanho_qr, 'qr_x': qr_x, 'qr_y': qr_y, 'tamanho_texto': tamanho_texto_qr, 'texto_x': texto_x_qr, 'texto_y': texto_y_qr, 'cor_texto': cor_texto_qr, 'rotacao_qr': rotacao_qr, 'rotacao_texto': rotacao_texto_qr, 'caminho_fonte': fontes_disponiveis[fonte_selecionada]}
-                lista_imagens = [img for numero in range(inicio, fim + 1) if (img := gerar_imagem_qrcode(background, numero, dado_base_para_url, config)) is not None]
-                if lista_imagens:
-                    pdf_bytes = io.BytesIO()
-                    lista_imagens[0].save(pdf_bytes, format="PDF", save_all=True, append_images=lista_imagens[1:])
-                    pdf_bytes.seek(0)
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                        zip_file.writestr(f"comandas_{inicio}_a_{fim}.pdf", pdf_bytes.getvalue())
-                    zip_buffer.seek(0)
-                    st.success(f"PDF com {len(lista_imagens)} comandas gerado com sucesso!")
-                    st.download_button("⬇️ Baixar PDF", data=pdf_bytes, file_name=f"comandas_{inicio}_a_{fim}.pdf", mime="application/pdf", use_container_width=True)
-                    st.download_button("⬇️ Baixar .ZIP", data=zip_buffer, file_name=f"comandas_{inicio}_a_{fim}.zip", mime="application/zip", use_container_width=True)
-                else:
-                    st.error("Nenhuma imagem pôde ser gerada.")
+            dado_base_para_url = aplicar_mascara_qrcode(documento, tipo_doc)
+            config = ConfigQrCode(caminho_fonte=fontes_disponiveis[fonte_selecionada], tamanho_qr=tamanho_qr, qr_x=qr_x, qr_y=qr_y, tamanho_texto=tamanho_texto_qr, texto_x=texto_x_qr, texto_y=texto_y_qr, cor_texto=cor_texto_qr, rotacao_qr=rotacao_qr, rotacao_texto=rotacao_texto_qr).como_dict()
+            submeter_lote(MODO_QRCODE, imagem_base_up.getvalue(), inicio, fim, dado_base_para_url, config)
 
 # --- Bloco do Código de Barras ---
-elif modo == "Código de Barras":
+elif modo == MODO_BARRAS:
     st.sidebar.subheader("1. Ficheiros e Fonte")
     imagem_base_up = st.sidebar.file_uploader("1. Template Vazio da Comanda", type=["png", "jpg", "jpeg"], key="bc_uploader")
     if fontes_disponiveis:
@@ -346,9 +379,7 @@ elif modo == "Código de Barras":
     st.sidebar.subheader("3. Layout e Posições")
     max_width, max_height = 2000, 2000
     if imagem_base_up:
-        imagem_base_up.seek(0)
-        img_temp = Image.open(imagem_base_up)
-        max_width, max_height = img_temp.size
+        max_width, max_height, template_preview, escala_preview = carregar_template(imagem_base_up.file_id, imagem_base_up)
         st.sidebar.info(f"Dimensões: {max_width}x{max_height} px")
 
     largura_barra = st.sidebar.slider("Largura da Barra", 100, max_width, 570, 10, key="bc_largura")
@@ -369,18 +400,20 @@ elif modo == "Código de Barras":
 
     st.header("🖼️ Pré-visualização Automática")
     if imagem_base_up and fonte_selecionada:
-        imagem_base_up.seek(0)
-        background = Image.open(imagem_base_up)
-        config = {'prefixo': prefixo, 'largura': largura_barra, 'altura': altura_barra, 'corte_vertical': corte_vertical, 'bar_x': bar_x, 'bar_y': bar_y, 'tamanho_texto': tamanho_texto_bc, 'texto_x': texto_x_bc, 'texto_y': texto_y_bc, 'cor_texto': cor_texto_bc, 'caminho_fonte': fontes_disponiveis[fonte_selecionada], 'rotacao_barra': rotacao_barra, 'rotacao_texto': rotacao_texto_bc, 'corte_esq': corte_esq, 'corte_dir': corte_dir}
-        preview_image = gerar_imagem_barcode(background, inicio, config)
+        config = ConfigCodigoBarras(caminho_fonte=fontes_disponiveis[fonte_selecionada], prefixo=prefixo, largura=largura_barra, altura=altura_barra, corte_vertical=corte_vertical, corte_esq=corte_esq, corte_dir=corte_dir, bar_x=bar_x, bar_y=bar_y, tamanho_texto=tamanho_texto_bc, texto_x=texto_x_bc, texto_y=texto_y_bc, cor_texto=cor_texto_bc, rotacao_barra=rotacao_barra, rotacao_texto=rotacao_texto_bc).como_dict()
+        preview_image = gerar_imagem_barcode(template_preview, inicio, escalar_config(config, escala_preview))
         if preview_image:
             if mostrar_reguas:
                 guias = {
                     'Codigo': {'x': bar_x, 'y': bar_y, 'color': '#ff4b4b'}, # Vermelho
                     'Numero': {'x': texto_x_bc, 'y': texto_y_bc, 'color': '#2b83ff'} # Azul
                 }
-                preview_image = draw_rulers_and_guides(preview_image, guias)
+                preview_image = draw_rulers_and_guides(preview_image, guias, escala=escala_preview)
             st.image(preview_image, caption=f"Exemplo da Comanda Nº {inicio}", use_container_width=True)
+            layout = Layout(ConfigCodigoBarras(**config), imposicao=imposicao)
+            st.download_button("⬇️ Baixar layout (JSON)", data=json.dumps(layout.como_dict(), ensure_ascii=False, indent=2), file_name="layout_codigo_barras.json", mime="application/json", help="Layout para gerar as comandas pela linha de comandos (cli.py).")
+        else:
+            st.error(f"Erro: Não foi possível carregar a fonte '{fonte_selecionada}'.")
     else:
         st.info("Preencha todos os campos obrigatórios para ver a pré-visualização.")
     
@@ -401,25 +434,9 @@ elif modo == "Código de Barras":
         if erros:
             st.error(f"❌ Por favor, forneça {', '.join(erros)} para continuar.")
         else:
-            with st.spinner(f"A gerar PDF com comandas de {inicio} a {fim}..."):
-                imagem_base_up.seek(0)
-                background = Image.open(imagem_base_up)
-                config = {'prefixo': prefixo, 'largura': largura_barra, 'altura': altura_barra, 'corte_vertical': corte_vertical, 'bar_x': bar_x, 'bar_y': bar_y, 'tamanho_texto': tamanho_texto_bc, 'texto_x': texto_x_bc, 'texto_y': texto_y_bc, 'cor_texto': cor_texto_bc, 'caminho_fonte': fontes_disponiveis[fonte_selecionada], 'rotacao_barra': rotacao_barra, 'rotacao_texto': rotacao_texto_bc, 'corte_esq': corte_esq, 'corte_dir': corte_dir}
-                lista_imagens = [img for numero in range(inicio, fim + 1) if (img := gerar_imagem_barcode(background, numero, config)) is not None]
-                if lista_imagens:
-                    pdf_bytes = io.BytesIO()
-                    lista_imagens[0].save(pdf_bytes, format="PDF", save_all=True, append_images=lista_imagens[1:])
-                    pdf_bytes.seek(0)
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                        zip_file.writestr(f"comandas_{inicio}_a_{fim}.pdf", pdf_bytes.getvalue())
-                    zip_buffer.seek(0)
-                    st.success(f"PDF com {len(lista_imagens)} comandas gerado com sucesso!")
-                    st.download_button("⬇️ Baixar PDF", data=pdf_bytes, file_name=f"comandas_{inicio}_a_{fim}.pdf", mime="application/pdf", use_container_width=True)
-                    st.download_button("⬇️ Baixar .ZIP", data=zip_buffer, file_name=f"comandas_{inicio}_a_{fim}.zip", mime="application/zip", use_container_width=True)
-                else:
-                    st.error("Nenhuma imagem pôde ser gerada.")
-
-
-
+            config = ConfigCodigoBarras(caminho_fonte=fontes_disponiveis[fonte_selecionada], prefixo=prefixo, largura=largura_barra, altura=altura_barra, corte_vertical=corte_vertical, corte_esq=corte_esq, corte_dir=corte_dir, bar_x=bar_x, bar_y=bar_y, tamanho_texto=tamanho_texto_bc, texto_x=texto_x_bc, texto_y=texto_y_bc, cor_texto=cor_texto_bc, rotacao_barra=rotacao_barra, rotacao_texto=rotacao_texto_bc).como_dict()
+            submeter_lote(MODO_BARRAS, imagem_base_up.getvalue(), inicio, fim, None, config)
 
+# --- Lotes em segundo plano ---
+a_atualizar = any(tarefa is not None and tarefa.ativa for tarefa in map(obter_gestor_tarefas().obter, st.session_state.get('tarefas', [])))
+st.fragment(run_every=INTERVALO_ATUALIZACAO_S if a_atualizar else None)(painel_tarefas)(a_atualizar)
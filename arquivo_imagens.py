@@ -0,0 +1,44 @@
+# ==============================
+# BIBLIOTECAS
+# ==============================
+import time
+import zipfile
+from instrumentacao import medir
+
+# ===================================================================
+# ARQUIVO ZIP COM UMA IMAGEM POR PÁGINA
+# ===================================================================
+# PNG e WebP já vêm comprimidos: voltar a comprimi-los com DEFLATE gasta
+# CPU sem ganho de tamanho, por isso as entradas são gravadas com
+# ZIP_STORED. Cada imagem é escrita no ZIP assim que fica pronta (pela
+# ordem dos números), diretamente no ficheiro de destino.
+
+EXTENSOES = {"PNG": "png", "WEBP": "webp"}
+
+
+def nomes_paginas(inicio, formato, imposicao=None):
+    """Gerador dos nomes das entradas: comanda_<número> ou, com imposição, folha_<n>."""
+    extensao = EXTENSOES[formato]
+    indice = 0
+    while True:
+        if imposicao:
+            yield f"folha_{indice + 1}.{extensao}"
+        else:
+            yield f"comanda_{inicio + indice}.{extensao}"
+        indice += 1
+
+
+def escrever_zip_imagens(imagens, destino, nomes):
+    """
+    Escreve cada imagem (bytes) de `imagens` como uma entrada ZIP_STORED em
+    `destino` (ficheiro binário aberto), com os nomes do iterável `nomes`.
+    Devolve o número de entradas.
+    """
+    total = 0
+    data_hora = time.localtime()[:6]
+    with zipfile.ZipFile(destino, "w", zipfile.ZIP_STORED) as arquivo:
+        for dados, nome in zip(imagens, nomes):
+            with medir("escrever_zip"):
+                arquivo.writestr(zipfile.ZipInfo(nome, data_hora), dados)
+            total += 1
+    return total
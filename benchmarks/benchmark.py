@@ -0,0 +1,364 @@
+# ==============================
+# BIBLIOTECAS
+# ==============================
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from PIL import Image, ImageDraw
+
+try:
+    import resource
+except ImportError:  # Windows: sem medição do pico de memória
+    resource = None
+
+PASTA_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PASTA_REPO)
+
+import motor
+from escritor_pdf import escrever_pdf
+from pdf_vetorial import escrever_pdf_vetorial
+from verificacao import RelatorioVerificacao, verificar_paginas
+
+# ===================================================================
+# BENCHMARK DA GERAÇÃO DE COMANDAS
+# ===================================================================
+# Mede cada etapa da geração com um template sintético e as fontes da
+# pasta fonts/, sem rede. Cada caso corre num processo novo, para que o
+# pico de memória (ru_maxrss) seja o desse caso e não o acumulado.
+# Os processos de renderização são filhos do forkserver e não do processo
+# do caso, por isso não entram em RUSAGE_CHILDREN: no Linux, o seu pico
+# (VmHWM em /proc/<pid>/status) é lido periodicamente enquanto o caso corre.
+# Noutros sistemas, a coluna RSS dos casos com --processos > 1 só mede o
+# processo principal.
+#
+#   python benchmarks/benchmark.py                          # todos os casos, 10 / 1000 / 10000
+#   python benchmarks/benchmark.py -n 10 1000 --gravar-base benchmarks/base.json
+#   python benchmarks/benchmark.py -n 10 1000 --comparar benchmarks/base.json
+#
+# Com --comparar, o código de saída é 1 se algum caso ficar mais lento do
+# que a base para além da tolerância.
+
+DADO_BASE = motor.aplicar_mascara_qrcode("11222333000144", "CNPJ")
+TAMANHO_TEMPLATE = (1080, 1920)
+
+
+def criar_template(largura, altura):
+    """Template sintético com alguma arte (para o JPEG não ser trivial), em PNG."""
+    imagem = Image.new("RGB", (largura, altura), "#f4e1c1")
+    draw = ImageDraw.Draw(imagem)
+    draw.rectangle((largura // 10, altura // 20, largura * 9 // 10, altura // 6), fill="#3a5f8a")
+    draw.ellipse((largura // 4, altura * 4 // 5, largura * 3 // 4, altura * 9 // 10), fill="#c0392b")
+    for y in range(altura // 5, altura * 3 // 4, 40):
+        draw.line((0, y, largura, y + 20), fill="#e8d2a8", width=3)
+    buffer = io.BytesIO()
+    imagem.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def primeira_fonte():
+    fontes = motor.listar_fontes(os.path.join(PASTA_REPO, "fonts"))
+    if not fontes:
+        raise SystemExit("A pasta fonts/ não tem fontes .ttf.")
+    return fontes[sorted(fontes)[0]]
+
+
+def configs(caminho_fonte):
+    qrcode = {'tamanho_qr': 450, 'qr_x': 540, 'qr_y': 1035, 'tamanho_texto': 150, 'texto_x': 533, 'texto_y': 1445, 'cor_texto': '#000000', 'rotacao_qr': 0, 'rotacao_texto': 0, 'caminho_fonte': caminho_fonte}
+    barras = {'prefixo': '/', 'largura': 570, 'altura': 215, 'corte_vertical': 27, 'bar_x': 535, 'bar_y': 600, 'tamanho_texto': 142, 'texto_x': 535, 'texto_y': 845, 'cor_texto': '#FFFFFF', 'caminho_fonte': caminho_fonte, 'rotacao_barra': 0, 'rotacao_texto': 0, 'corte_esq': 8, 'corte_dir': 8}
+    return qrcode, barras
+
+# ===================================================================
+# CASOS
+# ===================================================================
+# Cada caso recebe o contexto, o intervalo [1, total] e a função `marcar`,
+# que deve ser chamada uma vez por página/chamada; a latência de cada
+# página é o tempo entre marcas consecutivas. Um caso que não marque
+# nenhuma página só reporta o tempo total e a taxa.
+
+def caso_gerar_qrcode(contexto, total, marcar):
+    for numero in range(1, total + 1):
+        motor.gerar_qrcode(numero, DADO_BASE, 450, 0)
+        marcar()
+
+def caso_gerar_code39(contexto, total, marcar):
+    for numero in range(1, total + 1):
+        motor.gerar_code39(numero, '/', 570, 215, 27, 0, 8, 8)
+        marcar()
+
+def caso_gerar_imagem_qrcode(contexto, total, marcar):
+    background = Image.open(io.BytesIO(contexto['template']))
+    for numero in range(1, total + 1):
+        motor.gerar_imagem_qrcode(background, numero, DADO_BASE, contexto['config_qrcode'])
+        marcar()
+
+def caso_gerar_imagem_barcode(contexto, total, marcar):
+    background = Image.open(io.BytesIO(contexto['template']))
+    for numero in range(1, total + 1):
+        motor.gerar_imagem_barcode(background, numero, contexto['config_barras'])
+        marcar()
+
+def caso_draw_rulers_and_guides(contexto, total, marcar):
+    imagem = Image.open(io.BytesIO(contexto['template'])).convert("RGB")
+    for numero in range(1, total + 1):
+        guias = {'Codigo': {'x': numero % 1080, 'y': 1035, 'color': '#ff4b4b'}, 'Numero': {'x': 533, 'y': numero % 1920, 'color': '#2b83ff'}}
+        motor.draw_rulers_and_guides(imagem, guias)
+        marcar()
+
+def _marcadas(paginas, marcar):
+    for pagina in paginas:
+        yield pagina
+        marcar()
+
+def caso_pdf_qrcode(contexto, total, marcar):
+    paginas = motor.gerar_paginas(motor.MODO_QRCODE, contexto['template'], 1, total, DADO_BASE, contexto['config_qrcode'], contexto['processos'])
+    with tempfile.TemporaryFile() as destino:
+        escrever_pdf(_marcadas(paginas, marcar), destino)
+
+def caso_pdf_qrcode_verificado(contexto, total, marcar):
+    relatorio = RelatorioVerificacao()
+    paginas = motor.gerar_paginas(motor.MODO_QRCODE, contexto['template'], 1, total, DADO_BASE, contexto['config_qrcode'], contexto['processos'], ao_ler=relatorio.registar)
+    with tempfile.TemporaryFile() as destino:
+        escrever_pdf(_marcadas(paginas, marcar), destino)
+
+def caso_pdf_barras(contexto, total, marcar):
+    paginas = motor.gerar_paginas(motor.MODO_BARRAS, contexto['template'], 1, total, None, contexto['config_barras'], contexto['processos'])
+    with tempfile.TemporaryFile() as destino:
+        escrever_pdf(_marcadas(paginas, marcar), destino)
+
+def caso_pdf_qrcode_compacto(contexto, total, marcar):
+    paginas = motor.gerar_paginas(motor.MODO_QRCODE, contexto['template'], 1, total, DADO_BASE, contexto['config_qrcode'], contexto['processos'], codificacao={'cor': "auto", 'compressao': "auto"})
+    with tempfile.TemporaryFile() as destino:
+        escrever_pdf(_marcadas(paginas, marcar), destino)
+
+def caso_pdf_vetorial_qrcode(contexto, total, marcar):
+    # O escritor vetorial não expõe as páginas: só o tempo total é medido
+    with tempfile.TemporaryFile() as destino:
+        escrever_pdf_vetorial(motor.MODO_QRCODE, contexto['template'], 1, total, DADO_BASE, contexto['config_qrcode'], destino)
+
+def caso_verificar_qrcode(contexto, total, marcar):
+    for _ in verificar_paginas(motor.MODO_QRCODE, contexto['template'], 1, total, DADO_BASE, contexto['config_qrcode'], contexto['processos']):
+        marcar()
+
+def caso_verificar_barras(contexto, total, marcar):
+    for _ in verificar_paginas(motor.MODO_BARRAS, contexto['template'], 1, total, None, contexto['config_barras'], contexto['processos']):
+        marcar()
+
+CASOS = {
+    'gerar_qrcode': caso_gerar_qrcode,
+    'gerar_code39': caso_gerar_code39,
+    'gerar_imagem_qrcode': caso_gerar_imagem_qrcode,
+    'gerar_imagem_barcode': caso_gerar_imagem_barcode,
+    'draw_rulers_and_guides': caso_draw_rulers_and_guides,
+    'pdf_qrcode': caso_pdf_qrcode,
+    'pdf_qrcode_verificado': caso_pdf_qrcode_verificado,
+    'pdf_barras': caso_pdf_barras,
+    'pdf_qrcode_compacto': caso_pdf_qrcode_compacto,
+    'pdf_vetorial_qrcode': caso_pdf_vetorial_qrcode,
+    'verificar_qrcode': caso_verificar_qrcode,
+    'verificar_barras': caso_verificar_barras,
+}
+
+# ===================================================================
+# MEDIÇÃO
+# ===================================================================
+
+def percentil(valores, fracao):
+    """Percentil por posição mais próxima (valores já ordenados); None sem valores."""
+    if not valores:
+        return None
+    return valores[min(len(valores) - 1, max(0, round(fracao * len(valores)) - 1))]
+
+
+INTERVALO_AMOSTRAGEM_S = 0.2
+
+
+def _descendentes(pid):
+    """PIDs de todos os descendentes de `pid` (Linux, a partir de /proc)."""
+    filhos = {}
+    for entrada in os.listdir("/proc"):
+        if not entrada.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entrada}/stat") as ficheiro:
+                # O nome do processo (entre parênteses) pode ter espaços; o PPID é o 2.º campo depois dele
+                pai = int(ficheiro.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        filhos.setdefault(pai, []).append(int(entrada))
+    descendentes, pendentes = [], [pid]
+    while pendentes:
+        filhos_atuais = filhos.get(pendentes.pop(), [])
+        descendentes.extend(filhos_atuais)
+        pendentes.extend(filhos_atuais)
+    return descendentes
+
+
+def _vmhwm_kb(pid):
+    """Pico de memória residente (VmHWM) do processo, em KB, ou None se já terminou."""
+    try:
+        with open(f"/proc/{pid}/status") as ficheiro:
+            for linha in ficheiro:
+                if linha.startswith("VmHWM:"):
+                    return int(linha.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def vigiar_descendentes(parar, picos):
+    """Até `parar` ser ativado, guarda em `picos` (pid -> KB) o VmHWM de cada descendente deste processo."""
+    while True:
+        for pid in _descendentes(os.getpid()):
+            kb = _vmhwm_kb(pid)
+            if kb is not None:
+                picos[pid] = max(picos.get(pid, 0), kb)
+        if parar.wait(INTERVALO_AMOSTRAGEM_S):
+            return
+
+
+def pico_rss_mb(picos_descendentes=None):
+    """
+    Maior pico de memória residente, em MB, entre este processo, os filhos
+    já esperados (RUSAGE_CHILDREN) e os descendentes vigiados
+    (`picos_descendentes`, em KB). None sem `resource`.
+    """
+    if resource is None:
+        return None
+    pico = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss vem em KB no Linux e em bytes no macOS
+    pico_mb = pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+    return max([pico_mb] + [kb / 1024 for kb in (picos_descendentes or {}).values()])
+
+
+def medir_caso(nome, total, processos):
+    """Corre um caso no processo atual e devolve o dicionário de resultados."""
+    qrcode, barras = configs(primeira_fonte())
+    contexto = {'template': criar_template(*TAMANHO_TEMPLATE), 'config_qrcode': qrcode, 'config_barras': barras, 'processos': processos}
+    latencias = []
+    ultimo = [0.0]
+
+    def marcar():
+        agora = time.perf_counter()
+        latencias.append(agora - ultimo[0])
+        ultimo[0] = agora
+
+    picos_descendentes = {}
+    vigia = None
+    if processos > 1 and os.path.isdir("/proc"):
+        parar = threading.Event()
+        vigia = threading.Thread(target=vigiar_descendentes, args=(parar, picos_descendentes), daemon=True)
+        vigia.start()
+    inicio = ultimo[0] = time.perf_counter()
+    try:
+        CASOS[nome](contexto, total, marcar)
+    finally:
+        segundos = time.perf_counter() - inicio
+        if vigia is not None:
+            parar.set()
+            vigia.join()
+    latencias.sort()
+    return {
+        'caso': nome,
+        'total': total,
+        'segundos': round(segundos, 4),
+        'paginas_s': round(total / segundos, 2) if segundos else None,
+        'p50_ms': None if not latencias else round(percentil(latencias, 0.50) * 1000, 3),
+        'p99_ms': None if not latencias else round(percentil(latencias, 0.99) * 1000, 3),
+        'pico_rss_mb': None if resource is None else round(pico_rss_mb(picos_descendentes), 1),
+    }
+
+
+def medir_em_processo_novo(nome, total, processos):
+    comando = [sys.executable, os.path.abspath(__file__), "--caso", nome, "-n", str(total), "--processos", str(processos)]
+    saida = subprocess.run(comando, check=True, capture_output=True, text=True).stdout
+    return json.loads(saida.strip().splitlines()[-1])
+
+# ===================================================================
+# RELATÓRIO E COMPARAÇÃO COM A BASE
+# ===================================================================
+
+def imprimir_tabela(resultados, base=None):
+    cabecalho = f"{'caso':<24}{'total':>7}{'pág/s':>11}{'p50 ms':>10}{'p99 ms':>10}{'RSS MB':>9}"
+    if base:
+        cabecalho += f"{'vs base':>10}"
+    print(cabecalho)
+    print("-" * len(cabecalho))
+    def formatar(valor, casas):
+        return "-" if valor is None else f"{valor:.{casas}f}"
+
+    for resultado in resultados:
+        linha = (f"{resultado['caso']:<24}{resultado['total']:>7}{resultado['paginas_s']:>11.1f}"
+                 f"{formatar(resultado['p50_ms'], 2):>10}{formatar(resultado['p99_ms'], 2):>10}{formatar(resultado['pico_rss_mb'], 1):>9}")
+        if base:
+            anterior = base.get((resultado['caso'], resultado['total']))
+            linha += f"{resultado['paginas_s'] / anterior['paginas_s'] - 1:>+10.1%}" if anterior else f"{'-':>10}"
+        print(linha)
+
+
+def carregar_base(caminho):
+    with open(caminho, encoding="utf-8") as ficheiro:
+        return {(r['caso'], r['total']): r for r in json.load(ficheiro)['resultados']}
+
+
+def regressoes(resultados, base, tolerancia):
+    """Casos cuja taxa de páginas/s caiu mais do que `tolerancia` (fração) em relação à base."""
+    lentos = []
+    for resultado in resultados:
+        anterior = base.get((resultado['caso'], resultado['total']))
+        if anterior and resultado['paginas_s'] < anterior['paginas_s'] * (1 - tolerancia):
+            lentos.append(resultado)
+    return lentos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark da geração de comandas.")
+    parser.add_argument("-n", "--tamanhos", type=int, nargs="+", default=[10, 1000, 10000], help="tamanhos do intervalo de números (padrão: 10 1000 10000)")
+    parser.add_argument("-c", "--casos", nargs="+", choices=list(CASOS), default=list(CASOS), help="casos a medir (padrão: todos)")
+    parser.add_argument("--processos", type=int, default=1, help="processos usados nos casos pdf_* (padrão: 1)")
+    parser.add_argument("--gravar-base", metavar="JSON", help="grava os resultados como base de comparação")
+    parser.add_argument("--comparar", metavar="JSON", help="compara com uma base gravada antes")
+    parser.add_argument("--tolerancia", type=float, default=0.10, help="queda de pág/s aceite antes de acusar regressão (padrão: 0.10)")
+    parser.add_argument("--caso", choices=list(CASOS), help=argparse.SUPPRESS)
+    argumentos = parser.parse_args(argv)
+
+    if argumentos.caso:
+        # Processo filho: mede um único caso e escreve o resultado em JSON
+        print(json.dumps(medir_caso(argumentos.caso, argumentos.tamanhos[0], argumentos.processos)))
+        return 0
+
+    base = carregar_base(argumentos.comparar) if argumentos.comparar else None
+    resultados = []
+    for total in argumentos.tamanhos:
+        for nome in argumentos.casos:
+            print(f"A medir {nome} com {total}...", file=sys.stderr)
+            resultados.append(medir_em_processo_novo(nome, total, argumentos.processos))
+    imprimir_tabela(resultados, base)
+
+    if argumentos.gravar_base:
+        with open(argumentos.gravar_base, "w", encoding="utf-8") as ficheiro:
+            json.dump({
+                'data': datetime.now().isoformat(timespec="seconds"),
+                'python': platform.python_version(),
+                'plataforma': platform.platform(),
+                'processos': argumentos.processos,
+                'resultados': resultados,
+            }, ficheiro, ensure_ascii=False, indent=2)
+        print(f"Base gravada em {argumentos.gravar_base}.")
+    if base:
+        lentos = regressoes(resultados, base, argumentos.tolerancia)
+        for resultado in lentos:
+            print(f"REGRESSÃO: {resultado['caso']} com {resultado['total']} ({resultado['paginas_s']:.1f} pág/s)")
+        return 1 if lentos else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+# ==============================
+# BIBLIOTECAS
+# ==============================
+import hashlib
+import io
+import json
+import os
+import tempfile
+from PIL import Image
+from escritor_pdf import PaginaCodificada, resolver_codificacao
+from instrumentacao import medir
+from motor import gerar_paginas, cores_sobrepostas
+
+# ===================================================================
+# CACHE EM DISCO DAS COMANDAS RENDERIZADAS
+# ===================================================================
+# Cada comanda já codificada para o PDF é guardada num ficheiro cujo nome é
+# o SHA-256 de tudo o que determina o seu conteúdo: o template, a
+# configuração completa (e o ficheiro da fonte), o modo, o dado_base, o
+# número e a codificação já resolvida (cor, compressão e paleta). Reimprimir
+# ou alargar um intervalo só renderiza os números que ainda não estão no
+# cache; mudar o layout ou a codificação muda as chaves.
+#
+# A evicção é LRU pelo mtime: cada leitura toca no ficheiro e, no fim de um
+# lote, os ficheiros mais antigos são apagados até o cache caber no limite.
+#
+# Só as páginas de uma comanda por página (PDF raster sem imposição) passam
+# pelo cache; as folhas de imposição e o PDF vetorial são montados a partir
+# da comanda em imagem, que não é guardada.
+
+# Aumentar quando a renderização mudar, para invalidar as entradas antigas
+# (2: a máscara do QR Code deixou de depender dos números já gerados)
+VERSAO_CACHE = 2
+PASTA_PADRAO = os.environ.get("GERADOR_COMANDAS_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "gerador_comandas"))
+LIMITE_PADRAO_MB = 1024
+EXTENSAO = ".pagina"
+
+
+def _assinatura_fonte(caminho_fonte):
+    """Tamanho e mtime do ficheiro da fonte: trocar o ficheiro com o mesmo nome invalida o cache."""
+    try:
+        estado = os.stat(caminho_fonte)
+    except OSError:
+        return None
+    return [estado.st_size, estado.st_mtime_ns]
+
+
+class CacheComandas:
+    """Cache de páginas codificadas numa pasta, limitado a `limite_mb` megabytes."""
+
+    def __init__(self, pasta=PASTA_PADRAO, limite_mb=LIMITE_PADRAO_MB):
+        self.pasta = pasta
+        self.limite_bytes = int(limite_mb * 1024 * 1024)
+        self.acertos = 0
+        self.falhas = 0
+        os.makedirs(pasta, exist_ok=True)
+
+    def prefixo_chave(self, modo, template_bytes, dado_base, config, codificacao):
+        """Hash de tudo o que é comum ao lote; a chave de cada número acrescenta-lhe o número."""
+        descricao = {
+            'versao': VERSAO_CACHE,
+            'template': hashlib.sha256(template_bytes).hexdigest(),
+            'config': config,
+            'fonte': _assinatura_fonte(config['caminho_fonte']),
+            'modo': modo,
+            'dado_base': dado_base,
+            'codificacao': codificacao,
+        }
+        return hashlib.sha256(json.dumps(descricao, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def caminho(self, prefixo, numero):
+        chave = hashlib.sha256(f"{prefixo}:{numero}".encode("ascii")).hexdigest()
+        return os.path.join(self.pasta, chave[:2], chave + EXTENSAO)
+
+    def ler(self, caminho):
+        """Lê uma página do cache (e marca-a como usada), ou devolve None se não existir ou estiver corrompida."""
+        try:
+            with medir("cache_ler"), open(caminho, "rb") as ficheiro:
+                cabecalho = json.loads(ficheiro.readline())
+                dados = ficheiro.read()
+            os.utime(caminho)
+        except (OSError, ValueError):
+            return None
+        return PaginaCodificada(dados, cabecalho['largura'], cabecalho['altura'], cabecalho['filtro'], cabecalho['espaco_cor'], cabecalho['bits'], cabecalho.get('parametros'))
+
+    def gravar(self, caminho, pagina):
+        """Grava a página de forma atómica (ficheiro temporário + os.replace)."""
+        with medir("cache_gravar"):
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            cabecalho = {'largura': pagina.largura, 'altura': pagina.altura, 'filtro': pagina.filtro, 'espaco_cor': pagina.espaco_cor, 'bits': pagina.bits, 'parametros': pagina.parametros}
+            descritor, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix=".tmp")
+            try:
+                with os.fdopen(descritor, "wb") as ficheiro:
+                    ficheiro.write(json.dumps(cabecalho).encode("ascii") + b"\n")
+                    ficheiro.write(pagina.dados)
+                os.replace(temporario, caminho)
+            except OSError:
+                if os.path.exists(temporario):
+                    os.remove(temporario)
+                raise
+
+    def paginas(self, modo, template_bytes, inicio, fim, dado_base, config, processos=1, codificacao=None, ao_ler=None):
+        """
+        Gerador das páginas codificadas de `inicio` a `fim`, pela ordem dos
+        números: as que já estão no cache são lidas do disco e as restantes
+        são renderizadas (em intervalos contíguos, com gerar_paginas) e
+        gravadas. Atualiza self.acertos e self.falhas. Com `ao_ler`, só os
+        códigos das comandas renderizadas são lidos (ver gerar_paginas).
+        """
+        codificacao = resolver_codificacao(codificacao, Image.open(io.BytesIO(template_bytes)), cores_sobrepostas(config))
+        prefixo = self.prefixo_chave(modo, template_bytes, dado_base, config, codificacao)
+        caminhos = {numero: self.caminho(prefixo, numero) for numero in range(inicio, fim + 1)}
+        numero = inicio
+        while numero <= fim:
+            if os.path.exists(caminhos[numero]):
+                pagina = self.ler(caminhos[numero])
+                if pagina is not None:
+                    self.acertos += 1
+                    yield pagina
+                    numero += 1
+                    continue
+            # Intervalo contíguo de números em falta: renderizado de uma só vez
+            fim_falta = numero
+            while fim_falta < fim and not os.path.exists(caminhos[fim_falta + 1]):
+                fim_falta += 1
+            renderizadas = gerar_paginas(modo, template_bytes, numero, fim_falta, dado_base, config, processos, codificacao=codificacao, ao_ler=ao_ler)
+            for atual, pagina in zip(range(numero, fim_falta + 1), renderizadas):
+                self.gravar(caminhos[atual], pagina)
+                self.falhas += 1
+                yield pagina
+            numero = fim_falta + 1
+
+    def podar(self):
+        """Apaga as páginas menos usadas até o cache caber no limite. Devolve os bytes libertados."""
+        entradas = []
+        for raiz, _, ficheiros in os.walk(self.pasta):
+            for nome in ficheiros:
+                caminho = os.path.join(raiz, nome)
+                try:
+                    estado = os.stat(caminho)
+                except OSError:
+                    continue
+                entradas.append((estado.st_mtime_ns, estado.st_size, caminho))
+        ocupado = sum(tamanho for _, tamanho, _ in entradas)
+        libertado = 0
+        for _, tamanho, caminho in sorted(entradas):
+            if ocupado - libertado <= self.limite_bytes:
+                break
+            try:
+                os.remove(caminho)
+                libertado += tamanho
+            except OSError:
+                pass
+        return libertado
@@ -0,0 +1,215 @@
+# ==============================
+# BIBLIOTECAS
+# ==============================
+import argparse
+import cProfile
+import io
+import json
+import logging
+import os
+import sys
+import time
+from PIL import Image
+from layout import carregar_layout
+from motor import gerar_paginas
+from escritor_pdf import escrever_pdf, validar_codificacao, CODIFICACAO_PADRAO
+from instrumentacao import sessao
+from cache_disco import CacheComandas, PASTA_PADRAO, LIMITE_PADRAO_MB
+from arquivo_imagens import EXTENSOES, escrever_zip_imagens, nomes_paginas
+from verificacao import RelatorioVerificacao, verificar_paginas
+
+# ===================================================================
+# LINHA DE COMANDOS
+# ===================================================================
+# Gera um lote de comandas sem o Streamlit, a partir de um template e de
+# um layout em JSON (ver layout.py), por exemplo numa tarefa do cron:
+#
+#   python cli.py template.png layout.json 1 5000 -o comandas.pdf
+#   python cli.py template.png layout.json 1 50 --imagens pasta_saida
+#   python cli.py template.png layout.json 1 500 --zip-imagens comandas.zip --formato-imagem webp
+#   python cli.py template.png layout.json 1 10000 -o comandas.pdf --cores auto --compressao auto
+#   python cli.py template.png layout.json 1 10000 -o comandas.pdf --verificar --relatorio-verificacao leitura.json
+#   python cli.py template.png layout.json 1 5000 -o comandas.pdf --metricas etapas.json --perfil lote.prof
+
+
+# Opções da linha de comandos -> valores de escritor_pdf
+CORES = {"rgb": "RGB", "l": "L", "p": "P", "1": "1", "auto": "auto"}
+COMPRESSOES = {"jpeg": "JPEG", "flate": "Flate", "ccitt": "CCITT", "auto": "auto"}
+
+
+def _argumentos(argv):
+    parser = argparse.ArgumentParser(description="Gera comandas com QR Code ou Código de Barras a partir de um template e de um layout JSON.")
+    parser.add_argument("template", help="imagem do template vazio da comanda (PNG/JPG)")
+    parser.add_argument("layout", help="ficheiro JSON com o layout (ver layout.py)")
+    parser.add_argument("inicio", type=int, help="número da primeira comanda")
+    parser.add_argument("fim", type=int, help="número da última comanda")
+    parser.add_argument("-o", "--saida", help="ficheiro PDF de saída")
+    parser.add_argument("--imagens", metavar="PASTA", help="grava também uma imagem por página nesta pasta")
+    parser.add_argument("--zip-imagens", metavar="ZIP", help="grava também um ZIP com uma imagem por página")
+    parser.add_argument("--formato-imagem", choices=[formato.lower() for formato in EXTENSOES], default="png", help="formato sem perdas das imagens (padrão: png)")
+    parser.add_argument("-p", "--processos", type=int, default=os.cpu_count() or 1, help="processos de renderização (padrão: número de núcleos)")
+    parser.add_argument("--vetorial", action="store_true", help="gera o PDF vetorial (template embutido uma única vez)")
+    parser.add_argument("--cores", choices=list(CORES), default="rgb", help="cores das páginas do PDF: rgb (padrão), l (tons de cinzento), p (paleta), 1 (preto e branco) ou auto")
+    parser.add_argument("--compressao", choices=list(COMPRESSOES), default="jpeg", help="compressão das páginas do PDF: jpeg (padrão), flate, ccitt (só com --cores 1) ou auto")
+    parser.add_argument("--qualidade-jpeg", type=int, default=CODIFICACAO_PADRAO['qualidade'], help=f"qualidade do JPEG (padrão: {CODIFICACAO_PADRAO['qualidade']})")
+    parser.add_argument("--documento", help="documento do QR Code (substitui o do layout)")
+    parser.add_argument("--tipo-documento", choices=["CNPJ", "CPF"], help="tipo do documento (substitui o do layout)")
+    parser.add_argument("--cache", metavar="PASTA", nargs="?", const=PASTA_PADRAO, help=f"reutiliza as comandas já geradas guardadas nesta pasta (padrão: {PASTA_PADRAO}); só no PDF raster sem imposição")
+    parser.add_argument("--cache-limite-mb", type=float, default=LIMITE_PADRAO_MB, help=f"tamanho máximo do cache em MB (padrão: {LIMITE_PADRAO_MB})")
+    parser.add_argument("--verificar", action="store_true", help="lê o código de cada comanda, na mesma passagem em que é gerada, e compara-o com o esperado (termina com código 1 se algum falhar)")
+    parser.add_argument("--relatorio-verificacao", metavar="JSON", help="grava o relatório da verificação neste ficheiro (implica --verificar)")
+    parser.add_argument("--metricas", metavar="JSON", help="grava o tempo por etapa (contagens e histogramas) neste ficheiro")
+    parser.add_argument("--perfil", metavar="PROF", help="grava um perfil do cProfile do processo principal (ver python -m pstats)")
+    argumentos = parser.parse_args(argv)
+    argumentos.verificar = argumentos.verificar or bool(argumentos.relatorio_verificacao)
+    if not (argumentos.saida or argumentos.imagens or argumentos.zip_imagens or argumentos.verificar):
+        parser.error("indique o PDF de saída (-o), a pasta das imagens (--imagens), o ZIP das imagens (--zip-imagens) e/ou --verificar.")
+    if argumentos.fim < argumentos.inicio:
+        parser.error("o número final tem de ser maior ou igual ao inicial.")
+    if argumentos.vetorial and not argumentos.saida:
+        parser.error("--vetorial só se aplica ao PDF (-o).")
+    argumentos.codificacao = {'cor': CORES[argumentos.cores], 'compressao': COMPRESSOES[argumentos.compressao], 'qualidade': argumentos.qualidade_jpeg}
+    try:
+        validar_codificacao(argumentos.codificacao)
+    except ValueError as erro:
+        parser.error(str(erro))
+    return argumentos
+
+
+def gravar_imagens(imagens, pasta, nomes):
+    """Grava cada imagem já codificada (bytes) na pasta. Devolve o número de ficheiros."""
+    os.makedirs(pasta, exist_ok=True)
+    total = 0
+    for dados, nome in zip(imagens, nomes):
+        with open(os.path.join(pasta, nome), "wb") as ficheiro:
+            ficheiro.write(dados)
+        total += 1
+    return total
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    argumentos = _argumentos(argv)
+    try:
+        layout = carregar_layout(argumentos.layout)
+        if argumentos.documento is not None:
+            layout.documento = argumentos.documento
+        if argumentos.tipo_documento is not None:
+            layout.tipo_documento = argumentos.tipo_documento
+        dado_base = layout.dado_base
+    except (OSError, ValueError, TypeError) as erro:
+        logging.error("Layout inválido: %s", erro)
+        return 2
+    try:
+        with open(argumentos.template, "rb") as ficheiro:
+            template_bytes = ficheiro.read()
+        # Descodifica já o template, para que uma imagem ilegível não falhe a meio do lote
+        Image.open(io.BytesIO(template_bytes)).load()
+    except OSError as erro:
+        logging.error("Template inválido (%s): %s", argumentos.template, erro)
+        return 2
+
+    config = layout.config.como_dict()
+    imposicao = layout.imposicao
+    inicio, fim = argumentos.inicio, argumentos.fim
+    perfil = cProfile.Profile() if argumentos.perfil else None
+    tempo_inicial = time.perf_counter()
+    with sessao() as metricas:
+        if perfil:
+            perfil.enable()
+        relatorio = RelatorioVerificacao() if argumentos.verificar else None
+        try:
+            total = _gerar(argumentos, layout, template_bytes, dado_base, config, imposicao, relatorio)
+            if relatorio is not None:
+                _verificar(argumentos, layout, template_bytes, dado_base, config, relatorio)
+        except ValueError as erro:
+            logging.error("%s", erro)
+            return 2
+        finally:
+            if perfil:
+                perfil.disable()
+    if perfil:
+        perfil.dump_stats(argumentos.perfil)
+        logging.info("Perfil gravado em %s.", argumentos.perfil)
+    if argumentos.metricas:
+        metricas.gravar_json(argumentos.metricas)
+        for linha in metricas.resumo()[:5]:
+            logging.info("%-22s %6.1f%%  %9.1f ms  (%d x)", linha['etapa'], linha['percentagem'], linha['total_ms'], linha['contagem'])
+        logging.info("Métricas gravadas em %s.", argumentos.metricas)
+    if relatorio is not None and relatorio.falhas:
+        for falha in relatorio.exemplos_falhas[:5]:
+            logging.error("Comanda %d: %s (lido: %r).", falha['numero'], falha['erro'], falha['lido'])
+        logging.error("Verificação: %d de %d códigos falharam.", relatorio.falhas, relatorio.total)
+        return 1
+    if not total and relatorio is None:
+        logging.error("Nenhuma comanda pôde ser gerada (verifique 'caminho_fonte').")
+        return 1
+    if relatorio is not None:
+        logging.info("Verificação: os %d códigos foram lidos corretamente.", relatorio.total)
+        if relatorio.total < fim - inicio + 1:
+            logging.info("As %d comandas reutilizadas do cache não foram lidas de novo.", fim - inicio + 1 - relatorio.total)
+    logging.info("%d comandas em %.1f s.", fim - inicio + 1, time.perf_counter() - tempo_inicial)
+    return 0
+
+
+def _leitura_na_geracao(argumentos):
+    """True se alguma saída passa pelas comandas em imagem, onde os códigos são lidos na mesma passagem."""
+    return bool((argumentos.saida and not argumentos.vetorial) or argumentos.imagens or argumentos.zip_imagens)
+
+
+def _gerar(argumentos, layout, template_bytes, dado_base, config, imposicao, relatorio=None):
+    """
+    Escreve o PDF e/ou as imagens pedidas. Devolve o número de páginas
+    geradas. Com `relatorio`, os códigos são lidos na primeira saída que
+    renderiza as comandas em imagem.
+    """
+    inicio, fim = argumentos.inicio, argumentos.fim
+    total = 0
+    ao_ler = relatorio.registar if relatorio is not None else None
+    if argumentos.saida:
+        with open(argumentos.saida, "wb") as destino:
+            if argumentos.vetorial:
+                from pdf_vetorial import escrever_pdf_vetorial
+                total = escrever_pdf_vetorial(layout.modo, template_bytes, inicio, fim, dado_base, config, destino, imposicao, codificacao=argumentos.codificacao)
+            elif argumentos.cache and not imposicao:
+                cache = CacheComandas(argumentos.cache, argumentos.cache_limite_mb)
+                total = escrever_pdf(cache.paginas(layout.modo, template_bytes, inicio, fim, dado_base, config, argumentos.processos, argumentos.codificacao, ao_ler), destino)
+                ao_ler = None
+                cache.podar()
+                logging.info("Cache: %d comandas reutilizadas, %d renderizadas.", cache.acertos, cache.falhas)
+            else:
+                paginas = gerar_paginas(layout.modo, template_bytes, inicio, fim, dado_base, config, argumentos.processos, imposicao, codificacao=argumentos.codificacao, ao_ler=ao_ler)
+                total = escrever_pdf(paginas, destino, imposicao['dpi'] if imposicao else 72.0)
+                ao_ler = None
+        logging.info("PDF %s com %d páginas.", argumentos.saida, total)
+    formato = argumentos.formato_imagem.upper()
+    if argumentos.imagens:
+        imagens = gerar_paginas(layout.modo, template_bytes, inicio, fim, dado_base, config, argumentos.processos, imposicao, formato, ao_ler=ao_ler)
+        total = gravar_imagens(imagens, argumentos.imagens, nomes_paginas(inicio, formato, imposicao))
+        ao_ler = None
+        logging.info("%d imagens %s em %s.", total, formato, argumentos.imagens)
+    if argumentos.zip_imagens:
+        imagens = gerar_paginas(layout.modo, template_bytes, inicio, fim, dado_base, config, argumentos.processos, imposicao, formato, ao_ler=ao_ler)
+        with open(argumentos.zip_imagens, "wb") as destino:
+            total = escrever_zip_imagens(imagens, destino, nomes_paginas(inicio, formato, imposicao))
+        logging.info("ZIP %s com %d imagens %s.", argumentos.zip_imagens, total, formato)
+    return total
+
+
+def _verificar(argumentos, layout, template_bytes, dado_base, config, relatorio):
+    """
+    Completa o relatório da verificação (ver verificacao.py) e grava-o, se
+    pedido. Se nenhuma saída leu os códigos (PDF vetorial ou só
+    --verificar), as comandas são renderizadas à parte para a leitura.
+    """
+    if not _leitura_na_geracao(argumentos):
+        for leitura in verificar_paginas(layout.modo, template_bytes, argumentos.inicio, argumentos.fim, dado_base, config, argumentos.processos):
+            relatorio.registar(leitura)
+    if argumentos.relatorio_verificacao:
+        with open(argumentos.relatorio_verificacao, "w", encoding="utf-8") as ficheiro:
+            json.dump(relatorio.como_dict(), ficheiro, ensure_ascii=False, indent=2)
+        logging.info("Relatório da verificação gravado em %s.", argumentos.relatorio_verificacao)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+# ==============================
+# BIBLIOTECAS
+# ==============================
+import functools
+import io
+import zlib
+from collections import namedtuple
+from PIL import Image, ImageColor
+from instrumentacao import medir
+
+# ===================================================================
+# ESCRITA INCREMENTAL DE PDF
+# ===================================================================
+# O Pillow só grava PDFs multipágina a partir de uma lista completa de
+# imagens (save_all + append_images), o que obriga a manter todas as
+# comandas em memória. Aqui cada página é codificada, escrita no destino
+# e descartada; no fim são escritos a árvore de páginas, o catálogo e a
+# tabela xref.
+
+# `espaco_cor` é o nome de um espaço de cor (sem a barra) ou um array PDF
+# completo ("[/Indexed ...]"); `parametros` é o dicionário /DecodeParms, se houver.
+PaginaCodificada = namedtuple("PaginaCodificada", ["dados", "largura", "altura", "filtro", "espaco_cor", "bits", "parametros"], defaults=[None])
+
+# ===================================================================
+# CODIFICAÇÃO DAS PÁGINAS
+# ===================================================================
+# Uma comanda costuma ter poucas cores planas e o código é preto e branco,
+# por isso guardar cada página em RGB de 24 bits com JPEG desperdiça
+# memória, tempo e espaço. A codificação de um lote é um dicionário:
+#   'cor':        "RGB", "L" (tons de cinzento), "P" (paleta até 256 cores),
+#                 "1" (preto e branco) ou "auto";
+#   'compressao': "JPEG" (só RGB e L), "Flate" (sem perdas), "CCITT" (G4,
+#                 só preto e branco) ou "auto";
+#   'qualidade':  qualidade do JPEG.
+# O padrão é o comportamento de sempre (RGB em JPEG de qualidade 75).
+#
+# resolver_codificacao concretiza "auto" e calcula a paleta uma única vez
+# por lote, a partir do template e das cores desenhadas por cima (código e
+# texto); o resultado só depende do layout, por isso cada página sai igual
+# seja qual for o bloco ou o processo que a codifica. Os píxeis que não
+# estão na paleta (as margens suavizadas do texto) ficam com a cor mais
+# próxima.
+
+CODIFICACAO_PADRAO = {'cor': "RGB", 'compressao': "JPEG", 'qualidade': 75}
+MODOS_COR = ("auto", "RGB", "L", "P", "1")
+COMPRESSOES = ("auto", "JPEG", "Flate", "CCITT")
+COMPRESSOES_POR_COR = {"RGB": ("JPEG", "Flate"), "L": ("JPEG", "Flate"), "P": ("Flate",), "1": ("Flate", "CCITT")}
+COMPRESSAO_AUTOMATICA = {"RGB": "JPEG", "L": "Flate", "P": "Flate", "1": "CCITT"}
+CORES_PALETA = 256
+LIMIAR_1BIT = [0] * 128 + [255] * 128
+# Nível do zlib no Flate: nas páginas de cores planas o nível 3 é ~3x mais
+# rápido do que o padrão (6) e o ficheiro só cresce ~15%
+NIVEL_FLATE = 3
+
+
+def validar_codificacao(codificacao):
+    """Levanta ValueError se a cor ou a compressão forem desconhecidas ou incompatíveis entre si."""
+    cor, compressao = codificacao['cor'], codificacao['compressao']
+    if cor not in MODOS_COR:
+        raise ValueError(f"Cor das páginas desconhecida: {cor!r} (use um de {', '.join(MODOS_COR)}).")
+    if compressao not in COMPRESSOES:
+        raise ValueError(f"Compressão desconhecida: {compressao!r} (use uma de {', '.join(COMPRESSOES)}).")
+    if cor != "auto" and compressao != "auto" and compressao not in COMPRESSOES_POR_COR[cor]:
+        raise ValueError(f"A compressão {compressao} não serve para páginas em {cor} (use {' ou '.join(COMPRESSOES_POR_COR[cor])}).")
+    if not 1 <= codificacao['qualidade'] <= 95:
+        raise ValueError("A qualidade do JPEG deve estar entre 1 e 95.")
+
+
+def _cor_automatica(cores):
+    """Modo mais compacto que representa `cores` (conjunto de RGB, ou None se forem mais de 256) sem perdas."""
+    if cores is None:
+        return "RGB"
+    if cores <= {(0, 0, 0), (255, 255, 255)}:
+        return "1"
+    if all(r == g == b for r, g, b in cores):
+        return "L"
+    return "P"
+
+
+def resolver_codificacao(codificacao, template, cores_extra=()):
+    """
+    Codificação concreta de um lote: `template` é a imagem PIL do template e
+    `cores_extra` as cores (nomes ou #RRGGBB) desenhadas por cima. Escolhe a
+    cor e a compressão em "auto" e calcula a paleta para "P". Devolve um novo
+    dicionário (que pode voltar a ser resolvido sem mudar). Levanta ValueError.
+    """
+    codificacao = {**CODIFICACAO_PADRAO, **(codificacao or {})}
+    validar_codificacao(codificacao)
+    if codificacao['cor'] in ("auto", "P") and 'paleta' not in codificacao:
+        with medir("resolver_codificacao"):
+            rgb = template.convert("RGB")
+            extras = {ImageColor.getrgb(cor)[:3] for cor in cores_extra}
+            contagens = rgb.getcolors(CORES_PALETA)
+            cores = {cor for _, cor in contagens} | extras if contagens else None
+            if cores is not None and len(cores) > CORES_PALETA:
+                cores = None
+            if codificacao['cor'] == "auto":
+                codificacao['cor'] = _cor_automatica(cores)
+            if codificacao['cor'] == "P":
+                if cores is None:
+                    # Template com muitas cores: as mais representativas, mais as do código e do texto
+                    reduzido = rgb.quantize(CORES_PALETA - len(extras), dither=Image.Dither.NONE)
+                    cores = {tuple(reduzido.getpalette()[i:i + 3]) for i in range(0, 3 * (CORES_PALETA - len(extras)), 3)} | extras
+                codificacao['paleta'] = [componente for cor in sorted(cores) for componente in cor]
+    if codificacao['compressao'] == "auto":
+        codificacao['compressao'] = COMPRESSAO_AUTOMATICA[codificacao['cor']]
+    validar_codificacao(codificacao)
+    return codificacao
+
+
+@functools.lru_cache(maxsize=8)
+def _imagem_paleta(paleta):
+    imagem = Image.new("P", (1, 1))
+    imagem.putpalette(paleta)
+    return imagem
+
+
+def _converter(imagem, codificacao):
+    """A imagem no modo de cor da codificação."""
+    cor = codificacao['cor']
+    if cor == "RGB":
+        if imagem.mode not in ("RGB", "L"):
+            with medir("converter_rgb"):
+                imagem = imagem.convert("RGB")
+        return imagem
+    with medir("converter_cor"):
+        if cor == "L":
+            return imagem.convert("L")
+        if cor == "1":
+            return imagem.convert("L").point(LIMIAR_1BIT, "1")
+        if imagem.mode != "RGB":
+            imagem = imagem.convert("RGB")
+        return imagem.quantize(palette=_imagem_paleta(tuple(codificacao['paleta'])), dither=Image.Dither.NONE)
+
+
+def _ccitt_g4(imagem):
+    """Dados CCITT G4 de uma imagem em modo 1, tirados da única faixa de um TIFF do Pillow."""
+    buffer = io.BytesIO()
+    imagem.save(buffer, format="TIFF", compression="group4", tiffinfo={278: imagem.height})
+    tiff = Image.open(buffer)
+    inicio, tamanho = tiff.tag_v2[273][0], tiff.tag_v2[279][0]
+    return buffer.getvalue()[inicio:inicio + tamanho]
+
+
+def codificar_pagina(imagem, codificacao=None):
+    """
+    Codifica uma imagem para uma página de PDF com a `codificacao` já
+    resolvida (ver resolver_codificacao); sem ela, tal como o Pillow faria
+    (JPEG para RGB e tons de cinzento). Devolve uma PaginaCodificada.
+    """
+    codificacao = codificacao or CODIFICACAO_PADRAO
+    imagem = _converter(imagem, codificacao)
+    compressao = codificacao['compressao']
+    parametros = None
+    with medir("codificar_pdf"):
+        if compressao == "JPEG":
+            buffer = io.BytesIO()
+            imagem.save(buffer, format="JPEG", quality=codificacao['qualidade'])
+            dados, filtro = buffer.getvalue(), "DCTDecode"
+        elif compressao == "CCITT":
+            dados, filtro = _ccitt_g4(imagem), "CCITTFaxDecode"
+            parametros = f"<< /K -1 /Columns {imagem.width} /Rows {imagem.height} /BlackIs1 true >>"
+        else:
+            dados, filtro = zlib.compress(imagem.tobytes(), NIVEL_FLATE), "FlateDecode"
+    if imagem.mode == "P":
+        paleta = imagem.getpalette()
+        espaco_cor = f"[/Indexed /DeviceRGB {len(paleta) // 3 - 1} <{bytes(paleta).hex()}>]"
+    else:
+        espaco_cor = "DeviceRGB" if imagem.mode == "RGB" else "DeviceGray"
+    return PaginaCodificada(dados, imagem.width, imagem.height, filtro, espaco_cor, 1 if imagem.mode == "1" else 8, parametros)
+
+# ===================================================================
+# ESCRITOR
+# ===================================================================
+
+
+class EscritorPdf:
+    """
+    Escreve um PDF página a página num ficheiro binário já aberto
+    (ficheiro temporário, BytesIO, ...). Só a página atual fica em memória.
+    """
+
+    ID_CATALOGO = 1
+    ID_PAGINAS = 2
+
+    def __init__(self, destino, resolucao=72.0):
+        self.destino = destino
+        self.resolucao = resolucao
+        self.deslocamentos = {}
+        self.paginas = []
+        self.proximo_id = 3
+        self.fechado = False
+        self.destino.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo_excecao, excecao, traceback):
+        if tipo_excecao is None:
+            self.fechar()
+
+    def _novo_id(self):
+        id_objeto = self.proximo_id
+        self.proximo_id += 1
+        return id_objeto
+
+    def _escrever_objeto(self, id_objeto, entradas, stream=None):
+        """Escreve `<< entradas >>` (e o stream, se houver) como objeto indireto."""
+        with medir("escrever_pdf"):
+            self.deslocamentos[id_objeto] = self.destino.tell()
+            if stream is not None:
+                entradas = f"{entradas} /Length {len(stream)}".strip()
+            self.destino.write(f"{id_objeto} 0 obj\n<< {entradas} >>\n".encode("latin-1"))
+            if stream is not None:
+                self.destino.write(b"stream\n")
+                self.destino.write(stream)
+                self.destino.write(b"\nendstream\n")
+            self.destino.write(b"endobj\n")
+
+    def adicionar_objeto(self, entradas, stream=None):
+        """Escreve um novo objeto indireto e devolve o seu número."""
+        id_objeto = self._novo_id()
+        self._escrever_objeto(id_objeto, entradas, stream)
+        return id_objeto
+
+    def adicionar_xobject_imagem(self, pagina):
+        """Escreve uma imagem já codificada como XObject, para ser usada em várias páginas."""
+        espaco_cor = pagina.espaco_cor if pagina.espaco_cor.startswith("[") else "/" + pagina.espaco_cor
+        parametros = f" /DecodeParms {pagina.parametros}" if pagina.parametros else ""
+        return self.adicionar_objeto(
+            f"/Type /XObject /Subtype /Image /Width {pagina.largura} /Height {pagina.altura} "
+            f"/ColorSpace {espaco_cor} /BitsPerComponent {pagina.bits} /Filter /{pagina.filtro}{parametros}",
+            pagina.dados,
+        )
+
+    def adicionar_pagina(self, largura_pt, altura_pt, recursos, conteudo, comprimir=False):
+        """
+        Escreve uma página com o dicionário de recursos e o conteúdo (bytes)
+        dados; com `comprimir`, o conteúdo é guardado com FlateDecode.
+        """
+        if comprimir:
+            with medir("codificar_pdf"):
+                conteudo = zlib.compress(conteudo)
+            id_conteudo = self.adicionar_objeto("/Filter /FlateDecode", conteudo)
+        else:
+            id_conteudo = self.adicionar_objeto("", conteudo)
+        self.paginas.append(self.adicionar_objeto(
+            f"/Type /Page /Parent {self.ID_PAGINAS} 0 R /Resources << {recursos} >> "
+            f"/MediaBox [0 0 {largura_pt:f} {altura_pt:f}] /Contents {id_conteudo} 0 R"
+        ))
+
+    def adicionar_imagem(self, imagem):
+        """Codifica e escreve uma imagem como uma nova página."""
+        self.adicionar_pagina_codificada(codificar_pagina(imagem))
+
+    def adicionar_pagina_codificada(self, pagina):
+        """Escreve uma página já codificada por codificar_pagina."""
+        escala = 72.0 / self.resolucao
+        largura_pt, altura_pt = pagina.largura * escala, pagina.altura * escala
+        id_imagem = self.adicionar_xobject_imagem(pagina)
+        conteudo = f"q {largura_pt:f} 0 0 {altura_pt:f} 0 0 cm /image Do Q\n".encode("latin-1")
+        procset = "/ImageC" if pagina.espaco_cor == "DeviceRGB" else "/ImageI" if pagina.espaco_cor.startswith("[") else "/ImageB"
+        self.adicionar_pagina(largura_pt, altura_pt, f"/ProcSet [/PDF {procset}] /XObject << /image {id_imagem} 0 R >>", conteudo)
+
+    def fechar(self):
+        """Escreve a árvore de páginas, o catálogo, a xref e o trailer."""
+        if self.fechado:
+            return
+        filhos = " ".join(f"{id_pagina} 0 R" for id_pagina in self.paginas)
+        self._escrever_objeto(self.ID_PAGINAS, f"/Type /Pages /Kids [{filhos}] /Count {len(self.paginas)}")
+        self._escrever_objeto(self.ID_CATALOGO, f"/Type /Catalog /Pages {self.ID_PAGINAS} 0 R")
+
+        inicio_xref = self.destino.tell()
+        total = self.proximo_id
+        linhas = [f"xref\n0 {total}\n", "0000000000 65535 f \n"]
+        for id_objeto in range(1, total):
+            linhas.append(f"{self.deslocamentos[id_objeto]:010d} 00000 n \n")
+        linhas.append(f"trailer\n<< /Size {total} /Root {self.ID_CATALOGO} 0 R >>\nstartxref\n{inicio_xref}\n%%EOF\n")
+        self.destino.write("".join(linhas).encode("latin-1"))
+        self.destino.flush()
+        self.fechado = True
+
+
+def escrever_pdf(paginas, destino, resolucao=72.0):
+    """
+    Consome um iterável de imagens ou de PaginaCodificada (tipicamente um
+    gerador) e escreve-as como páginas de um PDF em `destino`. Devolve o
+    número de páginas.
+    """
+    escritor = EscritorPdf(destino, resolucao)
+    for pagina in paginas:
+        if isinstance(pagina, PaginaCodificada):
+            escritor.adicionar_pagina_codificada(pagina)
+        else:
+            escritor.adicionar_imagem(pagina)
+    escritor.fechar()
+    return len(escritor.paginas)
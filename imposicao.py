@@ -0,0 +1,130 @@
+# ==============================
+# BIBLIOTECAS
+# ==============================
+from PIL import Image, ImageDraw
+from instrumentacao import medir
+
+# ===================================================================
+# IMPOSIÇÃO: VÁRIAS COMANDAS POR FOLHA
+# ===================================================================
+# As comandas são distribuídas numa grelha de colunas x linhas sobre uma
+# folha A4/A3 à resolução de impressão. Cada comanda é reduzida ao tamanho
+# de corte que cabe na célula e a arte é ampliada até cobrir também a
+# sangria; as marcas de corte ficam fora da sangria, nos espaços entre
+# células. A folha é um único buffer reutilizado: as marcas são desenhadas
+# uma vez na base e cada comanda cobre por inteiro a sua caixa de sangria.
+#
+# Configuração (dicionário):
+#   folha         "A4" ou "A3"
+#   paisagem      True para a folha deitada
+#   colunas       número de colunas da grelha
+#   linhas        número de linhas da grelha
+#   dpi           resolução da folha
+#   margem_mm     margem da folha
+#   espaco_mm     espaço entre células
+#   sangria_mm    sangria à volta de cada comanda
+#   marcas_corte  True para desenhar as marcas de corte
+
+FOLHAS_MM = {"A4": (210, 297), "A3": (297, 420)}
+IMPOSICAO_PADRAO = {'folha': "A4", 'paisagem': False, 'colunas': 3, 'linhas': 2, 'dpi': 300, 'margem_mm': 10.0, 'espaco_mm': 10.0, 'sangria_mm': 2.0, 'marcas_corte': True}
+COMPRIMENTO_MARCA_MM = 5
+ESPESSURA_MARCA_PT = 0.25
+
+
+def mm_para_px(milimetros, dpi):
+    return milimetros * dpi / 25.4
+
+
+class Imposicao:
+    """
+    Geometria de uma folha de imposição para comandas de largura_arte x
+    altura_arte px. As medidas são guardadas em px (float) à resolução da
+    folha, para servirem tanto à folha raster como ao PDF vetorial.
+    """
+
+    def __init__(self, config, largura_arte, altura_arte):
+        self.config = config
+        self.dpi = config['dpi']
+        largura_mm, altura_mm = FOLHAS_MM[config['folha']]
+        if config['paisagem']:
+            largura_mm, altura_mm = altura_mm, largura_mm
+        self.largura = round(mm_para_px(largura_mm, self.dpi))
+        self.altura = round(mm_para_px(altura_mm, self.dpi))
+        margem, espaco, sangria = (mm_para_px(config[chave], self.dpi) for chave in ('margem_mm', 'espaco_mm', 'sangria_mm'))
+        colunas, linhas = config['colunas'], config['linhas']
+
+        celula_w = (self.largura - 2 * margem - (colunas - 1) * espaco) / colunas
+        celula_h = (self.altura - 2 * margem - (linhas - 1) * espaco) / linhas
+        escala_corte = min((celula_w - 2 * sangria) / largura_arte, (celula_h - 2 * sangria) / altura_arte)
+        if escala_corte <= 0:
+            raise ValueError("As comandas não cabem na folha com estas margens, espaços, sangria e grelha.")
+        self.corte_w, self.corte_h = largura_arte * escala_corte, altura_arte * escala_corte
+        self.sangria = sangria
+
+        # A arte cobre a caixa de sangria mantendo a proporção; o excesso fica de fora, centrado
+        self.escala = max((self.corte_w + 2 * sangria) / largura_arte, (self.corte_h + 2 * sangria) / altura_arte)
+        self.tamanho_sangria = (round(self.corte_w + 2 * sangria), round(self.corte_h + 2 * sangria))
+        origem_w, origem_h = self.tamanho_sangria[0] / self.escala, self.tamanho_sangria[1] / self.escala
+        # (limitada à arte: o arredondamento da caixa de sangria pode excedê-la em fração de pixel)
+        self.caixa_origem = (max(0, (largura_arte - origem_w) / 2), max(0, (altura_arte - origem_h) / 2), min(largura_arte, (largura_arte + origem_w) / 2), min(altura_arte, (altura_arte + origem_h) / 2))
+
+        # Caixa de corte de cada célula, pela ordem de leitura (linhas de cima para baixo)
+        self.caixas_corte = []
+        for linha in range(linhas):
+            for coluna in range(colunas):
+                centro_x = margem + coluna * (celula_w + espaco) + celula_w / 2
+                centro_y = margem + linha * (celula_h + espaco) + celula_h / 2
+                self.caixas_corte.append((centro_x - self.corte_w / 2, centro_y - self.corte_h / 2, centro_x + self.corte_w / 2, centro_y + self.corte_h / 2))
+        self.posicoes = [(round(x0 - sangria), round(y0 - sangria)) for x0, y0, _, _ in self.caixas_corte]
+        self.por_folha = len(self.caixas_corte)
+        self.espessura_marca = max(1, round(ESPESSURA_MARCA_PT / 72 * self.dpi))
+        self.folha_base = None
+
+    def marcas_corte(self):
+        """Segmentos ((x0, y0), (x1, y1)) das marcas de corte, a começar fora da sangria."""
+        if not self.config['marcas_corte']:
+            return []
+        comprimento = mm_para_px(COMPRIMENTO_MARCA_MM, self.dpi)
+        d = self.sangria
+        segmentos = []
+        for x0, y0, x1, y1 in self.caixas_corte:
+            for y in (y0, y1):
+                segmentos.append(((x0 - d - comprimento, y), (x0 - d, y)))
+                segmentos.append(((x1 + d, y), (x1 + d + comprimento, y)))
+            for x in (x0, x1):
+                segmentos.append(((x, y0 - d - comprimento), (x, y0 - d)))
+                segmentos.append(((x, y1 + d), (x, y1 + d + comprimento)))
+        return segmentos
+
+    def _base(self):
+        """Folha branca com as marcas de corte, criada uma única vez."""
+        if self.folha_base is None:
+            self.folha_base = Image.new("RGB", (self.largura, self.altura), "white")
+            draw = ImageDraw.Draw(self.folha_base)
+            for segmento in self.marcas_corte():
+                draw.line(segmento, fill="black", width=self.espessura_marca)
+        return self.folha_base
+
+    def impor(self, paginas):
+        """
+        Consome um iterável de comandas (imagens) e devolve um gerador de
+        folhas preenchidas pela ordem de leitura. A folha devolvida é o
+        buffer da imposição: só é válida até à folha seguinte.
+        """
+        base = self._base()
+        folha = base.copy()
+        ocupadas = 0
+        for pagina in paginas:
+            with medir("impor"):
+                arte = pagina.resize(self.tamanho_sangria, Image.Resampling.LANCZOS, box=self.caixa_origem)
+                folha.paste(arte, self.posicoes[ocupadas])
+            ocupadas += 1
+            if ocupadas == self.por_folha:
+                yield folha
+                ocupadas = 0
+        if ocupadas:
+            # Última folha incompleta: repõe as células que ficaram da folha anterior
+            for x, y in self.posicoes[ocupadas:]:
+                caixa = (x, y, x + self.tamanho_sangria[0], y + self.tamanho_sangria[1])
+                folha.paste(base.crop(caixa), caixa[:2])
+            yield folha
@@ -0,0 +1,168 @@
+# ==============================
+# BIBLIOTECAS
+# ==============================
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# ===================================================================
+# INSTRUMENTAÇÃO POR ETAPA
+# ===================================================================
+# Cada etapa do caminho crítico (descodificar o template, codificar o QR
+# Code, colar, desenhar o texto, codificar o PDF, ...) é envolvida em
+# `with medir("etapa"):`. Só há registo dentro de uma `sessao()`, e a sessão
+# é por thread: cada execução do Streamlit corre na sua própria thread, por
+# isso lotes de sessões diferentes não se misturam. Fora de uma sessão,
+# medir() devolve um contexto vazio e o custo é uma consulta a um atributo.
+#
+# Os processos de renderização em paralelo abrem a sua própria sessão e
+# devolvem as métricas de cada bloco, que são somadas às da sessão principal
+# (Metricas.juntar).
+
+# Limites superiores (ms) dos intervalos do histograma; o último é aberto
+LIMITES_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_local = threading.local()
+
+
+class Metricas:
+    """Contadores e histogramas de latência por etapa."""
+
+    def __init__(self):
+        self.etapas = {}
+
+    def registar(self, etapa, segundos):
+        dados = self.etapas.get(etapa)
+        if dados is None:
+            dados = self.etapas[etapa] = {'contagem': 0, 'total_s': 0.0, 'max_s': 0.0, 'histograma': [0] * (len(LIMITES_MS) + 1)}
+        dados['contagem'] += 1
+        dados['total_s'] += segundos
+        if segundos > dados['max_s']:
+            dados['max_s'] = segundos
+        dados['histograma'][bisect.bisect_left(LIMITES_MS, segundos * 1000)] += 1
+
+    def juntar(self, outras):
+        """Soma as métricas de outro processo (um dicionário de como_dict ou outro Metricas)."""
+        etapas = outras.etapas if isinstance(outras, Metricas) else outras
+        for etapa, dados in etapas.items():
+            atual = self.etapas.get(etapa)
+            if atual is None:
+                self.etapas[etapa] = {**dados, 'histograma': list(dados['histograma'])}
+                continue
+            atual['contagem'] += dados['contagem']
+            atual['total_s'] += dados['total_s']
+            atual['max_s'] = max(atual['max_s'], dados['max_s'])
+            atual['histograma'] = [a + b for a, b in zip(atual['histograma'], dados['histograma'])]
+
+    def como_dict(self):
+        """Dados brutos (serializáveis), para enviar entre processos ou gravar."""
+        return {etapa: {**dados, 'histograma': list(dados['histograma'])} for etapa, dados in self.etapas.items()}
+
+    @staticmethod
+    def _percentil_ms(histograma, fracao):
+        """Limite superior do intervalo do histograma que contém o percentil."""
+        alvo = fracao * sum(histograma)
+        acumulado = 0
+        for indice, quantidade in enumerate(histograma):
+            acumulado += quantidade
+            if quantidade and acumulado >= alvo:
+                return LIMITES_MS[indice] if indice < len(LIMITES_MS) else None
+        return None
+
+    def resumo(self):
+        """
+        Uma linha por etapa, da mais demorada para a menos demorada, com
+        contagem, tempo total, média, p50/p99 (limite do intervalo do
+        histograma; None no intervalo aberto) e máximo, em ms.
+        """
+        tempo_total = sum(dados['total_s'] for dados in self.etapas.values()) or 1.0
+        linhas = []
+        for etapa, dados in sorted(self.etapas.items(), key=lambda item: -item[1]['total_s']):
+            linhas.append({
+                'etapa': etapa,
+                'contagem': dados['contagem'],
+                'total_ms': round(dados['total_s'] * 1000, 1),
+                'percentagem': round(100 * dados['total_s'] / tempo_total, 1),
+                'media_ms': round(dados['total_s'] * 1000 / dados['contagem'], 3),
+                'p50_ms': self._percentil_ms(dados['histograma'], 0.50),
+                'p99_ms': self._percentil_ms(dados['histograma'], 0.99),
+                'max_ms': round(dados['max_s'] * 1000, 3),
+            })
+        return linhas
+
+    def gravar_json(self, destino):
+        """Grava o resumo e os histogramas em JSON (`destino`: caminho ou ficheiro de texto)."""
+        dados = {'limites_ms': list(LIMITES_MS), 'resumo': self.resumo(), 'etapas': self.como_dict()}
+        if isinstance(destino, str):
+            with open(destino, "w", encoding="utf-8") as ficheiro:
+                json.dump(dados, ficheiro, ensure_ascii=False, indent=2)
+        else:
+            json.dump(dados, destino, ensure_ascii=False, indent=2)
+
+
+class _Medicao:
+    __slots__ = ("metricas", "etapa", "inicio")
+
+    def __init__(self, metricas, etapa):
+        self.metricas = metricas
+        self.etapa = etapa
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+
+    def __exit__(self, tipo_excecao, excecao, traceback):
+        self.metricas.registar(self.etapa, time.perf_counter() - self.inicio)
+
+
+class _SemMedicao:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, tipo_excecao, excecao, traceback):
+        pass
+
+
+_SEM_MEDICAO = _SemMedicao()
+
+
+def medir(etapa):
+    """Contexto que regista a duração do bloco em `etapa`, se houver uma sessão ativa nesta thread."""
+    metricas = getattr(_local, "metricas", None)
+    if metricas is None:
+        return _SEM_MEDICAO
+    return _Medicao(metricas, etapa)
+
+
+def metricas_atuais():
+    """Metricas da sessão ativa nesta thread, ou None."""
+    return getattr(_local, "metricas", None)
+
+
+def ativar():
+    """Abre uma sessão nesta thread (sem a fechar); usado nos processos de renderização."""
+    _local.metricas = Metricas()
+    return _local.metricas
+
+
+def recolher():
+    """Devolve e reinicia as métricas da sessão ativa (dicionário), ou None se não houver sessão."""
+    metricas = getattr(_local, "metricas", None)
+    if metricas is None:
+        return None
+    _local.metricas = Metricas()
+    return metricas.como_dict()
+
+
+@contextmanager
+def sessao():
+    """Ativa a instrumentação nesta thread durante o bloco e devolve as Metricas recolhidas."""
+    anterior = getattr(_local, "metricas", None)
+    metricas = _local.metricas = Metricas()
+    try:
+        yield metricas
+    finally:
+        _local.metricas = anterior
@@ -0,0 +1,159 @@
+# ==============================
+# BIBLIOTECAS
+# ==============================
+import json
+import os
+from dataclasses import dataclass, asdict, fields
+from typing import ClassVar, Optional
+from motor import MODO_QRCODE, MODO_BARRAS, aplicar_mascara_qrcode
+from imposicao import FOLHAS_MM, IMPOSICAO_PADRAO
+
+# ===================================================================
+# LAYOUT DAS COMANDAS
+# ===================================================================
+# As configurações de cada modo como objetos tipados. O motor continua a
+# receber dicionários (como_dict), que são o formato passado aos processos
+# de renderização; estas classes só validam e documentam os campos, e
+# permitem guardar e ler o layout em JSON para a linha de comandos.
+#
+# Formato do ficheiro de layout:
+#   {
+#     "modo": "QR Code" | "Código de Barras",
+#     "tipo_documento": "CNPJ", "documento": "...",   (só QR Code)
+#     "imposicao": {...},                             (opcional, ver imposicao.py)
+#     ...campos de ConfigQrCode ou ConfigCodigoBarras
+#   }
+
+ROTACOES = (0, 90, 180, 270)
+
+
+def _validar_rotacoes(config, *campos):
+    for campo in campos:
+        if getattr(config, campo) not in ROTACOES:
+            raise ValueError(f"'{campo}' deve ser um de {ROTACOES}, não {getattr(config, campo)!r}.")
+
+
+@dataclass
+class ConfigQrCode:
+    """Posições e tamanhos (em px do template) de uma comanda com QR Code."""
+    modo: ClassVar[str] = MODO_QRCODE
+
+    caminho_fonte: str
+    tamanho_qr: int = 450
+    qr_x: int = 540
+    qr_y: int = 1035
+    tamanho_texto: int = 150
+    texto_x: int = 533
+    texto_y: int = 1445
+    cor_texto: str = "#000000"
+    rotacao_qr: int = 0
+    rotacao_texto: int = 0
+
+    def __post_init__(self):
+        _validar_rotacoes(self, 'rotacao_qr', 'rotacao_texto')
+
+    def como_dict(self):
+        """Dicionário de configuração no formato usado por motor.py."""
+        return asdict(self)
+
+
+@dataclass
+class ConfigCodigoBarras:
+    """Posições, tamanhos e cortes (em px e %) de uma comanda com Código de Barras."""
+    modo: ClassVar[str] = MODO_BARRAS
+
+    caminho_fonte: str
+    prefixo: str = "/"
+    largura: int = 570
+    altura: int = 215
+    corte_vertical: int = 27
+    corte_esq: int = 8
+    corte_dir: int = 8
+    bar_x: int = 535
+    bar_y: int = 600
+    tamanho_texto: int = 142
+    texto_x: int = 535
+    texto_y: int = 845
+    cor_texto: str = "#FFFFFF"
+    rotacao_barra: int = 0
+    rotacao_texto: int = 0
+
+    def __post_init__(self):
+        _validar_rotacoes(self, 'rotacao_barra', 'rotacao_texto')
+
+    def como_dict(self):
+        """Dicionário de configuração no formato usado por motor.py."""
+        return asdict(self)
+
+
+CONFIGS_POR_MODO = {MODO_QRCODE: ConfigQrCode, MODO_BARRAS: ConfigCodigoBarras}
+
+
+@dataclass
+class Layout:
+    """Layout completo de um lote: configuração do modo, dado do QR Code e imposição opcional."""
+    config: object
+    tipo_documento: str = "CNPJ"
+    documento: str = ""
+    imposicao: Optional[dict] = None
+
+    @property
+    def modo(self):
+        return self.config.modo
+
+    @property
+    def dado_base(self):
+        """Documento com a máscara usada no URL do QR Code (None no modo Código de Barras)."""
+        if self.modo != MODO_QRCODE:
+            return None
+        if not self.documento.strip():
+            raise ValueError("O layout de QR Code precisa de um 'documento'.")
+        return aplicar_mascara_qrcode(self.documento, self.tipo_documento)
+
+    @classmethod
+    def de_dict(cls, dados):
+        """Constrói o layout a partir do dicionário lido do JSON. Levanta ValueError se for inválido."""
+        dados = dict(dados)
+        modo = dados.pop('modo', None)
+        if modo not in CONFIGS_POR_MODO:
+            raise ValueError(f"'modo' deve ser um de {list(CONFIGS_POR_MODO)}, não {modo!r}.")
+        tipo_documento = dados.pop('tipo_documento', "CNPJ")
+        documento = dados.pop('documento', "")
+        imposicao = dados.pop('imposicao', None)
+
+        classe = CONFIGS_POR_MODO[modo]
+        conhecidos = {campo.name for campo in fields(classe)}
+        desconhecidos = sorted(set(dados) - conhecidos)
+        if desconhecidos:
+            raise ValueError(f"Campos desconhecidos no layout de {modo}: {', '.join(desconhecidos)}.")
+        if 'caminho_fonte' not in dados:
+            raise ValueError("O layout precisa de 'caminho_fonte'.")
+
+        if imposicao is not None:
+            imposicao = {**IMPOSICAO_PADRAO, **imposicao}
+            if imposicao['folha'] not in FOLHAS_MM:
+                raise ValueError(f"'folha' deve ser uma de {list(FOLHAS_MM)}.")
+        return cls(classe(**dados), tipo_documento, documento, imposicao)
+
+    def como_dict(self):
+        """Dicionário pronto a gravar em JSON (inverso de de_dict)."""
+        dados = {'modo': self.modo, **self.config.como_dict()}
+        if self.modo == MODO_QRCODE:
+            dados.update(tipo_documento=self.tipo_documento, documento=self.documento)
+        if self.imposicao:
+            dados['imposicao'] = self.imposicao
+        return dados
+
+
+def carregar_layout(caminho):
+    """
+    Lê um layout em JSON. Um 'caminho_fonte' relativo é procurado primeiro
+    junto ao ficheiro de layout e depois a partir da pasta atual.
+    """
+    with open(caminho, encoding="utf-8") as ficheiro:
+        layout = Layout.de_dict(json.load(ficheiro))
+    caminho_fonte = layout.config.caminho_fonte
+    junto_ao_layout = os.path.join(os.path.dirname(os.path.abspath(caminho)), caminho_fonte)
+    if not os.path.isabs(caminho_fonte) and os.path.isfile(junto_ao_layout):
+        layout.config.caminho_fonte = junto_ao_layout
+    return layout
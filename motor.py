@@ -0,0 +1,734 @@
+# ==============================
+# BIBLIOTECAS
+# ==============================
+from PIL import Image, ImageDraw, ImageFont
+import base64
+import qrcode
+import re
+import io
+import os
+import logging
+import functools
+import math
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from array import array
+from itertools import groupby
+from barcode.base import Barcode
+from barcode.charsets import code39
+from barcode.codex import MIN_SIZE, MIN_QUIET_ZONE
+from barcode.writer import ImageWriter, mm2px, pt2mm
+from escritor_pdf import codificar_pagina, resolver_codificacao
+from imposicao import Imposicao
+from instrumentacao import medir, ativar, recolher, metricas_atuais
+
+# ===================================================================
+# MOTOR DE RENDERIZAÇÃO DAS COMANDAS
+# ===================================================================
+# Funções de desenho das comandas, sem dependência do Streamlit, para que
+# possam ser importadas pelos processos de renderização em paralelo.
+
+MODO_QRCODE = "QR Code"
+MODO_BARRAS = "Código de Barras"
+
+logger = logging.getLogger(__name__)
+
+# ==============================
+# FONTES
+# ==============================
+
+def carregar_fonte(caminho_fonte, tamanho):
+    """Carrega a fonte a partir de um caminho de ficheiro local. Devolve None em caso de erro."""
+    try:
+        return ImageFont.truetype(caminho_fonte, tamanho)
+    except FileNotFoundError:
+        logger.error("Erro: O ficheiro da fonte '%s' não foi encontrado.", caminho_fonte)
+        return None
+    except Exception as e:
+        logger.error("Ocorreu um erro ao carregar a fonte: %s", e)
+        return None
+
+def listar_fontes(pasta_fontes="fonts"):
+    """
+    Verifica uma pasta, lê os ficheiros .ttf e retorna um dicionário
+    mapeando o nome real da fonte para o seu caminho.
+    """
+    fontes = {}
+    if not os.path.isdir(pasta_fontes):
+        return fontes
+
+    for nome_ficheiro in os.listdir(pasta_fontes):
+        if nome_ficheiro.lower().endswith('.ttf'):
+            caminho_completo = os.path.join(pasta_fontes, nome_ficheiro)
+            try:
+                font = ImageFont.truetype(caminho_completo, size=10)
+                nome_real = " ".join(font.getname())
+                fontes[nome_real] = caminho_completo
+            except Exception:
+                nome_fallback = os.path.splitext(nome_ficheiro)[0]
+                fontes[nome_fallback] = caminho_completo
+    return fontes
+
+# ==============================
+# ATLAS DE DÍGITOS
+# ==============================
+# Os números das comandas só usam os dígitos 0-9. Em vez de abrir a fonte,
+# medir e (quando há rotação) desenhar e rodar uma imagem temporária em
+# cada comanda, cada glifo é rasterizado e rodado uma única vez; o número é
+# montado colando as máscaras dos glifos nas posições dadas pelos avanços
+# e pelo kerning da fonte. O resultado coincide com draw.text/textbbox.
+
+DIGITOS = "0123456789"
+
+def _transpor_caixa(caixa, largura, altura, rotacao):
+    """Posição de uma caixa de uma imagem largura x altura depois de rodar `rotacao` graus (anti-horário)."""
+    x0, y0, x1, y1 = caixa
+    if rotacao == 90:
+        return (y0, largura - x1, y1, largura - x0)
+    if rotacao == 180:
+        return (largura - x1, altura - y1, largura - x0, altura - y0)
+    if rotacao == 270:
+        return (altura - y1, x0, altura - y0, x1)
+    return caixa
+
+class AtlasDigitos:
+    """Máscaras (modo L) dos glifos de uma fonte, já rodadas, com avanços e kerning."""
+
+    TRANSPOSICOES = {90: Image.Transpose.ROTATE_90, 180: Image.Transpose.ROTATE_180, 270: Image.Transpose.ROTATE_270}
+
+    def __init__(self, fonte, rotacao):
+        self.fonte = fonte
+        self.rotacao = rotacao
+        self.glifos = {}
+        self.avancos = {}
+        self.kerning = {}
+        for caractere in DIGITOS:
+            self._glifo(caractere)
+
+    def _glifo(self, caractere):
+        """Devolve (caixa, máscara rodada) do caractere, rasterizando-o na primeira utilização."""
+        if caractere not in self.glifos:
+            caixa = self.fonte.getbbox(caractere)
+            mascara = Image.new('L', (caixa[2] - caixa[0], caixa[3] - caixa[1]), 0)
+            ImageDraw.Draw(mascara).text((-caixa[0], -caixa[1]), caractere, font=self.fonte, fill=255)
+            if self.rotacao in self.TRANSPOSICOES:
+                mascara = mascara.transpose(self.TRANSPOSICOES[self.rotacao])
+            self.glifos[caractere] = (caixa, mascara)
+            self.avancos[caractere] = self.fonte.getlength(caractere)
+        return self.glifos[caractere]
+
+    def _kerning(self, anterior, caractere):
+        par = (anterior, caractere)
+        if par not in self.kerning:
+            self.kerning[par] = self.fonte.getlength(anterior + caractere) - self.avancos[anterior] - self.avancos[caractere]
+        return self.kerning[par]
+
+    def layout(self, texto):
+        """
+        Devolve a caixa do texto (igual a textbbox em (0, 0)) e a lista de
+        (caixa do glifo, máscara) na orientação original.
+        """
+        colocacoes = []
+        caneta = 0.0
+        anterior = None
+        for caractere in texto:
+            caixa, mascara = self._glifo(caractere)
+            if anterior is not None:
+                caneta += self.avancos[anterior] + self._kerning(anterior, caractere)
+            x = round(caneta)
+            colocacoes.append(((x + caixa[0], caixa[1], x + caixa[2], caixa[3]), mascara))
+            anterior = caractere
+        caixa_texto = (
+            min(c[0] for c, _ in colocacoes), min(c[1] for c, _ in colocacoes),
+            max(c[2] for c, _ in colocacoes), max(c[3] for c, _ in colocacoes),
+        )
+        return caixa_texto, colocacoes
+
+    def desenhar(self, imagem, texto, centro_x, centro_y, cor):
+        """
+        Desenha o texto centrado em (centro_x, centro_y), com a mesma colocação
+        de draw.text/rotate. Devolve a caixa da imagem que foi alterada.
+        """
+        if not texto:
+            return None
+        caixa_texto, colocacoes = self.layout(texto)
+        texto_w, texto_h = caixa_texto[2] - caixa_texto[0], caixa_texto[3] - caixa_texto[1]
+        if self.rotacao == 0:
+            # draw.text desenha a tinta deslocada de (bbox[0], bbox[1]) em relação à posição pedida
+            origem_x, origem_y = centro_x - texto_w // 2, centro_y - texto_h // 2
+        else:
+            rot_w, rot_h = (texto_h, texto_w) if self.rotacao in (90, 270) else (texto_w, texto_h)
+            origem_x, origem_y = centro_x - rot_w // 2, centro_y - rot_h // 2
+        alterada = None
+        for caixa, mascara in colocacoes:
+            if self.rotacao == 0:
+                destino = (origem_x + caixa[0], origem_y + caixa[1])
+            else:
+                local = (caixa[0] - caixa_texto[0], caixa[1] - caixa_texto[1], caixa[2] - caixa_texto[0], caixa[3] - caixa_texto[1])
+                rodada = _transpor_caixa(local, texto_w, texto_h, self.rotacao)
+                destino = (origem_x + rodada[0], origem_y + rodada[1])
+            caixa_destino = destino + (destino[0] + mascara.width, destino[1] + mascara.height)
+            imagem.paste(cor, caixa_destino, mascara)
+            alterada = caixa_destino if alterada is None else (
+                min(alterada[0], caixa_destino[0]), min(alterada[1], caixa_destino[1]),
+                max(alterada[2], caixa_destino[2]), max(alterada[3], caixa_destino[3]),
+            )
+        return alterada
+
+@functools.lru_cache(maxsize=32)
+def obter_atlas(caminho_fonte, tamanho, rotacao):
+    """
+    Atlas em cache por fonte, tamanho e rotação. A cor não entra na chave:
+    as máscaras não têm cor e a cor é aplicada ao colar. Devolve None se a
+    fonte não puder ser carregada.
+    """
+    fonte = carregar_fonte(caminho_fonte, tamanho)
+    if fonte is None:
+        return None
+    return AtlasDigitos(fonte, rotacao)
+
+# ===================================================================
+# SEÇÃO 1: LÓGICA DO GERADOR DE QR CODE
+# ===================================================================
+
+def aplicar_mascara_qrcode(documento, tipo):
+    numeros = re.sub(r'\D', '', documento)
+    if tipo == 'CPF' and len(numeros) > 0:
+        numeros = numeros[:11]
+        mascara = '{}.{}.{}-{}'.format(numeros[0:3], numeros[3:6], numeros[6:9], numeros[9:11]) if len(numeros) == 11 else numeros
+    elif tipo == 'CNPJ' and len(numeros) > 0:
+        numeros = numeros[:14]
+        mascara = '{}.{}.{}/{}-{}'.format(numeros[0:2], numeros[2:5], numeros[5:8], numeros[8:12], numeros[12:14]) if len(numeros) == 14 else numeros
+    else:
+        mascara = numeros
+    return mascara + ':'
+
+URL_AUTOATENDIMENTO = "https://pediucomeu.com.br/autoatendimento/"
+
+def montar_url_qrcode(numero, dado_base):
+    """URL codificada no QR Code da comanda `numero`."""
+    texto_original = f"{dado_base}{numero}"
+    base64_encoded = base64.b64encode(texto_original.encode()).decode()
+    return f"{URL_AUTOATENDIMENTO}{base64_encoded}"
+
+# Versão e máscara do QR Code por documento e número de dígitos. Num lote
+# só mudam os dígitos do número, por isso best_fit e best_mask_pattern (que
+# avalia as 8 máscaras) correm uma vez por (dado_base, número de dígitos) e
+# não por comanda. Qualquer máscara produz um código válido; a usada é a do
+# representante da chave, o menor número com esse número de dígitos, por
+# isso a comanda N sai sempre igual, seja qual for o número por onde o lote
+# (ou o bloco de um processo) começa e o que o processo já gerou antes.
+
+def _novo_qrcode(numero, dado_base):
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, border=2)
+    qr.add_data(montar_url_qrcode(numero, dado_base))
+    return qr
+
+def _forma_qrcode(qr):
+    return tuple((segmento.mode, len(segmento.data)) for segmento in qr.data_list)
+
+@functools.lru_cache(maxsize=64)
+def parametros_qrcode(dado_base, digitos):
+    """Forma do payload (modo e tamanho de cada segmento), versão e máscara do representante dos números com `digitos` dígitos."""
+    representante = _novo_qrcode(10 ** (digitos - 1), dado_base)
+    representante.best_fit()
+    return _forma_qrcode(representante), representante.version, representante.best_mask_pattern()
+
+def matriz_qrcode(numero, dado_base, rotacao_qr=0):
+    """
+    Matriz de módulos (listas de bool, True = escuro, com a margem de 2
+    módulos) do QR Code da comanda, já rodada `rotacao_qr` graus no
+    sentido anti-horário.
+    """
+    qr = _novo_qrcode(numero, dado_base)
+    forma, versao, mascara = parametros_qrcode(dado_base, len(str(numero)))
+    if _forma_qrcode(qr) == forma:
+        qr.version, qr.mask_pattern = versao, mascara
+        qr.make(fit=False)
+    else:
+        # Os dígitos mudaram a divisão do payload em segmentos: escolhe só para este número
+        qr.make(fit=True)
+    matriz = qr.get_matrix()
+    if rotacao_qr == 90:
+        matriz = [list(linha) for linha in zip(*matriz)][::-1]
+    elif rotacao_qr == 180:
+        matriz = [linha[::-1] for linha in matriz[::-1]]
+    elif rotacao_qr == 270:
+        matriz = [list(linha)[::-1] for linha in zip(*matriz)]
+    return matriz
+
+def gerar_qrcode(numero, dado_base, tamanho, rotacao_qr):
+    """
+    Rasteriza a matriz de módulos diretamente no tamanho final: um pixel
+    por módulo (Image.frombytes) ampliado com NEAREST. Devolve uma imagem
+    opaca em modo L (preto e branco).
+    """
+    with medir("codificar_qrcode"):
+        matriz = matriz_qrcode(numero, dado_base, rotacao_qr)
+    with medir("redimensionar_rodar"):
+        modulos = len(matriz)
+        pixels = bytes(0 if escuro else 255 for linha in matriz for escuro in linha)
+        img_qr = Image.frombytes('L', (modulos, modulos), pixels)
+        return img_qr.resize((tamanho, tamanho), Image.Resampling.NEAREST)
+
+def gerar_imagem_qrcode(background, numero, dado_base, config):
+    return ModeloComanda(background, MODO_QRCODE, dado_base, config).renderizar(numero)
+
+# ===================================================================
+# SEÇÃO 2: LÓGICA DO GERADOR DE CÓDIGO DE BARRAS
+# ===================================================================
+
+# Geometria efetiva do desenho do python-barcode. Code39.render repõe as suas
+# próprias opções por cima das do writer (module_width 0.2 mm, quiet zone
+# 2.54 mm, altura 15 mm, texto de 10 pt a 5 mm das barras), por isso é esta a
+# tela que o corte e o redimensionamento sempre receberam.
+CODE39_DPI = 300
+CODE39_MODULO_MM = MIN_SIZE
+CODE39_ZONA_MM = MIN_QUIET_ZONE
+CODE39_MARGEM_MM = 1.0
+CODE39_ALTURA_MM = Barcode.default_writer_options['module_height']
+CODE39_DISTANCIA_TEXTO_MM = Barcode.default_writer_options['text_distance']
+CODE39_TAMANHO_TEXTO_PT = Barcode.default_writer_options['font_size']
+
+def padrao_code39(codigo):
+    """Módulos ('1' barra, '0' espaço) do Code39 de `codigo`, com os asteriscos de início e fim."""
+    return code39.MIDDLE.join([code39.EDGE] + [code39.MAP[caractere][1] for caractere in codigo.upper()] + [code39.EDGE])
+
+@functools.lru_cache(maxsize=1)
+def fonte_code39():
+    """Fonte usada pelo ImageWriter para o texto por baixo das barras."""
+    return ImageFont.truetype(ImageWriter().font_path, int(mm2px(pt2mm(CODE39_TAMANHO_TEXTO_PT), CODE39_DPI)))
+
+@functools.lru_cache(maxsize=64)
+def _indices_nearest(origem, destino):
+    """Índice de origem de cada pixel de destino num redimensionamento NEAREST do Pillow."""
+    indices = Image.frombytes('I', (origem, 1), array('i', range(origem)).tobytes())
+    return tuple(array('i', indices.resize((destino, 1), Image.Resampling.NEAREST).tobytes()))
+
+def tela_code39(codigo):
+    """
+    Geometria da tela do ImageWriter para `codigo`: (largura, altura, linha de
+    barras em bytes L, primeira e última linha das barras, posição do texto).
+    """
+    padrao = padrao_code39(codigo)
+    largura_mm = 2 * CODE39_ZONA_MM + len(padrao) * CODE39_MODULO_MM
+    altura_mm = 2 * CODE39_MARGEM_MM + CODE39_ALTURA_MM + pt2mm(CODE39_TAMANHO_TEXTO_PT) / 2 + CODE39_DISTANCIA_TEXTO_MM
+    largura_px, altura_px = int(mm2px(largura_mm, CODE39_DPI)), int(mm2px(altura_mm, CODE39_DPI))
+
+    # As barras são retângulos com coordenadas truncadas, pintados por ordem
+    # (os espaços também são pintados, a branco), tal como no ImageWriter.
+    linha = bytearray(b'\xff' * largura_px)
+    x_mm = CODE39_ZONA_MM
+    for modulo, repeticoes in ((m, len(list(g))) for m, g in groupby(padrao)):
+        largura_run = CODE39_MODULO_MM * repeticoes
+        x0 = int(mm2px(x_mm, CODE39_DPI))
+        x1 = min(int(mm2px(x_mm + largura_run, CODE39_DPI) - 1), largura_px - 1)
+        linha[x0:x1 + 1] = (b'\x00' if modulo == '1' else b'\xff') * (x1 + 1 - x0)
+        x_mm += largura_run
+
+    linha_inicio = int(mm2px(CODE39_MARGEM_MM, CODE39_DPI))
+    linha_fim = int(mm2px(CODE39_MARGEM_MM + CODE39_ALTURA_MM, CODE39_DPI))
+    pos_texto = (mm2px(CODE39_ZONA_MM + len(padrao) * CODE39_MODULO_MM / 2, CODE39_DPI),
+                 mm2px(CODE39_MARGEM_MM + CODE39_ALTURA_MM + CODE39_DISTANCIA_TEXTO_MM, CODE39_DPI))
+    return largura_px, altura_px, bytes(linha), linha_inicio, linha_fim, pos_texto
+
+def gerar_code39(numero, prefixo, largura, altura, corte_vertical, rotacao_barra, corte_esq, corte_dir):
+    """
+    Desenha o Code39 de `prefixo + zfill(4)` diretamente no tamanho final,
+    com os cortes e a rotação pedidos. Cada pixel de destino é buscado na
+    tela que o python-barcode desenharia (mesmo mapeamento NEAREST do
+    Pillow), por isso o resultado é idêntico ao da renderização em PNG.
+    Devolve uma imagem em modo L.
+    """
+    codigo = f"{prefixo}{str(numero).zfill(4)}"
+    with medir("codificar_code39"):
+        largura_real, altura_real, linha_barras, linha_inicio, linha_fim, pos_texto = tela_code39(codigo)
+    corte_altura = int(altura_real * (1 - (corte_vertical / 100)))
+    corte_esq_px = int(largura_real * (corte_esq / 100))
+    corte_dir_px = int(largura_real * (1 - (corte_dir / 100)))
+
+    if corte_altura <= 0 or corte_dir_px <= corte_esq_px:
+        # Recorte vazio: o redimensionamento do Pillow devolvia uma imagem preta
+        imagem = Image.new('L', (largura, altura), 0)
+        return imagem.transpose(AtlasDigitos.TRANSPOSICOES[rotacao_barra]) if rotacao_barra != 0 else imagem
+
+    colunas = _indices_nearest(corte_dir_px - corte_esq_px, largura)
+    linhas = _indices_nearest(corte_altura, altura)
+    barras = bytes(linha_barras[corte_esq_px + c] for c in colunas)
+    branco = b'\xff' * largura
+
+    # O texto por baixo das barras só é desenhado se o corte vertical o deixar visível.
+    faixa_texto = None
+    if corte_altura > linha_fim + 1:
+        faixa_texto = Image.new('L', (largura_real, corte_altura - linha_fim - 1), 255)
+        ImageDraw.Draw(faixa_texto).text((pos_texto[0], pos_texto[1] - linha_fim - 1), codigo, font=fonte_code39(), fill=0, anchor="md")
+        faixa_texto = faixa_texto.tobytes()
+
+    def linha_destino(y):
+        if linha_inicio <= y <= linha_fim:
+            return barras
+        if faixa_texto is not None and y > linha_fim:
+            inicio_linha = (y - linha_fim - 1) * largura_real + corte_esq_px
+            return bytes(faixa_texto[inicio_linha + c] for c in colunas)
+        return branco
+
+    with medir("redimensionar_rodar"):
+        imagem = Image.frombytes('L', (largura, altura), b''.join(linha_destino(y) for y in linhas))
+        if rotacao_barra != 0:
+            imagem = imagem.transpose(AtlasDigitos.TRANSPOSICOES[rotacao_barra])
+    return imagem
+
+def gerar_imagem_barcode(background, numero, config):
+    return ModeloComanda(background, MODO_BARRAS, None, config).renderizar(numero)
+
+# ===================================================================
+# SEÇÃO 3: CAMADA ESTÁTICA DO TEMPLATE
+# ===================================================================
+# Numa comanda só mudam duas regiões: a do código e a do número. O template
+# é descodificado e convertido uma única vez por lote; cada página reutiliza
+# o mesmo buffer RGB e só repõe, a partir da base, os retângulos alterados
+# na página anterior. Pintar em RGB dá o mesmo resultado que pintar em RGBA
+# e converter no fim, porque o código é opaco e o texto é colado com máscara.
+
+class ModeloComanda:
+    """Template de um lote pronto a renderizar comandas (QR Code ou Código de Barras)."""
+
+    def __init__(self, background, modo, dado_base, config):
+        with medir("decodificar_template"):
+            background.load()
+        with medir("converter_rgb"):
+            self.base = background.convert("RGBA").convert("RGB")
+        self.pagina = self.base.copy()
+        self.modo = modo
+        self.dado_base = dado_base
+        self.config = config
+        self.atlas = obter_atlas(config['caminho_fonte'], config['tamanho_texto'], config['rotacao_texto'])
+        self.caixas_sujas = []
+
+    def texto_numero(self, numero):
+        """Texto impresso na comanda: o número, com 4 dígitos no modo Código de Barras."""
+        return str(numero) if self.modo == MODO_QRCODE else str(numero).zfill(4)
+
+    def _desenhar_codigo(self, numero):
+        config = self.config
+        if self.modo == MODO_QRCODE:
+            img_codigo = gerar_qrcode(numero, self.dado_base, config['tamanho_qr'], config['rotacao_qr'])
+            centro = (config['qr_x'], config['qr_y'])
+        else:
+            img_codigo = gerar_code39(numero, config['prefixo'], config['largura'], config['altura'], config['corte_vertical'], config['rotacao_barra'], config['corte_esq'], config['corte_dir'])
+            centro = (config['bar_x'], config['bar_y'])
+        posicao = (centro[0] - img_codigo.width // 2, centro[1] - img_codigo.height // 2)
+        with medir("colar"):
+            self.pagina.paste(img_codigo, posicao)
+        return posicao + (posicao[0] + img_codigo.width, posicao[1] + img_codigo.height)
+
+    def renderizar(self, numero):
+        """
+        Desenha a comanda `numero` e devolve a página (RGB), ou None se a
+        fonte não puder ser carregada. A imagem devolvida é o buffer do
+        modelo: só é válida até à chamada seguinte.
+        """
+        if self.atlas is None:
+            return None
+        with medir("colar"):
+            for caixa in self.caixas_sujas:
+                self.pagina.paste(self.base.crop(caixa), caixa[:2])
+        caixa_codigo = self._desenhar_codigo(numero)
+        with medir("texto"):
+            caixa_texto = self.atlas.desenhar(self.pagina, self.texto_numero(numero), self.config['texto_x'], self.config['texto_y'], self.config['cor_texto'])
+        self.caixas_sujas = [caixa for caixa in (caixa_codigo, caixa_texto) if caixa is not None]
+        return self.pagina
+
+# ===================================================================
+# PRÉ-VISUALIZAÇÃO: RÉGUAS E GUIAS
+# ===================================================================
+# A pré-visualização é desenhada numa versão reduzida do template; as
+# réguas e as guias continuam em px do template original, convertidos com
+# `escala` (px da imagem por px do template). As réguas só dependem do
+# tamanho da imagem e da escala, por isso são desenhadas uma única vez e
+# em cada atualização só se colam a imagem e as guias.
+
+CAMPOS_TAMANHO = ('tamanho_qr', 'largura', 'altura', 'tamanho_texto')
+CAMPOS_POSICAO = ('qr_x', 'qr_y', 'bar_x', 'bar_y', 'texto_x', 'texto_y')
+
+def escalar_config(config, escala):
+    """Cópia da configuração com posições e tamanhos em px multiplicados por `escala`."""
+    escalada = dict(config)
+    for chave in CAMPOS_TAMANHO:
+        if chave in escalada:
+            escalada[chave] = max(1, round(escalada[chave] * escala))
+    for chave in CAMPOS_POSICAO:
+        if chave in escalada:
+            escalada[chave] = round(escalada[chave] * escala)
+    return escalada
+
+@functools.lru_cache(maxsize=8)
+def desenhar_reguas(width, height, escala=1.0, ruler_size=30):
+    """
+    Tela com as réguas para uma imagem de width x height px, graduadas em
+    px do template. Partilhada entre chamadas: deve ser copiada antes de usar.
+    """
+    new_width = width + ruler_size
+    new_height = height + ruler_size
+    ruler_canvas = Image.new('RGB', (new_width, new_height), '#f0f2f6')
+
+    draw = ImageDraw.Draw(ruler_canvas)
+    try:
+        ruler_font = ImageFont.truetype("arial.ttf", 10)
+    except IOError:
+        ruler_font = ImageFont.load_default()
+    # Com escalas pequenas, os traços de 10 em 10 ficariam colados
+    passo = 10 if 10 * escala >= 3 else 50
+
+    # --- Régua Horizontal ---
+    for x in range(0, math.ceil(width / escala), passo):
+        pos_x = round(x * escala) + ruler_size
+        if x % 100 == 0:
+            draw.line([(pos_x, 0), (pos_x, ruler_size)], fill='black', width=1)
+            text = str(x)
+            text_bbox = draw.textbbox((0, 0), text, font=ruler_font)
+            text_w = text_bbox[2] - text_bbox[0]
+            draw.text((pos_x - text_w // 2, 5), text, fill='black', font=ruler_font)
+        elif x % 50 == 0:
+            draw.line([(pos_x, ruler_size // 2), (pos_x, ruler_size)], fill='gray', width=1)
+        else:
+            draw.line([(pos_x, ruler_size * 3 // 4), (pos_x, ruler_size)], fill='lightgray', width=1)
+
+    # --- Régua Vertical ---
+    for y in range(0, math.ceil(height / escala), passo):
+        pos_y = round(y * escala) + ruler_size
+        if y % 100 == 0:
+            draw.line([(0, pos_y), (ruler_size, pos_y)], fill='black', width=1)
+            text = str(y)
+            text_bbox = draw.textbbox((0, 0), text, font=ruler_font)
+            text_h = text_bbox[3] - text_bbox[1]
+            draw.text((5, pos_y - text_h // 2), text, fill='black', font=ruler_font)
+        elif y % 50 == 0:
+            draw.line([(ruler_size // 2, pos_y), (ruler_size, pos_y)], fill='gray', width=1)
+        else:
+            draw.line([(ruler_size * 3 // 4, pos_y), (ruler_size, pos_y)], fill='lightgray', width=1)
+
+    return ruler_canvas
+
+def draw_rulers_and_guides(image, guides, ruler_size=30, escala=1.0):
+    """
+    Desenha réguas e linhas-guia numa imagem. As posições das guias estão
+    em px do template; `escala` é o fator da imagem em relação ao template.
+    """
+    ruler_canvas = desenhar_reguas(image.width, image.height, escala, ruler_size).copy()
+    ruler_canvas.paste(image, (ruler_size, ruler_size))
+    new_width, new_height = ruler_canvas.size
+    draw = ImageDraw.Draw(ruler_canvas)
+
+    # --- Guias ---
+    for guide_type, positions in guides.items():
+        color = positions['color']
+        if 'x' in positions:
+            guide_x = round(positions['x'] * escala) + ruler_size
+            draw.line([(guide_x, 0), (guide_x, new_height)], fill=color, width=1)
+        if 'y' in positions:
+            guide_y = round(positions['y'] * escala) + ruler_size
+            draw.line([(0, guide_y), (new_width, guide_y)], fill=color, width=1)
+
+    return ruler_canvas
+
+# ===================================================================
+# SEÇÃO 4: RENDERIZAÇÃO EM PARALELO
+# ===================================================================
+# Cada processo recebe o template (em bytes) e a configuração uma única vez,
+# no arranque, e a partir daí só recebe intervalos de números. As páginas
+# voltam já codificadas (JPEG), o que também paraleliza a codificação e
+# reduz o volume transferido entre processos. Com imposição, cada bloco é
+# um número inteiro de folhas e o processo devolve as folhas já montadas.
+# Se o lote estiver a ser medido (instrumentacao.sessao), cada processo
+# mede as suas etapas e devolve as métricas junto com as páginas do bloco.
+# Para o arquivo de imagens, os processos codificam em PNG/WebP em vez de
+# JPEG; no modo sequencial essa codificação corre num conjunto de threads
+# (o Pillow liberta o GIL enquanto comprime).
+# Com a verificação ligada (`ao_ler`), o código de cada comanda é lido do
+# buffer do modelo logo depois de desenhado, antes de qualquer codificação,
+# na mesma passagem; os processos devolvem as leituras junto com o bloco.
+
+# Os lotes da interface correm em threads (tarefas.py) dentro do servidor
+# do Streamlit. Com "fork", um processo filho pode herdar um bloqueio (o do
+# logging, por exemplo) que outra thread tinha no momento do fork e ficar
+# parado para sempre; o "forkserver" cria os processos a partir de um
+# processo sem threads. No Windows só existe "spawn".
+CONTEXTO_PROCESSOS = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+# Opções de gravação de cada formato de imagem: o WebP é sem perdas, como o
+# PNG, para não degradar os módulos do QR Code nem as barras
+FORMATOS_IMAGEM = {"PNG": {}, "WEBP": {'lossless': True}}
+
+def codificar_imagem(imagem, formato):
+    """Codifica uma página em PNG ou WebP (ver FORMATOS_IMAGEM). Devolve os bytes."""
+    buffer = io.BytesIO()
+    imagem.save(buffer, format=formato, **FORMATOS_IMAGEM[formato])
+    return buffer.getvalue()
+
+def _codificar_cronometrado(imagem, formato):
+    inicio = time.perf_counter()
+    dados = codificar_imagem(imagem, formato)
+    return dados, time.perf_counter() - inicio
+
+def codificar_em_threads(imagens, formato, threads=None):
+    """
+    Codifica um iterável de imagens (que podem ser buffers reutilizados:
+    cada uma é copiada antes de seguir para as threads) e devolve um
+    gerador dos bytes, pela mesma ordem. Só `2 * threads` imagens ficam em
+    curso de cada vez.
+    """
+    threads = threads or os.cpu_count() or 1
+    metricas = metricas_atuais()
+
+    def resultado(futuro):
+        dados, segundos = futuro.result()
+        if metricas is not None:
+            metricas.registar("codificar_imagem", segundos)
+        return dados
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pendentes = deque()
+        for imagem in imagens:
+            pendentes.append(executor.submit(_codificar_cronometrado, imagem.copy(), formato))
+            if len(pendentes) >= 2 * threads:
+                yield resultado(pendentes.popleft())
+        while pendentes:
+            yield resultado(pendentes.popleft())
+
+_trabalho = {}
+
+def _iniciar_trabalhador(modo, template_bytes, dado_base, config, imposicao=None, medir_etapas=False, formato_imagem=None, codificacao=None, verificar=False):
+    """Inicializador do processo: descodifica e prepara o template uma única vez."""
+    if medir_etapas:
+        ativar()
+    _trabalho['formato_imagem'] = formato_imagem
+    _trabalho['codificacao'] = codificacao
+    _trabalho['verificar'] = verificar
+    background = Image.open(io.BytesIO(template_bytes))
+    _trabalho['modelo'] = ModeloComanda(background, modo, dado_base, config)
+    _trabalho['imposicao'] = Imposicao(imposicao, *background.size) if imposicao else None
+
+def _comandas(modelo, inicio, fim, ao_ler=None):
+    """
+    Gerador das comandas de `inicio` a `fim` (o buffer do modelo, uma de
+    cada vez). Com `ao_ler`, o código de cada comanda é lido antes de a
+    devolver e a Leitura (ver verificacao.py) é passada a ao_ler.
+    """
+    if ao_ler is not None:
+        # Importado aqui: verificacao importa o motor
+        from verificacao import verificar_pagina
+    for numero in range(inicio, fim + 1):
+        imagem = modelo.renderizar(numero)
+        if ao_ler is not None:
+            ao_ler(verificar_pagina(imagem, numero, modelo.modo, modelo.dado_base, modelo.config))
+        if imagem is not None:
+            yield imagem
+
+def _renderizar_bloco(bloco):
+    """
+    Renderiza e codifica os números de um bloco (inicio, fim) no processo
+    atual. Devolve (páginas, leituras dos códigos ou None, métricas do
+    bloco ou None).
+    """
+    inicio, fim = bloco
+    leituras = [] if _trabalho['verificar'] else None
+    paginas = _comandas(_trabalho['modelo'], inicio, fim, None if leituras is None else leituras.append)
+    if _trabalho['imposicao'] is not None:
+        paginas = _trabalho['imposicao'].impor(paginas)
+    formato = _trabalho['formato_imagem']
+    if formato is None:
+        return [codificar_pagina(pagina, _trabalho['codificacao']) for pagina in paginas], leituras, recolher()
+    codificadas = []
+    for pagina in paginas:
+        with medir("codificar_imagem"):
+            codificadas.append(codificar_imagem(pagina, formato))
+    return codificadas, leituras, recolher()
+
+def _resultado_bloco(futuro, ao_ler=None):
+    """
+    Páginas de um bloco concluído; as leituras dos códigos são passadas a
+    `ao_ler` e as métricas do processo somadas às da sessão atual.
+    """
+    paginas, leituras, metricas = futuro.result()
+    for leitura in leituras or ():
+        ao_ler(leitura)
+    if metricas and metricas_atuais() is not None:
+        metricas_atuais().juntar(metricas)
+    return paginas
+
+def dividir_em_blocos(inicio, fim, tamanho_bloco):
+    """Divide o intervalo [inicio, fim] em blocos consecutivos (inicio, fim)."""
+    for bloco_inicio in range(inicio, fim + 1, tamanho_bloco):
+        yield bloco_inicio, min(bloco_inicio + tamanho_bloco - 1, fim)
+
+def renderizar_paralelo(modo, template_bytes, inicio, fim, dado_base, config, processos=None, tamanho_bloco=None, imposicao=None, formato_imagem=None, codificacao=None, ao_ler=None):
+    """
+    Renderiza as comandas de `inicio` a `fim` num conjunto de processos e
+    devolve um gerador de páginas codificadas (PaginaCodificada com a
+    `codificacao` já resolvida, ou bytes PNG/WebP com `formato_imagem`),
+    pela ordem dos números. Com `ao_ler`, os processos leem também o
+    código de cada comanda e as leituras são passadas a ao_ler.
+    Só são mantidos em curso `2 * processos` blocos de cada vez, para que a
+    memória não cresça com o tamanho do intervalo.
+    """
+    processos = processos or os.cpu_count() or 1
+    total = fim - inicio + 1
+    if tamanho_bloco is None:
+        tamanho_bloco = max(1, min(64, total // (processos * 4)))
+    if imposicao:
+        # Blocos com folhas completas: só o último bloco pode ter uma folha incompleta
+        por_folha = imposicao['colunas'] * imposicao['linhas']
+        tamanho_bloco = -(-tamanho_bloco // por_folha) * por_folha
+    blocos = dividir_em_blocos(inicio, fim, tamanho_bloco)
+    initargs = (modo, template_bytes, dado_base, config, imposicao, metricas_atuais() is not None, formato_imagem, codificacao, ao_ler is not None)
+    with ProcessPoolExecutor(max_workers=processos, mp_context=CONTEXTO_PROCESSOS, initializer=_iniciar_trabalhador, initargs=initargs) as executor:
+        pendentes = deque()
+        try:
+            for bloco in blocos:
+                pendentes.append(executor.submit(_renderizar_bloco, bloco))
+                if len(pendentes) >= 2 * processos:
+                    yield from _resultado_bloco(pendentes.popleft(), ao_ler)
+            while pendentes:
+                yield from _resultado_bloco(pendentes.popleft(), ao_ler)
+        finally:
+            # Lote interrompido (gerador fechado ou erro): não espera pelos blocos que ainda não arrancaram
+            for futuro in pendentes:
+                futuro.cancel()
+
+def cores_sobrepostas(config):
+    """Cores desenhadas por cima do template: o código (preto e branco) e o número."""
+    return ("#000000", "#FFFFFF", config['cor_texto'])
+
+def gerar_paginas(modo, template_bytes, inicio, fim, dado_base, config, processos=1, imposicao=None, formato_imagem=None, codificacao=None, ao_ler=None):
+    """
+    Gerador das páginas de um lote, pela ordem dos números. Com mais de um
+    processo usa renderizar_paralelo (páginas já codificadas); caso
+    contrário renderiza no processo atual com um único ModeloComanda e
+    devolve o seu buffer, que deve ser consumido antes da página seguinte.
+    Com `imposicao` (ver imposicao.py), as páginas são folhas com várias
+    comandas; a geometria é validada aqui, antes de arrancar os processos.
+    Com `formato_imagem` ("PNG" ou "WEBP"), as páginas são sempre os bytes
+    da imagem codificada; com `codificacao` (ver escritor_pdf), são sempre
+    PaginaCodificada, com a codificação resolvida uma única vez para o lote.
+    Com `ao_ler`, o código de cada comanda é lido na mesma passagem (antes
+    da imposição e da codificação) e cada Leitura é passada a ao_ler.
+    """
+    background = Image.open(io.BytesIO(template_bytes))
+    folhas = Imposicao(imposicao, *background.size) if imposicao else None
+    if codificacao is not None:
+        codificacao = resolver_codificacao(codificacao, background, cores_sobrepostas(config))
+    if processos > 1 and fim > inicio:
+        yield from renderizar_paralelo(modo, template_bytes, inicio, fim, dado_base, config, processos, imposicao=imposicao, formato_imagem=formato_imagem, codificacao=codificacao, ao_ler=ao_ler)
+        return
+    paginas = _comandas(ModeloComanda(background, modo, dado_base, config), inicio, fim, ao_ler)
+    if folhas:
+        paginas = folhas.impor(paginas)
+    if formato_imagem:
+        yield from codificar_em_threads(paginas, formato_imagem)
+    elif codificacao is not None:
+        yield from (codificar_pagina(pagina, codificacao) for pagina in paginas)
+    else:
+        yield from paginas
@@ -0,0 +1,281 @@
+# ==============================
+# BIBLIOTECAS
+# ==============================
+import io
+import math
+import re
+import zlib
+from PIL import Image, ImageColor, ImageFont
+from barcode.writer import ImageWriter
+import motor
+from escritor_pdf import EscritorPdf, codificar_pagina, resolver_codificacao
+from imposicao import Imposicao
+from instrumentacao import medir
+
+# ===================================================================
+# EXPORTAÇÃO EM PDF VETORIAL
+# ===================================================================
+# Em vez de uma cópia raster do template por página, o template é embutido
+# uma única vez como XObject partilhado e a fonte TrueType do número uma
+# única vez como FontFile2. Cada página só acrescenta um pequeno stream de
+# conteúdo: os módulos do QR Code (ou as barras do Code39) como retângulos
+# e o número como texto real. O tamanho do ficheiro cresce com o número de
+# páginas e não com pixels x páginas.
+#
+# Cada elemento é desenhado no seu próprio referencial (eixo y para baixo,
+# como no Pillow) e colocado na página com uma matriz `cm` que aplica a
+# mesma centragem e rotação (anti-horária) de gerar_imagem_*. Com imposição,
+# o conteúdo de cada comanda é reutilizado tal e qual dentro de uma célula
+# da folha, com mais uma matriz de escala e um recorte à caixa de sangria.
+
+
+def _n(valor):
+    """Formata um número para o conteúdo do PDF (no máximo 3 casas decimais)."""
+    texto = f"{valor:.3f}".rstrip("0").rstrip(".")
+    return "0" if texto in ("", "-0") else texto
+
+
+def _compor(*matrizes):
+    """Compõe matrizes afins (a, b, c, d, e, f); a última é aplicada primeiro."""
+    a, b, c, d, e, f = 1, 0, 0, 1, 0, 0
+    for a2, b2, c2, d2, e2, f2 in matrizes:
+        a, b, c, d, e, f = (
+            a * a2 + c * b2, b * a2 + d * b2,
+            a * c2 + c * d2, b * c2 + d * d2,
+            a * e2 + c * f2 + e, b * e2 + d * f2 + f,
+        )
+    return a, b, c, d, e, f
+
+
+def _matriz_elemento(centro_x, centro_y, largura, altura, rotacao, altura_pagina):
+    """
+    Matriz que leva a caixa largura x altura de um elemento (eixo y para
+    baixo) para a página, rodada `rotacao` graus e centrada em (centro_x,
+    centro_y) em coordenadas de imagem.
+    """
+    angulo = math.radians(rotacao)
+    cos, sen = round(math.cos(angulo), 12), round(math.sin(angulo), 12)
+    return _compor(
+        (1, 0, 0, 1, centro_x, altura_pagina - centro_y),
+        (cos, sen, -sen, cos, 0, 0),
+        (1, 0, 0, -1, 0, 0),
+        (1, 0, 0, 1, -largura / 2, -altura / 2),
+    )
+
+
+def _cm(matriz):
+    return " ".join(_n(v) for v in matriz) + " cm"
+
+
+def _cor_rg(cor):
+    r, g, b = ImageColor.getrgb(cor)[:3]
+    return f"{_n(r / 255)} {_n(g / 255)} {_n(b / 255)} rg"
+
+
+def _texto_pdf(texto):
+    return "(" + texto.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+def embutir_fonte_truetype(escritor, caminho_fonte):
+    """Embute o ficheiro TTF (FontFile2) e escreve o dicionário da fonte. Devolve o número do objeto."""
+    with open(caminho_fonte, "rb") as ficheiro:
+        dados = ficheiro.read()
+    id_ficheiro = escritor.adicionar_objeto(f"/Filter /FlateDecode /Length1 {len(dados)}", zlib.compress(dados))
+
+    # Métricas em milésimos de em: uma fonte de 1000 px mede diretamente em unidades de texto do PDF
+    fonte = ImageFont.truetype(caminho_fonte, 1000)
+    ascendente, descendente = fonte.getmetrics()
+    caixas = [fonte.getbbox(caractere, anchor="ls") for caractere in motor.DIGITOS + "/"]
+    caixa = (min(c[0] for c in caixas), -max(c[3] for c in caixas), max(c[2] for c in caixas), -min(c[1] for c in caixas))
+    larguras = " ".join(_n(fonte.getlength(chr(codigo))) for codigo in range(32, 127))
+    nome = re.sub(r"[^A-Za-z0-9-]", "", "".join(fonte.getname())) or "Fonte"
+
+    id_descritor = escritor.adicionar_objeto(
+        f"/Type /FontDescriptor /FontName /{nome} /Flags 32 /FontBBox [{' '.join(_n(v) for v in caixa)}] "
+        f"/ItalicAngle 0 /Ascent {ascendente} /Descent {-descendente} /CapHeight {ascendente} /StemV 80 "
+        f"/FontFile2 {id_ficheiro} 0 R"
+    )
+    return escritor.adicionar_objeto(
+        f"/Type /Font /Subtype /TrueType /BaseFont /{nome} /FirstChar 32 /LastChar 126 "
+        f"/Widths [{larguras}] /Encoding /WinAnsiEncoding /FontDescriptor {id_descritor} 0 R"
+    )
+
+
+def _conteudo_qrcode(numero, dado_base, config, altura_pagina):
+    """Módulos escuros do QR Code como retângulos, sobre o fundo branco do código."""
+    with medir("codificar_qrcode"):
+        matriz = motor.matriz_qrcode(numero, dado_base)
+    modulos = len(matriz)
+    tamanho = config['tamanho_qr']
+    centro_x = config['qr_x'] - tamanho // 2 + tamanho / 2
+    centro_y = config['qr_y'] - tamanho // 2 + tamanho / 2
+    escala = tamanho / modulos
+    posicao = _compor(
+        _matriz_elemento(centro_x, centro_y, tamanho, tamanho, config['rotacao_qr'], altura_pagina),
+        (escala, 0, 0, escala, 0, 0),
+    )
+    retangulos = []
+    for y, linha in enumerate(matriz):
+        x = 0
+        while x < modulos:
+            if linha[x]:
+                inicio = x
+                while x < modulos and linha[x]:
+                    x += 1
+                retangulos.append(f"{inicio} {y} {x - inicio} 1 re")
+            x += 1
+    return [f"q {_cm(posicao)}", f"1 g 0 0 {modulos} {modulos} re f", "0 g", *retangulos, "f", "Q"]
+
+
+def _conteudo_code39(numero, config, altura_pagina, nome_fonte_barras):
+    """
+    Barras do Code39 como retângulos, no referencial da tela do python-barcode
+    (ver motor.tela_code39), com o mesmo corte e escala de gerar_code39.
+    Devolve (operações, usa_fonte_barras).
+    """
+    codigo = f"{config['prefixo']}{str(numero).zfill(4)}"
+    largura_real, altura_real, linha_barras, linha_inicio, linha_fim, pos_texto = motor.tela_code39(codigo)
+    corte_altura = int(altura_real * (1 - (config['corte_vertical'] / 100)))
+    corte_esq_px = int(largura_real * (config['corte_esq'] / 100))
+    corte_dir_px = int(largura_real * (1 - (config['corte_dir'] / 100)))
+    largura, altura = config['largura'], config['altura']
+    rot_w, rot_h = (altura, largura) if config['rotacao_barra'] in (90, 270) else (largura, altura)
+    centro_x = config['bar_x'] - rot_w // 2 + rot_w / 2
+    centro_y = config['bar_y'] - rot_h // 2 + rot_h / 2
+    caixa = _matriz_elemento(centro_x, centro_y, largura, altura, config['rotacao_barra'], altura_pagina)
+
+    if corte_altura <= 0 or corte_dir_px <= corte_esq_px:
+        return [f"q {_cm(caixa)}", f"0 g 0 0 {largura} {altura} re f", "Q"], False
+
+    corte_largura = corte_dir_px - corte_esq_px
+    posicao = _compor(caixa, (largura / corte_largura, 0, 0, altura / corte_altura, -corte_esq_px * largura / corte_largura, 0))
+    operacoes = [f"q {_cm(posicao)}", f"{corte_esq_px} 0 {corte_largura} {corte_altura} re W n", f"1 g {corte_esq_px} 0 {corte_largura} {corte_altura} re f", "0 g"]
+    x = 0
+    while x < largura_real:
+        if linha_barras[x] == 0:
+            inicio = x
+            while x < largura_real and linha_barras[x] == 0:
+                x += 1
+            operacoes.append(f"{inicio} {linha_inicio} {x - inicio} {linha_fim + 1 - linha_inicio} re")
+        x += 1
+    operacoes.append("f")
+
+    usa_fonte_barras = corte_altura > linha_fim + 1
+    if usa_fonte_barras:
+        fonte = motor.fonte_code39()
+        esquerda = pos_texto[0] - fonte.getlength(codigo) / 2
+        linha_base = pos_texto[1] - fonte.getmetrics()[1]
+        operacoes.append(f"BT /{nome_fonte_barras} {fonte.size} Tf 1 0 0 -1 {_n(esquerda)} {_n(linha_base)} Tm {_texto_pdf(codigo)} Tj ET")
+    operacoes.append("Q")
+    return operacoes, usa_fonte_barras
+
+
+def _conteudo_numero(texto, atlas, config, altura_pagina):
+    """O número como texto, centrado e rodado como em AtlasDigitos.desenhar."""
+    caixa_texto, _ = atlas.layout(texto)
+    texto_w, texto_h = caixa_texto[2] - caixa_texto[0], caixa_texto[3] - caixa_texto[1]
+    rotacao = config['rotacao_texto']
+    if rotacao == 0:
+        centro_x = config['texto_x'] - texto_w // 2 + (caixa_texto[0] + caixa_texto[2]) / 2
+        centro_y = config['texto_y'] - texto_h // 2 + (caixa_texto[1] + caixa_texto[3]) / 2
+    else:
+        rot_w, rot_h = (texto_h, texto_w) if rotacao in (90, 270) else (texto_w, texto_h)
+        centro_x = config['texto_x'] - rot_w // 2 + rot_w / 2
+        centro_y = config['texto_y'] - rot_h // 2 + rot_h / 2
+    # Referencial do texto: origem do draw.text (âncora "la"), deslocado para centrar a tinta
+    posicao = _compor(
+        _matriz_elemento(centro_x, centro_y, texto_w, texto_h, rotacao, altura_pagina),
+        (1, 0, 0, 1, -caixa_texto[0], -caixa_texto[1]),
+    )
+    ascendente = atlas.fonte.getmetrics()[0]
+    return [f"q {_cm(posicao)}", f"BT /F1 {atlas.fonte.size} Tf {_cor_rg(config['cor_texto'])} 1 0 0 -1 0 {ascendente} Tm {_texto_pdf(texto)} Tj ET", "Q"]
+
+
+def _conteudo_marcas(folhas, altura_pt):
+    """Marcas de corte da folha como um único caminho de traços."""
+    segmentos = folhas.marcas_corte()
+    if not segmentos:
+        return []
+    k = 72 / folhas.dpi
+    operacoes = [f"{_n(72 * folhas.espessura_marca / folhas.dpi)} w 0 G"]
+    for (x0, y0), (x1, y1) in segmentos:
+        operacoes.append(f"{_n(x0 * k)} {_n(altura_pt - y0 * k)} m {_n(x1 * k)} {_n(altura_pt - y1 * k)} l")
+    operacoes.append("S")
+    return operacoes
+
+
+def _celula(folhas, indice, largura_pagina, altura_pagina, altura_pt):
+    """Recorte à caixa de sangria e matriz que leva a comanda para a célula `indice` da folha."""
+    k = 72 / folhas.dpi
+    x0, y0, x1, y1 = folhas.caixas_corte[indice]
+    s = folhas.sangria
+    recorte = f"{_n((x0 - s) * k)} {_n(altura_pt - (y1 + s) * k)} {_n((x1 - x0 + 2 * s) * k)} {_n((y1 - y0 + 2 * s) * k)} re W n"
+    escala = folhas.escala * k
+    origem_x = ((x0 + x1) / 2 - largura_pagina * folhas.escala / 2) * k
+    topo_y = ((y0 + y1) / 2 - altura_pagina * folhas.escala / 2) * k
+    return f"q {recorte} {_cm((escala, 0, 0, escala, origem_x, altura_pt - topo_y - altura_pagina * escala))}"
+
+
+def escrever_pdf_vetorial(modo, template_bytes, inicio, fim, dado_base, config, destino, imposicao=None, progresso=None, codificacao=None):
+    """
+    Escreve em `destino` um PDF vetorial com as comandas de `inicio` a `fim`,
+    uma por página ou, com `imposicao` (ver imposicao.py), várias por folha.
+    `progresso`, se indicado, é chamado sem argumentos depois de cada página
+    (por exemplo tarefas.Tarefa.avancar). `codificacao` (ver escritor_pdf)
+    aplica-se à imagem do template, a única imagem do PDF.
+    Devolve o número de páginas (0 se a fonte não puder ser carregada).
+    """
+    atlas = motor.obter_atlas(config['caminho_fonte'], config['tamanho_texto'], config['rotacao_texto'])
+    if atlas is None:
+        return 0
+    with medir("decodificar_template"):
+        background = Image.open(io.BytesIO(template_bytes))
+        background.load()
+    with medir("converter_rgb"):
+        background = background.convert("RGBA").convert("RGB")
+    largura_pagina, altura_pagina = background.size
+    folhas = Imposicao(imposicao, largura_pagina, altura_pagina) if imposicao else None
+
+    escritor = EscritorPdf(destino)
+    # O código e o número são vetoriais: a paleta só precisa das cores do template
+    codificacao = resolver_codificacao(codificacao, background) if codificacao is not None else None
+    id_fundo = escritor.adicionar_xobject_imagem(codificar_pagina(background, codificacao))
+    del background
+    id_fonte = embutir_fonte_truetype(escritor, config['caminho_fonte'])
+    id_fonte_barras = None
+
+    def conteudo_comanda(numero):
+        nonlocal id_fonte_barras
+        conteudo = [f"q {largura_pagina} 0 0 {altura_pagina} 0 0 cm /Fundo Do Q"]
+        if modo == motor.MODO_QRCODE:
+            conteudo += _conteudo_qrcode(numero, dado_base, config, altura_pagina)
+            texto = str(numero)
+        else:
+            operacoes, usa_fonte_barras = _conteudo_code39(numero, config, altura_pagina, "F2")
+            conteudo += operacoes
+            if usa_fonte_barras and id_fonte_barras is None:
+                id_fonte_barras = embutir_fonte_truetype(escritor, ImageWriter().font_path)
+            texto = str(numero).zfill(4)
+        return conteudo + _conteudo_numero(texto, atlas, config, altura_pagina)
+
+    def escrever_pagina(largura_pt, altura_pt, conteudo):
+        fontes = f"/F1 {id_fonte} 0 R" + (f" /F2 {id_fonte_barras} 0 R" if id_fonte_barras else "")
+        recursos = f"/ProcSet [/PDF /Text /ImageC] /XObject << /Fundo {id_fundo} 0 R >> /Font << {fontes} >>"
+        escritor.adicionar_pagina(largura_pt, altura_pt, recursos, "\n".join(conteudo).encode("latin-1"), comprimir=True)
+        if progresso is not None:
+            progresso()
+
+    if folhas is None:
+        for numero in range(inicio, fim + 1):
+            escrever_pagina(largura_pagina, altura_pagina, conteudo_comanda(numero))
+    else:
+        largura_pt, altura_pt = folhas.largura * 72 / folhas.dpi, folhas.altura * 72 / folhas.dpi
+        marcas = _conteudo_marcas(folhas, altura_pt)
+        celulas = [_celula(folhas, indice, largura_pagina, altura_pagina, altura_pt) for indice in range(folhas.por_folha)]
+        for primeiro in range(inicio, fim + 1, folhas.por_folha):
+            conteudo = list(marcas)
+            for celula, numero in zip(celulas, range(primeiro, min(primeiro + folhas.por_folha, fim + 1))):
+                conteudo += [celula, *conteudo_comanda(numero), "Q"]
+            escrever_pagina(largura_pt, altura_pt, conteudo)
+    escritor.fechar()
+    return len(escritor.paginas)
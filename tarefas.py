@@ -0,0 +1,196 @@
+# ==============================
+# BIBLIOTECAS
+# ==============================
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from instrumentacao import sessao
+
+# ===================================================================
+# TAREFAS EM SEGUNDO PLANO
+# ===================================================================
+# Um lote grande não corre dentro da execução do Streamlit: é submetido a
+# um GestorTarefas partilhado por todas as sessões, que o corre numa das
+# suas threads. Só `simultaneas` lotes correm ao mesmo tempo; os restantes
+# ficam na fila, pela ordem de chegada, para que dois operadores com lotes
+# grandes não disputem os mesmos núcleos. A interface só consulta o estado
+# de cada tarefa (progresso, resultado) e pode pedir o cancelamento.
+#
+# A função da tarefa recebe a Tarefa como primeiro argumento e:
+#   - passa as páginas por tarefa.acompanhar() (ou chama tarefa.avancar()
+#     a cada página), o que atualiza o progresso e interrompe o lote com
+#     TarefaCancelada quando o cancelamento é pedido;
+#   - escreve os ficheiros de resultado nos caminhos de tarefa.novo_resultado().
+# Cada tarefa corre numa instrumentacao.sessao(), cujas métricas ficam em
+# tarefa.metricas. Os resultados ficam numa pasta temporária e são apagados
+# quando a tarefa é removida ou, depois de terminada, ao fim de
+# VALIDADE_RESULTADO_S segundos.
+
+TAREFAS_SIMULTANEAS = int(os.environ.get("GERADOR_COMANDAS_TAREFAS", "1"))
+VALIDADE_RESULTADO_S = 3600
+
+EM_FILA = "em fila"
+A_GERAR = "a gerar"
+CONCLUIDA = "concluída"
+CANCELADA = "cancelada"
+FALHOU = "falhou"
+
+
+class TarefaCancelada(Exception):
+    """Levantada dentro da função da tarefa quando o cancelamento foi pedido."""
+
+
+class Tarefa:
+    """Estado de um lote submetido ao GestorTarefas."""
+
+    def __init__(self, identificador, descricao, total, pasta):
+        self.id = identificador
+        self.descricao = descricao
+        self.total = total
+        self.pasta = pasta
+        self.estado = EM_FILA
+        self.feitas = 0
+        self.erro = None
+        self.mensagens = []
+        self.avisos = []
+        self.resultados = []
+        self.metricas = None
+        self.criada = time.time()
+        self.iniciada = None
+        self.terminada = None
+        self._cancelar = threading.Event()
+
+    @property
+    def ativa(self):
+        return self.estado in (EM_FILA, A_GERAR)
+
+    @property
+    def progresso(self):
+        """Fração das páginas já geradas, entre 0 e 1."""
+        return min(1.0, self.feitas / self.total) if self.total else 0.0
+
+    @property
+    def duracao(self):
+        """Segundos desde o arranque da tarefa (até ao fim, se já terminou), ou None se ainda não arrancou."""
+        if self.iniciada is None:
+            return None
+        return (self.terminada or time.time()) - self.iniciada
+
+    def cancelar(self):
+        """Pede o cancelamento; a tarefa para na próxima página."""
+        self._cancelar.set()
+
+    @property
+    def cancelamento_pedido(self):
+        return self._cancelar.is_set()
+
+    def avancar(self, quantidade=1):
+        """Conta `quantidade` páginas geradas. Levanta TarefaCancelada se o cancelamento foi pedido."""
+        if self._cancelar.is_set():
+            raise TarefaCancelada()
+        self.feitas += quantidade
+
+    def acompanhar(self, paginas):
+        """Gerador que devolve as páginas de `paginas` e conta cada uma (ver avancar)."""
+        try:
+            for pagina in paginas:
+                self.avancar()
+                yield pagina
+        finally:
+            # Fecha já o gerador de origem (e o seu conjunto de processos) ao cancelar
+            fechar = getattr(paginas, "close", None)
+            if fechar is not None:
+                fechar()
+
+    def novo_resultado(self, nome, mime):
+        """Regista um ficheiro de resultado e devolve o caminho onde a tarefa o deve escrever."""
+        os.makedirs(self.pasta, exist_ok=True)
+        caminho = os.path.join(self.pasta, nome)
+        self.resultados.append((nome, caminho, mime))
+        return caminho
+
+    def apagar_resultados(self):
+        self.resultados = []
+        shutil.rmtree(self.pasta, ignore_errors=True)
+
+
+class GestorTarefas:
+    """Fila de lotes com um limite de `simultaneas` lotes a correr ao mesmo tempo."""
+
+    def __init__(self, simultaneas=TAREFAS_SIMULTANEAS, pasta=None):
+        self.simultaneas = max(1, simultaneas)
+        self.pasta = pasta or tempfile.mkdtemp(prefix="gerador_comandas_tarefas_")
+        self._executor = ThreadPoolExecutor(max_workers=self.simultaneas, thread_name_prefix="tarefa")
+        self._tarefas = {}
+        self._bloqueio = threading.Lock()
+        self._identificadores = itertools.count(1)
+
+    def submeter(self, descricao, total, funcao, *argumentos):
+        """Põe `funcao(tarefa, *argumentos)` na fila. `total` é o número de páginas esperado. Devolve a Tarefa."""
+        self.limpar_expiradas()
+        with self._bloqueio:
+            identificador = next(self._identificadores)
+            tarefa = Tarefa(identificador, descricao, total, os.path.join(self.pasta, str(identificador)))
+            self._tarefas[identificador] = tarefa
+        self._executor.submit(self._executar, tarefa, funcao, argumentos)
+        return tarefa
+
+    def _executar(self, tarefa, funcao, argumentos):
+        if tarefa.cancelamento_pedido:
+            tarefa.estado = CANCELADA
+            tarefa.terminada = time.time()
+            return
+        tarefa.estado = A_GERAR
+        tarefa.iniciada = time.time()
+        with sessao() as metricas:
+            tarefa.metricas = metricas
+            try:
+                funcao(tarefa, *argumentos)
+                estado = CONCLUIDA
+            except TarefaCancelada:
+                tarefa.apagar_resultados()
+                estado = CANCELADA
+            except Exception as erro:  # o erro é mostrado na interface em vez de perder a thread
+                logging.exception("Tarefa %d falhou.", tarefa.id)
+                tarefa.apagar_resultados()
+                tarefa.erro = str(erro) or type(erro).__name__
+                estado = FALHOU
+        tarefa.terminada = time.time()
+        tarefa.estado = estado
+        if self.obter(tarefa.id) is None:
+            # Removida enquanto corria: ninguém vai descarregar os resultados
+            tarefa.apagar_resultados()
+
+    def obter(self, identificador):
+        return self._tarefas.get(identificador)
+
+    def posicao_na_fila(self, tarefa):
+        """Quantas tarefas em fila estão à frente desta, mais um (0 se já não está na fila)."""
+        if tarefa.estado != EM_FILA:
+            return 0
+        with self._bloqueio:
+            return 1 + sum(1 for outra in self._tarefas.values() if outra.estado == EM_FILA and outra.id < tarefa.id)
+
+    def remover(self, identificador):
+        """Cancela a tarefa (se ainda estiver ativa) e apaga-a com os resultados."""
+        with self._bloqueio:
+            tarefa = self._tarefas.pop(identificador, None)
+        if tarefa is None:
+            return
+        tarefa.cancelar()
+        if not tarefa.ativa:
+            tarefa.apagar_resultados()
+
+    def limpar_expiradas(self):
+        """Remove as tarefas terminadas há mais de VALIDADE_RESULTADO_S segundos."""
+        limite = time.time() - VALIDADE_RESULTADO_S
+        with self._bloqueio:
+            tarefas = list(self._tarefas.values())
+        for tarefa in tarefas:
+            if not tarefa.ativa and tarefa.terminada and tarefa.terminada < limite:
+                self.remover(tarefa.id)
@@ -0,0 +1,38 @@
+# Os testes importam os módulos da raiz do repositório (motor, verificacao, ...)
+import io
+import os
+import sys
+import pytest
+from PIL import Image, ImageDraw
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASTA_FONTES = os.path.join(RAIZ, "fonts")
+FONTE = os.path.join(PASTA_FONTES, "Roboto-VariableFont_wdth,wght.ttf")
+sys.path.insert(0, RAIZ)
+
+from motor import aplicar_mascara_qrcode  # noqa: E402
+
+DADO_BASE = aplicar_mascara_qrcode("12345678000190", "CNPJ")
+
+
+@pytest.fixture(scope="session")
+def template_bytes():
+    """Template sintético de 600x900 com três cores, em PNG."""
+    imagem = Image.new("RGB", (600, 900), "#F2E6D0")
+    ImageDraw.Draw(imagem).rectangle((0, 0, 600, 120), fill="#8B1E3F")
+    buffer = io.BytesIO()
+    imagem.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def config_qrcode():
+    return {'tamanho_qr': 330, 'qr_x': 300, 'qr_y': 380, 'tamanho_texto': 70, 'texto_x': 300, 'texto_y': 700,
+            'cor_texto': '#000000', 'rotacao_qr': 0, 'rotacao_texto': 0, 'caminho_fonte': FONTE}
+
+
+@pytest.fixture
+def config_barras():
+    return {'prefixo': '/', 'largura': 500, 'altura': 160, 'corte_vertical': 27, 'bar_x': 300, 'bar_y': 380,
+            'tamanho_texto': 70, 'texto_x': 300, 'texto_y': 700, 'cor_texto': '#000000', 'caminho_fonte': FONTE,
+            'rotacao_barra': 0, 'rotacao_texto': 0, 'corte_esq': 8, 'corte_dir': 8}
@@ -0,0 +1,46 @@
+# ===================================================================
+# ATLAS DE DÍGITOS CONTRA draw.text
+# ===================================================================
+# O número desenhado pelo AtlasDigitos tem de ser igual, pixel a pixel, ao
+# que a versão original desenhava com draw.text (rotação 0) ou com uma
+# imagem temporária rodada e colada com máscara (restantes rotações).
+import os
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+from conftest import PASTA_FONTES
+from motor import obter_atlas
+
+FONTES = ["Roboto-VariableFont_wdth,wght.ttf", "Poppins-Bold.ttf", "Oswald-VariableFont_wght.ttf", "Montserrat-Italic-VariableFont_wght.ttf"]
+TEXTOS = ["7", "0041", "1234567890", "10000"]
+
+
+def texto_original(imagem, texto, fonte, centro_x, centro_y, cor, rotacao):
+    """Desenho do número como na versão original (gerar_imagem_qrcode / gerar_imagem_barcode)."""
+    imagem_final = imagem.convert("RGBA")
+    draw = ImageDraw.Draw(imagem_final)
+    texto_bbox = draw.textbbox((0, 0), texto, font=fonte)
+    texto_w, texto_h = texto_bbox[2] - texto_bbox[0], texto_bbox[3] - texto_bbox[1]
+    if rotacao == 0:
+        draw.text((centro_x - texto_w // 2, centro_y - texto_h // 2), texto, font=fonte, fill=cor)
+    else:
+        texto_img = Image.new('RGBA', (texto_w, texto_h), (0, 0, 0, 0))
+        ImageDraw.Draw(texto_img).text((-texto_bbox[0], -texto_bbox[1]), texto, font=fonte, fill=cor)
+        texto_rotacionado = texto_img.rotate(rotacao, expand=True, fillcolor=(0, 0, 0, 0))
+        rot_w, rot_h = texto_rotacionado.size
+        imagem_final.paste(texto_rotacionado, (centro_x - rot_w // 2, centro_y - rot_h // 2), texto_rotacionado)
+    return imagem_final.convert("RGB")
+
+
+@pytest.mark.parametrize("nome_fonte", FONTES)
+@pytest.mark.parametrize("rotacao", [0, 90, 180, 270])
+@pytest.mark.parametrize("tamanho", [37, 150])
+def test_atlas_igual_a_draw_text(nome_fonte, rotacao, tamanho):
+    caminho = os.path.join(PASTA_FONTES, nome_fonte)
+    fonte = ImageFont.truetype(caminho, tamanho)
+    atlas = obter_atlas(caminho, tamanho, rotacao)
+    for texto in TEXTOS:
+        base = Image.new("RGB", (1400, 1400), "#3a7bd5")
+        esperado = texto_original(base, texto, fonte, 701, 698, "#F5E50A", rotacao)
+        obtido = base.copy()
+        atlas.desenhar(obtido, texto, 701, 698, "#F5E50A")
+        assert obtido.tobytes() == esperado.tobytes(), texto
@@ -0,0 +1,51 @@
+# ===================================================================
+# CODE39 NATIVO CONTRA O PYTHON-BARCODE
+# ===================================================================
+# gerar_code39 reproduz a tela que o python-barcode desenharia. Se uma
+# versão nova da biblioteca mudar a geometria, estes testes falham antes
+# de as comandas deixarem de ser lidas.
+import io
+import pytest
+from barcode import Code39
+from barcode.writer import ImageWriter
+from PIL import Image
+from motor import gerar_code39
+
+# (número, prefixo, largura, altura, corte_vertical, rotacao_barra, corte_esq, corte_dir)
+LAYOUTS = [
+    (1, "/", 570, 215, 27, 0, 8, 8),
+    (42, "", 300, 80, 0, 0, 0, 0),
+    (9999, "MESA", 800, 300, 10, 90, 3, 12),
+    (12345, "A-", 451, 133, 50, 180, 20, 0),
+    (7, "$", 1200, 40, 35, 270, 0, 25),
+    (305, "X", 97, 611, 5, 90, 45, 40),
+    (8, "/", 200, 100, 100, 0, 0, 0),
+    (56, "/", 640, 180, 0, 180, 0, 0),
+]
+
+
+def code39_original(numero, prefixo, largura, altura, corte_vertical, rotacao_barra, corte_esq, corte_dir):
+    """Código de barras como na versão original: PNG do python-barcode cortado, redimensionado e rodado."""
+    codigo = f"{prefixo}{str(numero).zfill(4)}"
+    writer = ImageWriter()
+    writer.set_options({'module_width': 0.7, 'module_height': altura / 10, 'quiet_zone': 2.0, 'font_size': 0, 'text_distance': 0, 'write_text': False})
+    output = io.BytesIO()
+    Code39(codigo, writer=writer, add_checksum=False).write(output)
+    output.seek(0)
+    imagem = Image.open(output)
+    largura_real, altura_real = imagem.size
+    corte_altura = int(altura_real * (1 - (corte_vertical / 100)))
+    corte_esq_px = int(largura_real * (corte_esq / 100))
+    corte_dir_px = int(largura_real * (1 - (corte_dir / 100)))
+    imagem = imagem.crop((corte_esq_px, 0, corte_dir_px, corte_altura)).resize((largura, altura), Image.Resampling.NEAREST)
+    if rotacao_barra != 0:
+        imagem = imagem.rotate(rotacao_barra, expand=True)
+    return imagem.convert("L")
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_code39_igual_ao_python_barcode(layout):
+    esperado = code39_original(*layout)
+    obtido = gerar_code39(*layout)
+    assert obtido.size == esperado.size
+    assert obtido.tobytes() == esperado.tobytes()
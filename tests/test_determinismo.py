@@ -0,0 +1,55 @@
+# ===================================================================
+# A COMANDA N SAI SEMPRE IGUAL
+# ===================================================================
+# A versão e a máscara do QR Code são memorizadas por processo. A comanda N
+# tem de sair com os mesmos bytes seja qual for o número por onde o lote
+# começa e o que o processo já gerou antes, senão o cache em disco guarda
+# páginas que dependem da história do processo.
+import pytest
+from conftest import DADO_BASE
+from cache_disco import CacheComandas
+from escritor_pdf import CODIFICACAO_PADRAO
+from motor import MODO_QRCODE, gerar_paginas, gerar_qrcode, montar_url_qrcode, parametros_qrcode
+
+# 1000 e 10000 têm payloads do mesmo tamanho com este CNPJ
+AQUECIMENTOS = [None, 1000, 9999, 99999, 100000]
+
+
+def test_payloads_partilham_o_tamanho():
+    assert len(montar_url_qrcode(1000, DADO_BASE)) == len(montar_url_qrcode(10000, DADO_BASE))
+
+
+@pytest.mark.parametrize("numero", [10000, 1000, 100001])
+def test_qrcode_nao_depende_dos_numeros_anteriores(numero):
+    imagens = []
+    for aquecimento in AQUECIMENTOS:
+        parametros_qrcode.cache_clear()
+        if aquecimento is not None:
+            gerar_qrcode(aquecimento, DADO_BASE, 330, 0)
+        imagens.append(gerar_qrcode(numero, DADO_BASE, 330, 0).tobytes())
+    assert all(imagem == imagens[0] for imagem in imagens)
+
+
+def _paginas(template_bytes, config, inicio, fim):
+    return [pagina.dados for pagina in gerar_paginas(MODO_QRCODE, template_bytes, inicio, fim, DADO_BASE, config, codificacao=CODIFICACAO_PADRAO)]
+
+
+@pytest.mark.parametrize("aquecimento, inicio", [(1000, 10000), (None, 9999), (99999, 9999)])
+def test_pagina_nao_depende_do_inicio_do_lote(template_bytes, config_qrcode, aquecimento, inicio):
+    parametros_qrcode.cache_clear()
+    esperada = _paginas(template_bytes, config_qrcode, 10000, 10000)[-1]
+    parametros_qrcode.cache_clear()
+    if aquecimento is not None:
+        _paginas(template_bytes, config_qrcode, aquecimento, aquecimento)
+    assert _paginas(template_bytes, config_qrcode, inicio, 10000)[-1] == esperada
+
+
+def test_cache_devolve_o_mesmo_que_a_renderizacao(tmp_path, template_bytes, config_qrcode):
+    parametros_qrcode.cache_clear()
+    esperadas = _paginas(template_bytes, config_qrcode, 9998, 10001)
+    cache = CacheComandas(str(tmp_path))
+    parametros_qrcode.cache_clear()
+    assert [pagina.dados for pagina in cache.paginas(MODO_QRCODE, template_bytes, 10000, 10001, DADO_BASE, config_qrcode)] == esperadas[2:]
+    parametros_qrcode.cache_clear()
+    assert [pagina.dados for pagina in cache.paginas(MODO_QRCODE, template_bytes, 9998, 10001, DADO_BASE, config_qrcode)] == esperadas
+    assert (cache.acertos, cache.falhas) == (2, 4)
@@ -0,0 +1,119 @@
+# ===================================================================
+# LEITURA DOS CÓDIGOS
+# ===================================================================
+import io
+import numpy as np
+import pytest
+import qrcode
+from barcode.charsets import code39
+from PIL import Image
+from conftest import DADO_BASE
+from escritor_pdf import CODIFICACAO_PADRAO
+from imposicao import IMPOSICAO_PADRAO
+from motor import MODO_BARRAS, MODO_QRCODE, ModeloComanda, gerar_paginas
+from verificacao import ErroLeitura, RelatorioVerificacao, amostrar_qrcode, descodificar_linha_code39, descodificar_matriz_qrcode, verificar_pagina
+
+
+def _modelo(template_bytes, modo, config):
+    return ModeloComanda(Image.open(io.BytesIO(template_bytes)), modo, DADO_BASE if modo == MODO_QRCODE else None, config)
+
+
+@pytest.mark.parametrize("rotacao", [0, 90, 180, 270])
+def test_le_o_qrcode_de_cada_comanda(template_bytes, config_qrcode, rotacao):
+    config = dict(config_qrcode, rotacao_qr=rotacao)
+    modelo = _modelo(template_bytes, MODO_QRCODE, config)
+    for numero in (1, 99, 1000, 123456):
+        leitura = verificar_pagina(modelo.renderizar(numero), numero, MODO_QRCODE, DADO_BASE, config)
+        assert leitura.erro is None, leitura
+
+
+@pytest.mark.parametrize("rotacao", [0, 90, 180, 270])
+def test_le_o_code39_de_cada_comanda(template_bytes, config_barras, rotacao):
+    # Com a barra rodada, o número fica mais abaixo para não tapar as barras
+    config = dict(config_barras, rotacao_barra=rotacao, texto_y=850 if rotacao in (90, 270) else 700)
+    modelo = _modelo(template_bytes, MODO_BARRAS, config)
+    for numero in (1, 42, 9999):
+        leitura = verificar_pagina(modelo.renderizar(numero), numero, MODO_BARRAS, None, config)
+        assert leitura.erro is None, leitura
+
+
+def test_numero_na_margem_do_qrcode_e_uma_falha_de_leitura(template_bytes, config_qrcode):
+    # O número toca na margem de cima do QR Code, à direita do padrão de localização
+    config = dict(config_qrcode, tamanho_texto=40, texto_x=380, texto_y=212)
+    modelo = _modelo(template_bytes, MODO_QRCODE, config)
+    leitura = verificar_pagina(modelo.renderizar(7), 7, MODO_QRCODE, DADO_BASE, config)
+    assert leitura.lido is None
+    assert "margem" in leitura.erro
+
+
+def test_numero_por_cima_das_barras_e_uma_falha_de_leitura(template_bytes, config_barras):
+    # O número fica por cima de parte das barras, a meio da altura
+    config = dict(config_barras, tamanho_texto=60, texto_x=200, texto_y=380)
+    modelo = _modelo(template_bytes, MODO_BARRAS, config)
+    leitura = verificar_pagina(modelo.renderizar(42), 42, MODO_BARRAS, None, config)
+    assert leitura.erro is not None
+
+
+def _linha_code39(texto):
+    """Linha de leitura (um elemento por módulo) do Code39 de `texto`, já com os asteriscos."""
+    padroes = [code39.EDGE if caractere == "*" else code39.MAP[caractere][1] for caractere in texto]
+    return np.array([modulo == "1" for modulo in "0".join(padroes)])
+
+
+def test_linha_sem_barras():
+    with pytest.raises(ErroLeitura):
+        descodificar_linha_code39(np.zeros(50, dtype=bool))
+
+
+def test_asterisco_no_meio_do_code39():
+    assert descodificar_linha_code39(_linha_code39("*AB-12*")) == "AB-12"
+    with pytest.raises(ErroLeitura):
+        descodificar_linha_code39(_linha_code39("*A*B*"))
+
+
+def test_regioes_aleatorias_so_dao_erros_de_leitura():
+    aleatorio = np.random.default_rng(2024)
+    for _ in range(500):
+        escuro = aleatorio.random(tuple(aleatorio.integers(1, 100, size=2))) < aleatorio.random()
+        with pytest.raises(ErroLeitura):
+            descodificar_matriz_qrcode(*amostrar_qrcode(escuro))
+        linha = aleatorio.random(aleatorio.integers(1, 200)) < aleatorio.random()
+        try:
+            texto = descodificar_linha_code39(linha)
+        except ErroLeitura:
+            continue
+        assert set(texto) <= set(code39.MAP), texto
+
+
+def test_modulos_trocados_sao_detetados():
+    aleatorio = np.random.default_rng(7)
+    for _ in range(200):
+        qr = qrcode.QRCode(border=0, error_correction=int(aleatorio.integers(0, 4)))
+        qr.add_data("".join(map(chr, aleatorio.integers(32, 127, size=aleatorio.integers(1, 150)))))
+        qr.make()
+        matriz = np.array(qr.get_matrix())
+        assert descodificar_matriz_qrcode(matriz, qr.version) == qr.data_list[0].data.decode("ascii")
+        linha, coluna = aleatorio.integers(9, len(matriz), size=2)
+        matriz[linha, coluna] ^= True
+        try:
+            lido = descodificar_matriz_qrcode(matriz, qr.version)
+        except ErroLeitura:
+            continue
+        assert lido == qr.data_list[0].data.decode("ascii")
+
+
+@pytest.mark.parametrize("processos, imposicao", [(1, None), (2, dict(IMPOSICAO_PADRAO, colunas=2, linhas=1, dpi=150))])
+def test_leitura_na_mesma_passagem(template_bytes, config_qrcode, processos, imposicao):
+    lidos = []
+    paginas = list(gerar_paginas(MODO_QRCODE, template_bytes, 98, 105, DADO_BASE, config_qrcode, processos, imposicao, codificacao=CODIFICACAO_PADRAO, ao_ler=lidos.append))
+    assert len(paginas) == (8 if imposicao is None else 4)
+    assert [leitura.numero for leitura in lidos] == list(range(98, 106))
+    assert all(leitura.erro is None for leitura in lidos)
+
+
+def test_leitura_na_mesma_passagem_deteta_o_layout_errado(template_bytes, config_qrcode):
+    relatorio = RelatorioVerificacao(limite_falhas=2)
+    config = dict(config_qrcode, tamanho_texto=40, texto_x=380, texto_y=212)
+    paginas = list(gerar_paginas(MODO_QRCODE, template_bytes, 1, 5, DADO_BASE, config, ao_ler=relatorio.registar))
+    assert len(paginas) == 5
+    assert (relatorio.total, relatorio.falhas, len(relatorio.exemplos_falhas)) == (5, 5, 2)
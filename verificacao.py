@@ -0,0 +1,443 @@
+# ==============================
+# BIBLIOTECAS
+# ==============================
+import functools
+import io
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+import numpy as np
+import qrcode
+from qrcode import base as qr_base
+from qrcode import util as qr_util
+from barcode.charsets import code39
+from PIL import Image
+from motor import MODO_QRCODE, CONTEXTO_PROCESSOS, ModeloComanda, montar_url_qrcode, dividir_em_blocos
+from instrumentacao import medir, ativar, recolher, metricas_atuais
+
+# ===================================================================
+# VERIFICAÇÃO DOS CÓDIGOS POR LEITURA
+# ===================================================================
+# Cada comanda renderizada é lida de volta, como faria um leitor, e o texto
+# lido é comparado com o esperado: o URL do QR Code (montar_url_qrcode) ou
+# o `prefixo + NNNN` do Code39. A posição e a rotação do código vêm do
+# layout; tudo o resto é lido dos pixels com operações em arrays numpy:
+#
+# QR Code: a grelha de módulos é amostrada no centro de cada módulo (o
+# tamanho do módulo vem do padrão de localização do canto superior
+# esquerdo), a informação de formato dá o nível de correção e a máscara, e
+# os bits de dados são lidos pela ordem em ziguezague. A ordem, as zonas
+# reservadas e a divisão em blocos Reed-Solomon vêm da própria biblioteca
+# qrcode e são calculadas uma vez por versão. Cada bloco tem de ter as
+# síndromes Reed-Solomon a zero: a verificação é estrita (não corrige
+# erros), porque numa comanda acabada de gerar qualquer módulo trocado é um
+# defeito. São descodificados os segmentos numérico, alfanumérico e byte.
+#
+# Code39: as linhas com mais transições (as das barras) são combinadas por
+# maioria numa só linha de leitura, cujas larguras de barras e espaços são
+# classificadas em estreitas e largas e agrupadas em caracteres de 9
+# elementos, entre os asteriscos de início e fim.
+#
+# Num lote, a leitura é feita na mesma passagem que gera as páginas
+# (motor.gerar_paginas com `ao_ler`), sobre a comanda acabada de desenhar e
+# antes da codificação, e as Leituras são juntas num RelatorioVerificacao.
+# verificar_paginas renderiza e lê as comandas à parte, em paralelo e por
+# blocos, para quando a exportação não passa pelas comandas em imagem (PDF
+# vetorial); só devolve ao processo principal o resultado de cada número.
+
+Leitura = namedtuple("Leitura", ["numero", "esperado", "lido", "erro"])
+
+
+class ErroLeitura(ValueError):
+    """O código da página não pôde ser lido."""
+
+
+LIMIAR_ESCURO = 128
+
+# ==============================
+# RECORTE DO CÓDIGO NA PÁGINA
+# ==============================
+
+def recortar_codigo(pagina, centro_x, centro_y, largura, altura, rotacao):
+    """
+    Pixels escuros (array bool) da região onde o código foi colado, já
+    rodados de volta para a orientação 0. `largura` e `altura` são as do
+    código antes da rotação.
+    """
+    if rotacao in (90, 270):
+        largura, altura = altura, largura
+    esquerda, topo = centro_x - largura // 2, centro_y - altura // 2
+    with medir("recortar_codigo"):
+        regiao = np.asarray(pagina.crop((esquerda, topo, esquerda + largura, topo + altura)).convert("L"))
+        return np.rot90(regiao < LIMIAR_ESCURO, -(rotacao // 90))
+
+# ==============================
+# QR CODE
+# ==============================
+
+# Nível de correção (valor dos bits de formato) -> nome
+NIVEIS_CORRECAO = {qrcode.constants.ERROR_CORRECT_L: "L", qrcode.constants.ERROR_CORRECT_M: "M",
+                   qrcode.constants.ERROR_CORRECT_Q: "Q", qrcode.constants.ERROR_CORRECT_H: "H"}
+# Os 32 códigos de formato válidos (nível << 3 | máscara), já com a máscara de formato
+FORMATOS_QRCODE = np.array([qr_util.BCH_type_info(dados) for dados in range(32)])
+# Número de bits a 1 de cada valor de 15 bits (np.bitwise_count só existe a partir do numpy 2.0)
+BITS_A_UM = np.array([bin(valor).count("1") for valor in range(1 << 15)], dtype=np.uint8)
+
+
+def _posicoes_formato(modulos):
+    """Posições (linha, coluna) dos bits 0..14 das duas cópias da informação de formato (como em QRCode.setup_type_info)."""
+    vertical, horizontal = [], []
+    for i in range(15):
+        vertical.append((i, 8) if i < 6 else (i + 1, 8) if i < 8 else (modulos - 15 + i, 8))
+        horizontal.append((8, modulos - i - 1) if i < 8 else (8, 15 - i) if i < 9 else (8, 15 - i - 1))
+    return np.array(vertical).T, np.array(horizontal).T
+
+
+@functools.lru_cache(maxsize=None)
+def _disposicao(versao):
+    """
+    Linhas e colunas dos módulos de dados pela ordem de leitura (ziguezague,
+    como em QRCode.map_data) e as posições da informação de formato.
+    As zonas reservadas são as que a biblioteca qrcode desenha em makeImpl.
+    """
+    qr = qrcode.QRCode(version=versao)
+    qr.modules_count = modulos = versao * 4 + 17
+    qr.modules = [[None] * modulos for _ in range(modulos)]
+    qr.setup_position_probe_pattern(0, 0)
+    qr.setup_position_probe_pattern(modulos - 7, 0)
+    qr.setup_position_probe_pattern(0, modulos - 7)
+    qr.setup_position_adjust_pattern()
+    qr.setup_timing_pattern()
+    qr.setup_type_info(True, 0)
+    if versao >= 7:
+        qr.setup_type_number(True)
+
+    linhas, colunas = [], []
+    linha, sentido = modulos - 1, -1
+    for coluna in range(modulos - 1, 0, -2):
+        if coluna <= 6:
+            coluna -= 1
+        while 0 <= linha < modulos:
+            for c in (coluna, coluna - 1):
+                if qr.modules[linha][c] is None:
+                    linhas.append(linha)
+                    colunas.append(c)
+            linha += sentido
+        linha -= sentido
+        sentido = -sentido
+    return np.array(linhas), np.array(colunas), _posicoes_formato(modulos)
+
+
+@functools.lru_cache(maxsize=None)
+def _mascara(versao, padrao):
+    """Bits da máscara `padrao` nos módulos de dados, pela ordem de leitura."""
+    linhas, colunas, _ = _disposicao(versao)
+    funcao = qr_util.mask_func(padrao)
+    return np.fromiter((funcao(int(i), int(j)) for i, j in zip(linhas, colunas)), dtype=bool, count=len(linhas))
+
+
+@functools.lru_cache(maxsize=None)
+def _blocos(versao, nivel):
+    """
+    Índices das palavras de cada bloco Reed-Solomon na sequência lida
+    (dados intercalados e depois correção intercalada): [(índices, n.º de palavras de dados)].
+    """
+    blocos = qr_base.rs_blocks(versao, nivel)
+    posicao = 0
+    dados = [[] for _ in blocos]
+    for i in range(max(bloco.data_count for bloco in blocos)):
+        for indice, bloco in enumerate(blocos):
+            if i < bloco.data_count:
+                dados[indice].append(posicao)
+                posicao += 1
+    correcao = [[] for _ in blocos]
+    for i in range(max(bloco.total_count - bloco.data_count for bloco in blocos)):
+        for indice, bloco in enumerate(blocos):
+            if i < bloco.total_count - bloco.data_count:
+                correcao[indice].append(posicao)
+                posicao += 1
+    return [(np.array(d + c), len(d)) for d, c in zip(dados, correcao)]
+
+
+_EXP = np.array([qr_base.gexp(i) for i in range(255)])
+_LOG = np.array([0] + [qr_base.glog(i) for i in range(1, 256)])
+
+
+def _sindromes_a_zero(palavras, quantidade_correcao):
+    """True se o bloco é uma palavra de código Reed-Solomon válida (síndromes r(α^i) = 0, i < quantidade_correcao)."""
+    nao_nulas = palavras != 0
+    logs = _LOG[palavras[nao_nulas]]
+    graus = (len(palavras) - 1 - np.flatnonzero(nao_nulas))
+    expoentes = (logs[None, :] + np.arange(quantidade_correcao)[:, None] * graus[None, :]) % 255
+    return not np.bitwise_xor.reduce(_EXP[expoentes], axis=1).any()
+
+
+def _segmentos(bits, versao):
+    """Descodifica os segmentos (numérico, alfanumérico, byte) de uma sequência de bits de dados."""
+    bits = (bits.astype(np.uint8) + ord("0")).tobytes()
+    texto = bytearray()
+    posicao = 0
+
+    def ler(quantidade):
+        nonlocal posicao
+        if posicao + quantidade > len(bits):
+            raise ErroLeitura("os dados do QR Code terminam a meio de um segmento")
+        valor = int(bits[posicao:posicao + quantidade], 2) if quantidade else 0
+        posicao += quantidade
+        return valor
+
+    while len(bits) - posicao >= 4:
+        modo = ler(4)
+        if modo == 0:
+            break
+        if modo not in (qr_util.MODE_NUMBER, qr_util.MODE_ALPHA_NUM, qr_util.MODE_8BIT_BYTE):
+            raise ErroLeitura(f"modo de segmento {modo} não suportado")
+        quantidade = ler(qr_util.length_in_bits(modo, versao))
+        if modo == qr_util.MODE_8BIT_BYTE:
+            texto += ler(8 * quantidade).to_bytes(quantidade, "big")
+        elif modo == qr_util.MODE_NUMBER:
+            for inicio in range(0, quantidade, 3):
+                digitos = min(3, quantidade - inicio)
+                texto += str(ler((4, 7, 10)[digitos - 1])).zfill(digitos).encode("ascii")
+        else:
+            for inicio in range(0, quantidade, 2):
+                pares = quantidade - inicio >= 2
+                valor = ler(11 if pares else 6)
+                if valor >= (45 * 45 if pares else 45):
+                    raise ErroLeitura("há caracteres inválidos num segmento alfanumérico do QR Code")
+                texto += bytes((qr_util.ALPHA_NUM[valor // 45], qr_util.ALPHA_NUM[valor % 45]) if pares else (qr_util.ALPHA_NUM[valor],))
+    try:
+        return texto.decode("utf-8")
+    except UnicodeDecodeError:
+        raise ErroLeitura("os dados do QR Code não são texto UTF-8") from None
+
+
+def amostrar_qrcode(escuro):
+    """
+    Matriz de módulos (array bool, sem a margem) do QR Code em `escuro`
+    (orientação 0). O tamanho do módulo é medido no padrão de localização
+    do canto superior esquerdo (7 módulos) e a grelha é amostrada no centro
+    de cada módulo da caixa do símbolo.
+    """
+    linhas_escuras = np.flatnonzero(escuro.any(axis=1))
+    colunas_escuras = np.flatnonzero(escuro.any(axis=0))
+    if len(linhas_escuras) == 0:
+        raise ErroLeitura("não há QR Code na posição do layout")
+    topo, fundo = linhas_escuras[0], linhas_escuras[-1] + 1
+    esquerda, direita = colunas_escuras[0], colunas_escuras[-1] + 1
+    linha_topo = escuro[topo, esquerda:direita]
+    claros = np.flatnonzero(~linha_topo)
+    largura_localizador = claros[0] if len(claros) else len(linha_topo)
+    if largura_localizador == 0:
+        # A caixa começa num pixel claro: há algo escuro (o número, por exemplo) na margem do código
+        raise ErroLeitura("o padrão de localização do QR Code não está no canto do código (há algo escuro na margem)")
+    modulos = round(7 * (direita - esquerda) / largura_localizador)
+    versao = round((modulos - 17) / 4)
+    if not 1 <= versao <= 40:
+        raise ErroLeitura("o padrão de localização do QR Code não foi encontrado")
+    modulos = versao * 4 + 17
+    ys = (topo + (np.arange(modulos) + 0.5) * (fundo - topo) / modulos).astype(int)
+    xs = (esquerda + (np.arange(modulos) + 0.5) * (direita - esquerda) / modulos).astype(int)
+    return escuro[np.ix_(ys, xs)], versao
+
+
+def descodificar_matriz_qrcode(matriz, versao):
+    """Texto de uma matriz de módulos (sem margem) da `versao` indicada. Levanta ErroLeitura."""
+    linhas, colunas, (formato_vertical, formato_horizontal) = _disposicao(versao)
+    pesos = 1 << np.arange(15)
+    lidos = [int(matriz[tuple(posicoes)].dot(pesos)) for posicoes in (formato_vertical, formato_horizontal)]
+    distancias = [BITS_A_UM[FORMATOS_QRCODE ^ lido] for lido in lidos]
+    melhor = min(distancias, key=lambda d: d.min())
+    if melhor.min() > 3:
+        raise ErroLeitura("a informação de formato do QR Code é ilegível")
+    formato = int(melhor.argmin())
+    nivel, padrao = formato >> 3, formato & 7
+
+    bits = matriz[linhas, colunas] ^ _mascara(versao, padrao)
+    blocos = _blocos(versao, nivel)
+    total_palavras = sum(len(indices) for indices, _ in blocos)
+    palavras = np.packbits(bits[:8 * total_palavras])
+    dados = []
+    for indices, quantidade_dados in blocos:
+        bloco = palavras[indices].astype(np.int64)
+        if not _sindromes_a_zero(bloco, len(indices) - quantidade_dados):
+            raise ErroLeitura(f"a correção de erros do QR Code não confere (nível {NIVEIS_CORRECAO[nivel]})")
+        dados.append(bloco[:quantidade_dados])
+    return _segmentos(np.unpackbits(np.concatenate(dados).astype(np.uint8)), versao)
+
+
+def ler_qrcode(pagina, config):
+    """Texto do QR Code colado na página com a configuração `config`. Levanta ErroLeitura."""
+    escuro = recortar_codigo(pagina, config['qr_x'], config['qr_y'], config['tamanho_qr'], config['tamanho_qr'], config['rotacao_qr'])
+    with medir("ler_qrcode"):
+        matriz, versao = amostrar_qrcode(escuro)
+        return descodificar_matriz_qrcode(matriz, versao)
+
+# ==============================
+# CÓDIGO DE BARRAS (CODE39)
+# ==============================
+
+def _larguras_code39(padrao):
+    """Padrão de módulos -> tupla de 9 bool (True = elemento largo)."""
+    return tuple(len(list(grupo)) > 1 for _, grupo in groupby(padrao))
+
+
+# Elementos largos (bit i = elemento i) -> caractere
+CARACTERES_CODE39 = {sum(1 << i for i, largo in enumerate(_larguras_code39(padrao)) if largo): caractere
+                     for caractere, (_, padrao) in code39.MAP.items()}
+CARACTERES_CODE39[sum(1 << i for i, largo in enumerate(_larguras_code39(code39.EDGE)) if largo)] = "*"
+
+
+def linha_leitura_code39(escuro):
+    """Linha de leitura (array bool): maioria das linhas com mais transições, que são as das barras."""
+    transicoes = np.count_nonzero(escuro[:, 1:] != escuro[:, :-1], axis=1)
+    if not transicoes.any():
+        raise ErroLeitura("não há código de barras na posição do layout")
+    return escuro[transicoes == transicoes.max()].mean(axis=0) > 0.5
+
+
+def descodificar_linha_code39(linha):
+    """Texto (sem os asteriscos) de uma linha de leitura de Code39. Levanta ErroLeitura."""
+    limites = np.concatenate(([0], np.flatnonzero(linha[1:] != linha[:-1]) + 1, [len(linha)]))
+    larguras = np.diff(limites)
+    barras = np.flatnonzero(linha[limites[:-1]])
+    if len(barras) == 0:
+        raise ErroLeitura("não há barras na linha de leitura do código de barras")
+    # Só interessam os elementos entre a primeira e a última barra
+    primeira, ultima = barras[[0, -1]]
+    larguras = larguras[primeira:ultima + 1]
+    if (len(larguras) + 1) % 10:
+        raise ErroLeitura(f"o código de barras tem {len(larguras)} elementos, que não formam caracteres Code39")
+    largos = larguras > (larguras.min() + larguras.max()) / 2
+    caracteres = np.append(largos, False).reshape(-1, 10)
+    if caracteres[:, 9].any():
+        raise ErroLeitura("há um espaço largo entre caracteres do código de barras")
+    chaves = caracteres[:, :9].dot(1 << np.arange(9))
+    texto = "".join(CARACTERES_CODE39.get(int(chave), "?") for chave in chaves)
+    if "?" in texto:
+        raise ErroLeitura(f"há caracteres inválidos no código de barras ({texto})")
+    if len(texto) < 2 or texto[0] != "*" or texto[-1] != "*":
+        raise ErroLeitura(f"faltam os caracteres de início/fim no código de barras ({texto})")
+    if "*" in texto[1:-1]:
+        raise ErroLeitura(f"há caracteres de início/fim no meio do código de barras ({texto})")
+    return texto[1:-1]
+
+
+def ler_code39(pagina, config):
+    """Texto do Code39 colado na página com a configuração `config`. Levanta ErroLeitura."""
+    escuro = recortar_codigo(pagina, config['bar_x'], config['bar_y'], config['largura'], config['altura'], config['rotacao_barra'])
+    with medir("ler_code39"):
+        return descodificar_linha_code39(linha_leitura_code39(escuro))
+
+# ==============================
+# VERIFICAÇÃO DE UM LOTE
+# ==============================
+
+def texto_esperado(modo, numero, dado_base, config):
+    """O que um leitor deve ler no código da comanda `numero`."""
+    if modo == MODO_QRCODE:
+        return montar_url_qrcode(numero, dado_base)
+    return f"{config['prefixo']}{str(numero).zfill(4)}".upper()
+
+
+def verificar_pagina(pagina, numero, modo, dado_base, config):
+    """
+    Lê o código da página (comanda `numero`) e devolve uma Leitura; `erro` é
+    None se o texto lido for o esperado. `pagina` é None quando a comanda não
+    pôde ser renderizada.
+    """
+    esperado = texto_esperado(modo, numero, dado_base, config)
+    if pagina is None:
+        return Leitura(numero, esperado, None, "a fonte não pôde ser carregada")
+    try:
+        lido = ler_qrcode(pagina, config) if modo == MODO_QRCODE else ler_code39(pagina, config)
+    except ErroLeitura as erro:
+        return Leitura(numero, esperado, None, str(erro))
+    return Leitura(numero, esperado, lido, None if lido == esperado else "o texto lido é diferente do esperado")
+
+
+_trabalho = {}
+
+
+def _iniciar_trabalhador(modo, template_bytes, dado_base, config, medir_etapas=False):
+    """Inicializador do processo: prepara o template uma única vez."""
+    if medir_etapas:
+        ativar()
+    _trabalho.update(modo=modo, dado_base=dado_base, config=config)
+    _trabalho['modelo'] = ModeloComanda(Image.open(io.BytesIO(template_bytes)), modo, dado_base, config)
+
+
+def _verificar_intervalo(modelo, modo, inicio, fim, dado_base, config):
+    for numero in range(inicio, fim + 1):
+        yield verificar_pagina(modelo.renderizar(numero), numero, modo, dado_base, config)
+
+
+def _verificar_bloco(bloco):
+    """Renderiza e lê os números de um bloco no processo atual. Devolve (leituras, métricas do bloco ou None)."""
+    inicio, fim = bloco
+    leituras = list(_verificar_intervalo(_trabalho['modelo'], _trabalho['modo'], inicio, fim, _trabalho['dado_base'], _trabalho['config']))
+    return leituras, recolher()
+
+
+def verificar_paginas(modo, template_bytes, inicio, fim, dado_base, config, processos=1):
+    """
+    Gerador das Leituras das comandas de `inicio` a `fim`, pela ordem dos
+    números. Cada comanda é renderizada (como em motor.gerar_paginas) e o
+    seu código lido logo a seguir; com mais de um processo, em blocos
+    repartidos pelos processos, com no máximo `2 * processos` em curso.
+    """
+    if processos <= 1 or fim <= inicio:
+        modelo = ModeloComanda(Image.open(io.BytesIO(template_bytes)), modo, dado_base, config)
+        yield from _verificar_intervalo(modelo, modo, inicio, fim, dado_base, config)
+        return
+    tamanho_bloco = max(1, min(256, (fim - inicio + 1) // (processos * 4)))
+    metricas = metricas_atuais()
+    initargs = (modo, template_bytes, dado_base, config, metricas is not None)
+    with ProcessPoolExecutor(max_workers=processos, mp_context=CONTEXTO_PROCESSOS, initializer=_iniciar_trabalhador, initargs=initargs) as executor:
+        pendentes = deque()
+
+        def resultado(futuro):
+            leituras, metricas_bloco = futuro.result()
+            if metricas_bloco and metricas is not None:
+                metricas.juntar(metricas_bloco)
+            return leituras
+
+        try:
+            for bloco in dividir_em_blocos(inicio, fim, tamanho_bloco):
+                pendentes.append(executor.submit(_verificar_bloco, bloco))
+                if len(pendentes) >= 2 * processos:
+                    yield from resultado(pendentes.popleft())
+            while pendentes:
+                yield from resultado(pendentes.popleft())
+        finally:
+            for futuro in pendentes:
+                futuro.cancel()
+
+
+class RelatorioVerificacao:
+    """
+    Junta as Leituras de um lote (registar, que pode ser passado como
+    `ao_ler` a motor.gerar_paginas) sem as guardar todas: conta as corretas
+    e guarda só as primeiras `limite_falhas` falhas.
+    """
+
+    def __init__(self, limite_falhas=1000):
+        self.limite_falhas = limite_falhas
+        self.total = 0
+        self.corretas = 0
+        self.exemplos_falhas = []
+
+    @property
+    def falhas(self):
+        return self.total - self.corretas
+
+    def registar(self, leitura):
+        self.total += 1
+        if leitura.erro is None:
+            self.corretas += 1
+        elif len(self.exemplos_falhas) < self.limite_falhas:
+            self.exemplos_falhas.append(leitura._asdict())
+
+    def como_dict(self):
+        """Total, corretas, número de falhas e as falhas guardadas (dicionários prontos a gravar em JSON)."""
+        return {'total': self.total, 'corretas': self.corretas, 'falhas': self.falhas, 'exemplos_falhas': self.exemplos_falhas}